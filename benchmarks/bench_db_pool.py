@@ -0,0 +1,123 @@
+"""
+Đo thông lượng đọc/ghi xen kẽ trên SQLite: kiểu cũ (mở kết nối mới mỗi request, rollback journal)
+so với pool kết nối WAL trong server/db.py.
+
+Chạy: python benchmarks/bench_db_pool.py --seconds 5 --writers 4 --readers 4
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import server  # noqa: E402
+from db import ConnectionPool  # noqa: E402
+from ingest import write_readings  # noqa: E402
+from partitions import range_query  # noqa: E402
+
+
+def legacy_connection(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def seed(path, rows):
+    server.DATABASE_FILE = path
+    server.init_db()
+    server.db_pool.close_all()
+    conn = sqlite3.connect(path)
+    start = datetime.now(timezone.utc) - timedelta(seconds=10 * rows)
+    write_readings(conn, [
+        {"timestamp": (start + timedelta(seconds=10 * i)).isoformat(), "chimVao": i, "temperature": 28.0, "humidity": 80.0}
+        for i in range(rows)
+    ])
+    conn.commit()
+    conn.close()
+
+
+def run(mode, path, seconds, writers, readers):
+    pool = ConnectionPool(path, max_idle=writers + readers)
+    if mode == "legacy":
+        # Trở về rollback journal cho kiểu cũ
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+    def get_conn():
+        return legacy_connection(path) if mode == "legacy" else pool.acquire()
+
+    counts = {"write": 0, "read": 0, "error": 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+    since = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    def writer(worker_id):
+        n = 0
+        while time.monotonic() < stop:
+            n += 1
+            try:
+                conn = get_conn()
+                write_readings(conn, [{"house_id": f"bench-{worker_id}", "timestamp": datetime.now(timezone.utc).isoformat(), "chimVao": n}])
+                conn.commit()
+                conn.close()
+                key = "write"
+            except sqlite3.Error:
+                key = "error"
+            with lock:
+                counts[key] += 1
+
+    def reader():
+        while time.monotonic() < stop:
+            try:
+                conn = get_conn()
+                conn.execute(*range_query(conn, "default", since)).fetchall()
+                conn.close()
+                key = "read"
+            except sqlite3.Error:
+                key = "error"
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    pool.close_all()
+    return {k: v / elapsed for k, v in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=8640, help="số bản ghi có sẵn (8640 = 1 ngày)")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("legacy", "pooled"):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            seed(path, args.rows)
+            results[mode] = run(mode, path, args.seconds, args.writers, args.readers)
+        r = results[mode]
+        print(f"{mode:>7}: ghi {r['write']:8.1f}/s  đọc {r['read']:8.1f}/s  lỗi {r['error']:6.1f}/s")
+
+    for key in ("write", "read"):
+        before = results["legacy"][key]
+        if before:
+            print(f"{key}: x{results['pooled'][key] / before:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+So sánh các cách quét cảm biến trong client/bird_counter.py trên pigpio mô phỏng (client/sim_pigpio.py):
+  poll/sequential     : vòng lặp pi.read(echo), mỗi lần đọc là một lượt socket tới pigpiod
+  callback/sequential : callback cạnh lên/xuống, độ rộng xung lấy từ tick của pigpiod
+  callback/staggered  : như trên, phát cùng lúc các cảm biến không kề nhau và chờ ECHO song song
+In số vòng quét 6 cảm biến mỗi giây, số mẫu/giây từng cảm biến, CPU mỗi vòng và sai số khoảng cách đo được.
+
+Ví dụ:
+  python benchmarks/bench_echo.py --seconds 5 --distance 40 --call-us 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client")
+
+
+# Chạy trong tiến trình con để mỗi chế độ import bird_counter với biến môi trường riêng.
+def run_mode(args):
+    sys.path.insert(0, CLIENT_DIR)
+    import sim_pigpio
+    import bird_counter
+
+    for trig, echo in zip(bird_counter.TRIG_PINS, bird_counter.ECHO_PINS):
+        sim_pigpio.attach_sensor(trig, echo, args.distance)
+    # Không tính thời gian hồi (COOLDOWN) để đo trần tốc độ quét
+    bird_counter.COOLDOWN = 0
+    bird_counter.MAX_DISTANCE = 0
+    sensor_ids = range(bird_counter.NUM_SENSORS)
+
+    errors = []
+    sweeps = 0
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    bird_counter.sweep_scheduler.report()
+    while time.perf_counter() - started < args.seconds:
+        bird_counter.sweep(sensor_ids)
+        sweeps += 1
+    report = bird_counter.sweep_scheduler.report()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    for _ in range(20):
+        dist = bird_counter.read_distance(bird_counter.TRIG_PINS[0], bird_counter.ECHO_PINS[0])
+        if dist != 999:
+            errors.append(abs(dist - args.distance))
+    bird_counter.pi.stop()
+    print(json.dumps({
+        "mode": f"{bird_counter.ECHO_MODE}/{bird_counter.SWEEP_MODE if bird_counter.ECHO_MODE == 'callback' else 'sequential'}",
+        "waves": bird_counter.sweep_scheduler.waves_for(sensor_ids),
+        "sweeps_per_s": report["sweep_rate"],
+        "sensor_rates": report["sensor_rates"],
+        "cpu_ms_per_sweep": round(cpu / sweeps * 1000, 2),
+        "cpu_percent": round(cpu / elapsed * 100, 1),
+        "mean_error_cm": round(sum(errors) / len(errors), 2) if errors else None,
+        "timeouts": 20 - len(errors),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--distance", type=float, default=40.0, help="khoảng cách mô phỏng (cm)")
+    parser.add_argument("--call-us", type=float, default=50.0, help="chi phí một lượt gọi pigpiod (micro giây)")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    results = []
+    for mode in ("poll/sequential", "callback/sequential", "callback/staggered"):
+        echo_mode, sweep_mode = mode.split("/")
+        env = dict(os.environ, SWIFTLET_PIGPIO="sim", SWIFTLET_ECHO_MODE=echo_mode, SWIFTLET_SWEEP_MODE=sweep_mode,
+                   SWIFTLET_SIM_CALL_US=str(args.call_us))
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", mode, "--seconds", str(args.seconds),
+                              "--distance", str(args.distance)], env=env, cwd=CLIENT_DIR,
+                             capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['mode']:>19}: {r['sweeps_per_s']:6.1f} vòng/s  CPU {r['cpu_ms_per_sweep']:6.2f} ms/vòng "
+              f"({r['cpu_percent']:5.1f}%)  sai số {r['mean_error_cm']} cm  timeout {r['timeouts']}")
+        print(f"{'':>19}  đợt {r['waves']}  mẫu/s từng cảm biến {r['sensor_rates']}")
+    poll = results[0]
+    for r in results[1:]:
+        print(f"{r['mode']} so với {poll['mode']}: vòng/s x{r['sweeps_per_s'] / poll['sweeps_per_s']:.2f}, "
+              f"CPU mỗi vòng ít hơn x{poll['cpu_ms_per_sweep'] / r['cpu_ms_per_sweep']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Phát lại luồng sự kiện cảm biến tổng hợp (đàn chim bay dồn dập lúc chạng vạng) qua hai thuật toán ghép:
+  legacy      : check_events cũ, quét O(n²) trên deque(maxlen=100), mỗi vòng quét ghép tối đa một lượt
+  incremental : client/event_matcher.py, ghép mọi lượt hoàn tất theo từng sự kiện
+In thông lượng (sự kiện/giây xử lý), số chim vào/ra đếm được so với số thật.
+
+Ví dụ:
+  python benchmarks/bench_matcher.py --birds-per-minute 600 --minutes 10 --phase evening
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+from event_matcher import EventMatcher  # noqa: E402
+
+NUM_SENSORS = 6
+MAX_INTERVAL = 0.34
+NEAR_SIMULTANEOUS = 0.2
+COOLDOWN = 0.045
+
+
+# Sinh sự kiện: mỗi con chim bay qua một cặp cảm biến (2g, 2g+1); bay vào chạm cảm biến chẵn trước.
+# Mỗi cảm biến báo 1..max_repeats lần liên tiếp (cách nhau COOLDOWN) khi chim lướt qua.
+def generate_events(birds_per_minute, minutes, seed, max_repeats=1):
+    rng = random.Random(seed)
+    events = []
+    truth = {"in": 0, "out": 0}
+    t = 0.0
+    end = minutes * 60
+    while True:
+        t += rng.expovariate(birds_per_minute / 60)
+        if t >= end:
+            break
+        group = rng.randrange(NUM_SENSORS // 2)
+        direction = rng.choice(("in", "out"))
+        truth[direction] += 1
+        first, second = (2 * group, 2 * group + 1) if direction == "in" else (2 * group + 1, 2 * group)
+        gap = rng.uniform(NEAR_SIMULTANEOUS + 0.01, MAX_INTERVAL - 0.02)
+        for sensor, start in ((first, t), (second, t + gap)):
+            for k in range(rng.randint(1, max_repeats)):
+                events.append((sensor, start + k * COOLDOWN))
+    events.sort(key=lambda e: e[1])
+    return events, truth
+
+
+# Thuật toán cũ trong bird_counter.check_events, giữ nguyên để so sánh.
+def legacy_check_events(event_queue, phase, counts):
+    events = list(event_queue)
+    i = 0
+    while i < len(events):
+        id1, t1 = events[i]
+        j = i + 1
+        while j < len(events):
+            id2, t2 = events[j]
+            grp1, grp2 = id1 // 2, id2 // 2
+            if id1 == id2 or abs(grp1 - grp2) > 1:
+                j += 1
+                continue
+            if abs(t1 - t2) <= MAX_INTERVAL:
+                even_time, odd_time = (t1, t2) if id1 % 2 == 0 else (t2, t1)
+                diff = abs(even_time - odd_time)
+                direction = None
+                if diff <= NEAR_SIMULTANEOUS:
+                    if phase == 'morning':
+                        direction = "out"
+                    elif phase == 'evening':
+                        direction = "in"
+                elif even_time < odd_time:
+                    direction = "in"
+                elif odd_time < even_time:
+                    direction = "out"
+                if direction is not None:
+                    counts[direction] += 1
+                    try:
+                        event_queue.remove((id1, t1))
+                        event_queue.remove((id2, t2))
+                    except ValueError:
+                        pass
+                    return
+            j += 1
+        i += 1
+
+
+# Chia sự kiện theo từng vòng quét (sweep_period giây) như run_counter, rồi gọi thuật toán ghép sau mỗi vòng.
+def replay(events, sweep_period, phase, algorithm):
+    counts = {"in": 0, "out": 0}
+    event_queue = deque(maxlen=100)
+    matcher = EventMatcher(NUM_SENSORS, MAX_INTERVAL, NEAR_SIMULTANEOUS)
+    index = 0
+    sweep_end = sweep_period
+    elapsed = 0.0
+    while index < len(events):
+        batch = []
+        while index < len(events) and events[index][1] < sweep_end:
+            batch.append(events[index])
+            index += 1
+        started = time.perf_counter()
+        if algorithm == "legacy":
+            event_queue.extend(batch)
+            legacy_check_events(event_queue, phase, counts)
+        else:
+            for direction in matcher.match(batch, phase):
+                counts[direction] += 1
+        elapsed += time.perf_counter() - started
+        sweep_end += sweep_period
+    return counts, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--birds-per-minute", type=float, default=600)
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--sweep-period", type=float, default=0.025, help="thời gian một vòng quét (giây)")
+    parser.add_argument("--phase", choices=("morning", "evening", "none"), default="evening")
+    parser.add_argument("--max-repeats", type=int, default=1, help="số lần tối đa một cảm biến báo cho cùng một con chim")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    phase = None if args.phase == "none" else args.phase
+    events, truth = generate_events(args.birds_per_minute, args.minutes, args.seed, args.max_repeats)
+    results = {"events": len(events), "truth": truth}
+    for algorithm in ("legacy", "incremental"):
+        counts, elapsed = replay(events, args.sweep_period, phase, algorithm)
+        results[algorithm] = {
+            "in": counts["in"],
+            "out": counts["out"],
+            "abs_error": abs(counts["in"] - truth["in"]) + abs(counts["out"] - truth["out"]),
+            "seconds": round(elapsed, 4),
+            "events_per_s": round(len(events) / elapsed) if elapsed else None,
+        }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(events)} sự kiện, thật: vào {truth['in']}, ra {truth['out']}")
+    for algorithm in ("legacy", "incremental"):
+        r = results[algorithm]
+        print(f"{algorithm:>11}: vào {r['in']:6d}  ra {r['out']:6d}  sai lệch {r['abs_error']:6d}  "
+              f"{r['seconds']:8.4f}s  {r['events_per_s']} sự kiện/s")
+    print(f"thông lượng: x{results['legacy']['seconds'] / results['incremental']['seconds']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+Bộ benchmark cho toàn bộ đường đi dữ liệu, chạy trên phần cứng mô phỏng (client/sim_pigpio.py, sim_dht.py,
+sim_gpio.py) và server Flask ngay trong tiến trình, xuất kết quả dạng JSON để so sánh giữa các lần chạy:
+  sweep   : tốc độ quét 6 cảm biến siêu âm ở ba chế độ (bench_echo.py)
+  matcher : thông lượng ghép sự kiện check_events (bench_matcher.py)
+  dht     : vòng lấy mẫu DHT22 và điều khiển relay trên DHT/GPIO mô phỏng
+  sender  : chi phí kênh bộ nhớ chung, hàng đợi, outbox và nén lô của send_to_server
+  ingest  : số bản ghi/giây qua /api/update (ghi trực tiếp, group commit) và /api/update_batch
+  history : độ trễ /api/historical_data khi DB có 1 ngày, 1 tháng và 1 năm dữ liệu
+
+Ví dụ:
+  python benchmarks/bench_suite.py --output results.json
+  python benchmarks/bench_suite.py --quick --baseline results.json --tolerance 0.25
+  python benchmarks/bench_suite.py --only ingest,history --json
+Với --baseline, mã thoát là 1 nếu có chỉ số xấu đi quá tolerance so với lần chạy được lưu.
+"""
+import argparse
+import contextlib
+import gzip
+import json
+import math
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.join(BENCH_DIR, "..", "client")
+SERVER_DIR = os.path.join(BENCH_DIR, "..", "server")
+SECTIONS = ("sweep", "matcher", "dht", "sender", "ingest", "history")
+# Kích thước dữ liệu (số ngày) cho phần history
+HISTORY_SIZES = {"day": 1, "month": 30, "year": 365}
+HISTORY_QUERIES = {
+    "day": {"range": "day"},
+    "week": {"range": "week"},
+    "month": {"range": "month"},
+    "month_raw": {"range": "month", "resolution": "raw", "max_points": 2000},
+}
+GMT7 = timezone(timedelta(hours=7))
+
+os.environ.setdefault("SWIFTLET_PIGPIO", "sim")
+os.environ.setdefault("SWIFTLET_DHT", "sim")
+sys.path.insert(0, CLIENT_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+
+class Results:
+    """Danh sách chỉ số: tên, giá trị, đơn vị và chiều tốt hơn (higher/lower) để so với lần chạy trước."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, name, value, unit, better):
+        if value is not None:
+            value = round(value, 4)
+        self.metrics.append({"name": name, "value": value, "unit": unit, "better": better})
+        print(f"  {name:<48} {value!s:>12} {unit}", file=sys.stderr)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(math.ceil(p / 100 * len(values))) - 1)]
+
+
+def run_json(script, *script_args):
+    out = subprocess.run([sys.executable, os.path.join(BENCH_DIR, script), "--json", *script_args],
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out)
+
+
+def bench_sweep(results, args):
+    for r in run_json("bench_echo.py", "--seconds", str(args.seconds)):
+        results.add(f"sweep.{r['mode']}.sweeps_per_s", r["sweeps_per_s"], "vòng/s", "higher")
+        results.add(f"sweep.{r['mode']}.cpu_ms_per_sweep", r["cpu_ms_per_sweep"], "ms", "lower")
+
+
+def bench_matcher(results, args):
+    r = run_json("bench_matcher.py", "--minutes", str(2 if args.quick else 10))
+    for algorithm in ("legacy", "incremental"):
+        results.add(f"matcher.{algorithm}.events_per_s", r[algorithm]["events_per_s"], "sự kiện/s", "higher")
+        results.add(f"matcher.{algorithm}.abs_error", r[algorithm]["abs_error"], "chim", "lower")
+
+
+# Lấy mẫu DHT22 liên tục (không nghỉ 2 giây) ở luồng nền trong khi luồng chính chạy vòng điều khiển relay
+# không ngủ, để đo chi phí mỗi nhịp relay và số mẫu lọc được mỗi giây.
+def bench_dht(results, args):
+    import sim_dht
+    import sim_gpio
+    import dht
+
+    sim_dht.ERROR_RATE = 0.1
+    # Độ ẩm dao động qua hai ngưỡng để relay bật/tắt
+    sim_dht.set_climate(28.0, lambda now: 80.5 + 3 * math.sin(now * 2))
+    dht.RELAY_MIN_ON = dht.RELAY_MIN_OFF = 0
+    dht.setup_relay()
+    device = sim_dht.DHT22(sim_dht.board.D4)
+    sampler = dht.DHTSampler(device, interval=0)
+    sampler.start()
+    ticks = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.seconds:
+        reading = sampler.latest()
+        if reading is not None:
+            dht.control_relay(reading[2])
+        ticks += 1
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+    results.add("dht.relay_tick_us", elapsed / ticks * 1e6, "µs", "lower")
+    results.add("dht.samples_per_s", sampler.version / elapsed, "mẫu/s", "higher")
+    results.add("dht.error_rate", sampler.errors / max(sampler.reads, 1), "", "lower")
+    results.add("dht.relay_switches", sim_gpio.changes.get(dht.RELAY_GPIO_PIN, 0), "lần", None)
+
+
+def _echo_queue(inbox, outbox):
+    for item in iter(inbox.get, None):
+        outbox.put(item)
+
+
+def bench_sender(results, args):
+    from latest_channel import counter_channel
+    from outbox import Outbox
+    import send_to_server
+
+    n = 20000 if args.quick else 100000
+    channel = counter_channel()
+    try:
+        started = time.perf_counter()
+        for i in range(n):
+            channel.publish({"chimVao": i, "chimRa": i, "chimTong": i})
+            channel.read()
+        results.add("sender.latest_channel_publish_read_us", (time.perf_counter() - started) / n * 1e6, "µs", "lower")
+    finally:
+        channel.close()
+        channel.unlink()
+
+    # Tham chiếu: một vòng put/get qua multiprocessing.Queue sang tiến trình khác và quay lại
+    inbox, replies = multiprocessing.Queue(), multiprocessing.Queue()
+    worker = multiprocessing.Process(target=_echo_queue, args=(inbox, replies), daemon=True)
+    worker.start()
+    rounds = 2000
+    started = time.perf_counter()
+    for i in range(rounds):
+        inbox.put({"chimVao": i, "chimRa": i, "chimTong": i})
+        replies.get()
+    results.add("sender.mp_queue_roundtrip_us", (time.perf_counter() - started) / rounds * 1e6, "µs", "lower")
+    inbox.put(None)
+    worker.join(timeout=5)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = Outbox(os.path.join(tmp, "outbox.db"))
+        rows = send_to_server.BATCH_SIZE
+        last = None
+        queued = 0
+        started = time.perf_counter()
+        for i in range(rows):
+            payload = {"house_id": "bench", "chimVao": i // 3, "chimRa": i // 5, "chimTong": 100 + i // 3 - i // 5,
+                       "temperature": 28.0 + (i % 7) / 10, "humidity": 80.0, "relay_status": i // 50 % 2,
+                       "timestamp": datetime.now(GMT7).isoformat(timespec='milliseconds')}
+            item = send_to_server.live_payload(payload, last, i % 30 == 0)
+            if item is not None:
+                outbox.add(item)
+                queued += 1
+                last = payload
+        results.add("sender.outbox_add_us", (time.perf_counter() - started) / rows * 1e6, "µs", "lower")
+        started = time.perf_counter()
+        batch = outbox.next_batch(rows)
+        body = json.dumps([payload for _, payload in batch], separators=(",", ":")).encode()
+        compressed = gzip.compress(body)
+        results.add("sender.batch_encode_ms", (time.perf_counter() - started) * 1000, "ms", "lower")
+        results.add("sender.batch_gzip_ratio", len(body) / len(compressed), "x", "higher")
+        results.add("sender.delta_bytes_per_row", len(compressed) / max(queued, 1), "byte", "lower")
+        outbox.close()
+
+
+def _setup_server(db_path):
+    import server
+    from ingest import WriteCoalescer
+    from ring_cache import RingCache
+
+    server.DATABASE_FILE = db_path
+    server.RETENTION_ENABLED = False
+    server.LATEST_SYNC_ENABLED = False
+    server.write_coalescer = WriteCoalescer(server.get_writer_connection, linger=server.INGEST_LINGER,
+                                            max_batch=server.INGEST_MAX_BATCH)
+    server.ring_cache = RingCache(hours=server.RING_CACHE_HOURS)
+    server.init_db()
+    server.load_latest_data_from_db()
+    return server
+
+
+def _reading(house_id, when, i):
+    return {"house_id": house_id, "timestamp": when.astimezone(GMT7).isoformat(timespec='milliseconds'),
+            "chimVao": i // 4, "chimRa": i // 6, "chimTong": 500 + i // 4 - i // 6,
+            "temperature": round(28 + 2 * math.sin(i / 500), 1), "humidity": round(80 + 3 * math.sin(i / 300), 1),
+            "relay_status": i // 40 % 2}
+
+
+# Nhiều nhà yến gửi đồng thời (mỗi luồng một test client), đo số bản ghi/giây và độ trễ mỗi request.
+def _post_concurrently(server, threads, per_thread):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n):
+        client = server.app.test_client()
+        mine = []
+        for i in range(per_thread):
+            data = _reading(f"house-{n}", datetime.now(timezone.utc), i)
+            started = time.perf_counter()
+            client.post("/api/update", json=data)
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return threads * per_thread / (time.perf_counter() - started), latencies
+
+
+def bench_ingest(results, args):
+    threads = 8
+    per_thread = 50 if args.quick else 200
+    with tempfile.TemporaryDirectory() as tmp:
+        server = _setup_server(os.path.join(tmp, "ingest.db"))
+        for mode, coalesce in (("direct", False), ("coalesced", True)):
+            server.INGEST_COALESCE = coalesce
+            rate, latencies = _post_concurrently(server, threads, per_thread)
+            results.add(f"ingest.update_{mode}.rows_per_s", rate, "bản ghi/s", "higher")
+            results.add(f"ingest.update_{mode}.p95_ms", percentile(latencies, 95) * 1000, "ms", "lower")
+        client = server.app.test_client()
+        size = 500
+        base = datetime.now(timezone.utc) - timedelta(days=1)
+        started = time.perf_counter()
+        for b in range(10):
+            client.post("/api/update_batch", json=[_reading("batch", base + timedelta(seconds=10 * (b * size + i)),
+                                                            b * size + i) for i in range(size)])
+        results.add("ingest.update_batch.rows_per_s", 10 * size / (time.perf_counter() - started), "bản ghi/s",
+                    "higher")
+        server.db_pool.close_all()
+
+
+# Ghi days ngày dữ liệu (mỗi interval giây một bản ghi, kết thúc ở hiện tại) qua write_readings như /api/update_batch.
+def seed_history(server, days, interval):
+    from ingest import write_readings
+
+    conn = server.get_writer_connection()
+    now = datetime.now(timezone.utc)
+    total = int(days * 86400 / interval)
+    chunk = []
+    for i in range(total):
+        chunk.append(_reading("bench", now - timedelta(seconds=(total - i) * interval), i))
+        if len(chunk) == 5000 or i == total - 1:
+            write_readings(conn, chunk)
+            conn.commit()
+            chunk = []
+    conn.close()
+    return total
+
+
+def bench_history(results, args):
+    interval = 300 if args.quick else 60
+    repeats = 5 if args.quick else 20
+    for size, days in HISTORY_SIZES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            server = _setup_server(os.path.join(tmp, f"history_{size}.db"))
+            started = time.perf_counter()
+            rows = seed_history(server, days, interval)
+            print(f"  (history.{size}: {rows} bản ghi, nạp {time.perf_counter() - started:.1f}s)", file=sys.stderr)
+            client = server.app.test_client()
+            for name, params in HISTORY_QUERIES.items():
+                params = dict(params, house_id="bench")
+                started = time.perf_counter()
+                response = client.get("/api/historical_data", query_string=params)
+                cold = time.perf_counter() - started
+                latencies = []
+                for _ in range(repeats):
+                    started = time.perf_counter()
+                    client.get("/api/historical_data", query_string=params)
+                    latencies.append(time.perf_counter() - started)
+                prefix = f"history.{size}.{name}"
+                results.add(f"{prefix}.cold_ms", cold * 1000, "ms", "lower")
+                results.add(f"{prefix}.p50_ms", statistics.median(latencies) * 1000, "ms", "lower")
+                results.add(f"{prefix}.p95_ms", percentile(latencies, 95) * 1000, "ms", "lower")
+                results.add(f"{prefix}.bytes", len(response.get_data()), "byte", None)
+            server.db_pool.close_all()
+
+
+# So với lần chạy trước: trả về danh sách (tên, cũ, mới) các chỉ số xấu đi quá tolerance.
+def compare(baseline, metrics, tolerance):
+    previous = {m["name"]: m for m in baseline["metrics"]}
+    regressions = []
+    for metric in metrics:
+        old = previous.get(metric["name"])
+        if old is None or not metric["better"] or old["value"] in (None, 0) or metric["value"] is None:
+            continue
+        ratio = metric["value"] / old["value"]
+        if (metric["better"] == "higher" and ratio < 1 - tolerance) or \
+                (metric["better"] == "lower" and ratio > 1 + tolerance):
+            regressions.append((metric["name"], old["value"], metric["value"]))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help=f"chỉ chạy các phần (phân cách bằng dấu phẩy): {','.join(SECTIONS)}")
+    parser.add_argument("--seconds", type=float, default=3.0, help="thời gian đo mỗi chế độ quét và vòng DHT")
+    parser.add_argument("--quick", action="store_true", help="ít dữ liệu hơn (một bản ghi mỗi 5 phút cho history)")
+    parser.add_argument("--output", help="ghi kết quả JSON vào tệp này")
+    parser.add_argument("--json", action="store_true", help="in kết quả JSON ra stdout")
+    parser.add_argument("--baseline", help="tệp JSON của lần chạy trước để so sánh")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="mức xấu đi cho phép (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    sections = args.only.split(",") if args.only else SECTIONS
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"không có phần: {', '.join(sorted(unknown))}")
+
+    results = Results()
+    started = time.time()
+    # Log của server/client (print) ra stderr để stdout chỉ còn JSON khi dùng --json
+    with contextlib.redirect_stdout(sys.stderr):
+        for section in sections:
+            print(f"{section}:")
+            globals()[f"bench_{section}"](results, args)
+
+    document = {
+        "meta": {
+            "started_at": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+            "duration_seconds": round(time.time() - started, 1),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "sections": list(sections),
+            "quick": args.quick,
+        },
+        "metrics": results.metrics,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(document, indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(json.load(f), results.metrics, args.tolerance)
+        for name, old, new in regressions:
+            print(f"XẤU ĐI: {name}: {old} -> {new}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"Không có chỉ số nào xấu đi quá {args.tolerance:.0%} so với {args.baseline}.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Tạo tải cục bộ cho server: N nhà yến gửi POST /api/update, M dashboard đọc /api/data và /api/historical_data.
+Chế độ --ramp tăng dần số nhà yến cho đến khi p95 vượt ngưỡng hoặc tỉ lệ lỗi vượt 1%, để đo trần đồng thời.
+
+Ví dụ:
+  cd server && gunicorn -c gunicorn.conf.py wsgi:app
+  python benchmarks/loadtest.py --url http://127.0.0.1:5000 --houses 200 --dashboards 20 --seconds 30
+  python benchmarks/loadtest.py --ramp 50,100,200,400,800 --interval 1 --seconds 15
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+GMT7 = timezone(timedelta(hours=7))
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(name, []).append(seconds)
+            else:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed):
+        result = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(name, []))
+            errors = self.errors.get(name, 0)
+            total = len(values) + errors
+            result[name] = {
+                "requests": total,
+                "rate_per_s": round(total / elapsed, 1),
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "mean_ms": round(statistics.fmean(values) * 1000, 1) if values else 0.0,
+            }
+        return result
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def timed(session, stats, name, method, url, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=10, **kwargs)
+        ok = response.status_code in (200, 304)
+    except requests.RequestException:
+        ok = False
+    stats.record(name, time.perf_counter() - started, ok)
+
+
+def house_worker(base_url, house_id, interval, stop, stats):
+    session = requests.Session()
+    chim_tong = 100
+    # Lệch pha ngẫu nhiên giữa các nhà để không gửi dồn cùng lúc
+    time.sleep((hash(house_id) % 1000) / 1000 * interval)
+    while time.monotonic() < stop:
+        started = time.monotonic()
+        chim_tong += 1
+        payload = {
+            "house_id": house_id,
+            "timestamp": datetime.now(timezone.utc).astimezone(GMT7).isoformat(),
+            "chimVao": chim_tong, "chimRa": 0, "chimTong": chim_tong,
+            "temperature": 28.5, "humidity": 80.1, "relay_status": 0,
+        }
+        timed(session, stats, "POST /api/update", "POST", f"{base_url}/api/update", json=payload)
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def dashboard_worker(base_url, house_id, interval, history_every, stop, stats):
+    session = requests.Session()
+    n = 0
+    while time.monotonic() < stop:
+        started = time.monotonic()
+        timed(session, stats, "GET /api/data", "GET", f"{base_url}/api/data", params={"house_id": house_id})
+        if n % history_every == 0:
+            timed(session, stats, "GET /api/historical_data", "GET", f"{base_url}/api/historical_data",
+                  params={"house_id": house_id, "range": "day", "max_points": 1000, "format": "columns"})
+        n += 1
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def run_stage(args, houses, dashboards):
+    stats = Stats()
+    stop = time.monotonic() + args.seconds
+    threads = [
+        threading.Thread(target=house_worker, args=(args.url, f"load-{i}", args.interval, stop, stats), daemon=True)
+        for i in range(houses)
+    ]
+    threads += [
+        threading.Thread(target=dashboard_worker,
+                         args=(args.url, f"load-{i % max(houses, 1)}", args.dashboard_interval, args.history_every, stop, stats),
+                         daemon=True)
+        for i in range(dashboards)
+    ]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return stats.summary(time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--houses", type=int, default=100)
+    parser.add_argument("--dashboards", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=10.0, help="chu kỳ gửi của mỗi nhà yến (giây)")
+    parser.add_argument("--dashboard-interval", type=float, default=5.0)
+    parser.add_argument("--history-every", type=int, default=12, help="dashboard tải lịch sử sau mỗi n lần đọc")
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--ramp", help="danh sách số nhà yến cho từng giai đoạn, ví dụ 50,100,200")
+    parser.add_argument("--p95-limit-ms", type=float, default=500.0)
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    stages = [int(x) for x in args.ramp.split(",")] if args.ramp else [args.houses]
+    results = []
+    for houses in stages:
+        summary = run_stage(args, houses, args.dashboards)
+        ingest = summary.get("POST /api/update", {})
+        results.append({"houses": houses, "dashboards": args.dashboards, "routes": summary})
+        if not args.json:
+            print(f"--- {houses} nhà yến, {args.dashboards} dashboard, {args.seconds:.0f}s ---")
+            for name, r in summary.items():
+                print(f"{name:28s} {r['rate_per_s']:8.1f}/s  p50 {r['p50_ms']:7.1f}ms  p95 {r['p95_ms']:7.1f}ms  "
+                      f"p99 {r['p99_ms']:7.1f}ms  lỗi {r['error_rate'] * 100:5.2f}%")
+        if args.ramp and (ingest.get("p95_ms", 0) > args.p95_limit_ms or ingest.get("error_rate", 0) > 0.01):
+            if not args.json:
+                print(f"Đã chạm trần ở {houses} nhà yến (p95 > {args.p95_limit_ms}ms hoặc lỗi > 1%).")
+            break
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
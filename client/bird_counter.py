@@ -1,8 +1,25 @@
-import pigpio
+import os
+import threading
 import time
 from collections import deque
 from multiprocessing import Queue
-from datetime import date
+from datetime import date, datetime
+
+import flight_phase
+from checkpoint import CounterCheckpoint
+from config_client import ConfigWatcher, apply_to_module
+from event_matcher import EventMatcher
+from flight_phase import get_time_phase
+from latest_channel import counter_channel
+from recorder import EventRecorder
+from server_api import fetch_latest
+
+# SWIFTLET_PIGPIO=sim dùng pigpio mô phỏng (sim_pigpio.py) để chạy/đo trên máy không có Pi
+PIGPIO_BACKEND = os.environ.get("SWIFTLET_PIGPIO", "pigpio")
+if PIGPIO_BACKEND == "sim":
+    import sim_pigpio as pigpio
+else:
+    import pigpio
 
 # --- Cấu hình cảm biến ---
 TRIG_PINS = [2, 17, 22, 24, 5, 16]
@@ -13,14 +30,31 @@ MIN_DISTANCE = 2
 MAX_DISTANCE = 89
 MAX_INTERVAL = 0.34
 COOLDOWN = 0.045
+SENSOR_GAP = 0.0065   # nghỉ giữa hai cảm biến để tiếng vọng cũ tắt hẳn
+ECHO_TIMEOUT_US = 20000
+
+# "callback": đo độ rộng xung ECHO bằng callback cạnh của pigpiod (tick phần cứng, không tốn CPU chờ)
+# "poll": cách cũ, đọc liên tục pi.read(echo) trong vòng lặp
+ECHO_MODE = os.environ.get("SWIFTLET_ECHO_MODE", "callback")
+# "staggered": phát đồng thời các cảm biến thuộc hai nhóm không kề nhau (id//2 cách nhau > 1) và chờ ECHO song song
+# "sequential": từng cảm biến một. Chế độ "poll" luôn chạy tuần tự.
+SWEEP_MODE = os.environ.get("SWIFTLET_SWEEP_MODE", "staggered")
+SWEEP_REPORT_INTERVAL = 60
+# Thư mục ghi mẫu khoảng cách để phát lại offline bằng replay.py (không đặt = không ghi)
+RECORD_DIR = os.environ.get("SWIFTLET_RECORD_DIR")
+# File lưu số đếm để khởi động lại không mất; bản lưu cũ hơn CHECKPOINT_STALE_AFTER giây thì hỏi lại server
+CHECKPOINT_FILE = os.environ.get("SWIFTLET_CHECKPOINT", "counters.json")
+CHECKPOINT_STALE_AFTER = 600
 
-MORNING_START     = 4    # 4h–10h chim thường bay ra
-MORNING_END       = 10
-EVENING_START     = 15   # 15h–20h chim thường bay vào
-EVENING_END       = 20
 NEAR_SIMULTANEOUS = 0.2 # t <= 24ms
 
+# Tham số cấu hình từ server (/api/config) -> biến của module này; đổi được khi đang chạy
+CONFIG_KEYS = {"min_distance": "MIN_DISTANCE", "max_distance": "MAX_DISTANCE", "max_interval": "MAX_INTERVAL",
+               "cooldown": "COOLDOWN", "near_simultaneous": "NEAR_SIMULTANEOUS"}
+
 event_queue = deque(maxlen=100)
+event_matcher = EventMatcher(NUM_SENSORS, MAX_INTERVAL, NEAR_SIMULTANEOUS)
+recorder = EventRecorder(RECORD_DIR) if RECORD_DIR else None
 last_active = [0] * NUM_SENSORS
 chimTong = 9
 chimVao  = 10
@@ -39,11 +73,73 @@ for i in range(NUM_SENSORS):
     pi.set_mode(TRIG_PINS[i], pigpio.OUTPUT)
     pi.set_mode(ECHO_PINS[i], pigpio.INPUT)
     pi.write(TRIG_PINS[i], 0)
+    if PIGPIO_BACKEND == "sim":
+        pigpio.attach_sensor(TRIG_PINS[i], ECHO_PINS[i])
+
+
+class EchoTimer:
+    """Đo độ rộng xung ECHO từ tick phần cứng mà pigpiod gắn cho cạnh lên và cạnh xuống."""
+
+    def __init__(self, echo):
+        self._rise_tick = None
+        self._width_us = None
+        self.echo_time = None
+        self._done = threading.Event()
+        self._cb = pi.callback(echo, pigpio.EITHER_EDGE, self._edge)
+
+    def _edge(self, gpio, level, tick):
+        if level == 1:
+            self._rise_tick = tick
+        elif level == 0 and self._rise_tick is not None:
+            self._width_us = pigpio.tickDiff(self._rise_tick, tick)
+            self._rise_tick = None
+            # Thời điểm nhận ECHO, dùng làm mốc sự kiện thay cho lúc vòng quét xử lý xong
+            self.echo_time = time.time()
+            self._done.set()
+
+    def trigger(self, trig):
+        self._width_us = None
+        self._rise_tick = None
+        self._done.clear()
+        # Một lệnh gpio_trigger thay cho write/sleep/write
+        pi.gpio_trigger(trig, 10, 1)
+
+    def wait(self, timeout):
+        if not self._done.wait(timeout):
+            return None
+        return self._width_us
+
+    def measure(self, trig):
+        self.trigger(trig)
+        return self.wait(ECHO_TIMEOUT_US / 1e6)
+
+    def cancel(self):
+        self._cb.cancel()
+
+
+echo_timers = {}
+if ECHO_MODE == "callback":
+    for echo_pin in ECHO_PINS:
+        echo_timers[echo_pin] = EchoTimer(echo_pin)
 
 time.sleep(1) 
 
 # Đọc khoảng cách
 def read_distance(trig, echo):
+    if ECHO_MODE == "callback":
+        return read_distance_callback(trig, echo)
+    return read_distance_poll(trig, echo)
+
+def read_distance_callback(trig, echo):
+    return width_to_distance(echo_timers[echo].measure(trig))
+
+def width_to_distance(width_us):
+    if width_us is None:
+        return 999
+    distance = (width_us / 1e6 * 34300) / 2
+    return distance if 0 < distance < 130 else 999
+
+def read_distance_poll(trig, echo):
     # Phát tín hiệu TRIG
     pi.write(trig, 1)
     time.sleep(0.00001) 
@@ -76,75 +172,181 @@ def enqueue(sensor_id, timestamp):
 
 def check_events(phase):
     global chimTong, chimVao, chimRa
-    events = list(event_queue)
-
-    i = 0
-    while i < len(events):
-        id1, t1 = events[i]
-        j = i + 1
-        while j < len(events):
-            id2, t2 = events[j]
-
-            # chỉ xét cùng cặp hoặc nhóm kề nhau 
-            grp1, grp2 = id1//2, id2//2
-            if id1 == id2 or abs(grp1 - grp2) > 1:
-                j += 1
-                continue
-
-            if abs(t1 - t2) <= MAX_INTERVAL:
-                even_time, odd_time = (t1, t2) if id1%2==0 else (t2, t1)
-                diff = abs(even_time - odd_time)
-                action_taken = False
-
-                # Gần như đồng thời -> dùng phase
-                if diff <= NEAR_SIMULTANEOUS:
-                    if phase == 'morning':
-                        # chim ra
-                        chimTong = max(0, chimTong-1)
-                        chimRa += 1
-                        action_taken = True
-                    elif phase == 'evening':
-                        # chim vào
-                        chimTong += 1
-                        chimVao += 1
-                        action_taken = True
-                # không gần -> logic gốc
-                else:
-                    if even_time < odd_time:
-                        chimTong += 1
-                        chimVao += 1
-                        action_taken = True
-                    elif odd_time < even_time:
-                        chimTong = max(0, chimTong-1)
-                        chimRa += 1
-                        action_taken = True
-
-                if action_taken:
-                    # xóa sự kiện đã xử lý
-                    try:
-                        event_queue.remove((id1, t1))
-                        event_queue.remove((id2, t2))
-                    except ValueError:
-                        pass
-                    return
-
-            j += 1
-        i += 1
+    # Lấy hết sự kiện mới của vòng quét và ghép ngay mọi lượt bay hoàn tất
+    events = []
+    while event_queue:
+        events.append(event_queue.popleft())
+    for direction in event_matcher.match(events, phase):
+        if direction == "in":
+            chimTong += 1
+            chimVao += 1
+        else:
+            chimTong = max(0, chimTong-1)
+            chimRa += 1
 
 
 def get_chim_tong():
     return chimTong
 
-def get_time_phase():
-    h = time.localtime().tm_hour
-    if MORNING_START <= h < MORNING_END:
-        return 'morning'
-    elif EVENING_START <= h < EVENING_END:
-        return 'evening'
-    return None
+# Chia các cảm biến (theo thứ tự quét) thành các đợt phát cùng lúc: hai cảm biến chỉ chung đợt khi
+# nhóm id//2 của chúng cách nhau hơn 1, để tiếng vọng của cặp này không lọt vào cặp bên cạnh.
+def build_waves(sensor_ids):
+    waves = []
+    for i in sensor_ids:
+        for wave in waves:
+            if all(abs(i // 2 - j // 2) > 1 for j in wave):
+                wave.append(i)
+                break
+        else:
+            waves.append([i])
+    return waves
 
-def run_counter(queue):
+
+class SweepScheduler:
+    """
+    Quét các cảm biến theo từng đợt. Ở chế độ callback, cả đợt được phát TRIG cùng lúc và chờ ECHO song song;
+    khoảng nghỉ SENSOR_GAP giữa hai đợt tính từ lúc phát nên thời gian chờ ECHO nằm gọn trong đó.
+    Định kỳ ghi lại tốc độ quét thực tế (vòng/s), thời gian mỗi vòng, số mẫu mỗi giây của từng cảm biến,
+    và công bố chúng (cùng số lần hết giờ chờ ECHO) lên kênh metrics nếu có.
+    """
+
+    def __init__(self):
+        self._waves = {}
+        self.sweeps = 0
+        self.samples = [0] * NUM_SENSORS
+        self.sweep_seconds = 0.0
+        self.sweep_seconds_max = 0.0
+        self.queue_peak = 0
+        self.echo_timeouts = 0
+        self.metrics = None
+        self.last_report = None
+        self._window_start = time.monotonic()
+
+    def waves_for(self, sensor_ids):
+        key = tuple(sensor_ids)
+        if key not in self._waves:
+            if ECHO_MODE == "callback" and SWEEP_MODE == "staggered":
+                self._waves[key] = build_waves(key)
+            else:
+                self._waves[key] = [[i] for i in key]
+        return self._waves[key]
+
+    def _measure_wave(self, wave):
+        if ECHO_MODE != "callback":
+            return [(i, read_distance(TRIG_PINS[i], ECHO_PINS[i]), None) for i in wave]
+        timers = [echo_timers[ECHO_PINS[i]] for i in wave]
+        for i, timer in zip(wave, timers):
+            timer.trigger(TRIG_PINS[i])
+        deadline = time.monotonic() + ECHO_TIMEOUT_US / 1e6
+        return [(i, width_to_distance(timer.wait(max(0.0, deadline - time.monotonic()))), timer.echo_time)
+                for i, timer in zip(wave, timers)]
+
+    def sweep(self, sensor_ids):
+        started = time.monotonic()
+        waves = self.waves_for(sensor_ids)
+        for n, wave in enumerate(waves):
+            now = time.time()
+            active = [i for i in wave if now - last_active[i] >= COOLDOWN]
+            triggered = time.monotonic()
+            if active:
+                for i, dist, echo_time in self._measure_wave(active):
+                    self.samples[i] += 1
+                    if dist == 999:
+                        self.echo_timeouts += 1
+                    is_event = MIN_DISTANCE < dist < MAX_DISTANCE
+                    if recorder is not None and dist != 999:
+                        recorder.record(echo_time or time.time(), i, dist, is_event)
+                    if is_event:
+                        enqueue(i, echo_time or time.time())
+                        last_active[i] = time.time()
+            if n != len(waves) - 1:
+                if ECHO_MODE == "callback":
+                    # Khoảng nghỉ tính từ lúc phát TRIG, thời gian chờ ECHO đã nằm trong đó
+                    time.sleep(max(0.0, SENSOR_GAP - (time.monotonic() - triggered)))
+                elif active:
+                    time.sleep(SENSOR_GAP)
+        self.sweeps += 1
+        duration = time.monotonic() - started
+        self.sweep_seconds += duration
+        self.sweep_seconds_max = max(self.sweep_seconds_max, duration)
+        self.queue_peak = max(self.queue_peak, len(event_queue))
+        if time.monotonic() - self._window_start >= SWEEP_REPORT_INTERVAL:
+            self.report()
+
+    # Tốc độ quét và số mẫu/giây từng cảm biến kể từ lần báo cáo trước.
+    def report(self):
+        elapsed = max(time.monotonic() - self._window_start, 1e-9)
+        self.last_report = {
+            "sweep_rate": round(self.sweeps / elapsed, 1),
+            "sensor_rates": [round(n / elapsed, 1) for n in self.samples],
+            "sweep_seconds_avg": round(self.sweep_seconds / self.sweeps, 4) if self.sweeps else None,
+            "sweep_seconds_max": round(self.sweep_seconds_max, 4),
+            "echo_timeouts_total": self.echo_timeouts,
+            "event_queue_depth": self.queue_peak,
+        }
+        print(f"COUNTER: {self.last_report['sweep_rate']} vòng/s, mẫu/s từng cảm biến: {self.last_report['sensor_rates']}")
+        if self.metrics is not None:
+            self.metrics.publish(self.last_report)
+        self.sweeps = 0
+        self.samples = [0] * NUM_SENSORS
+        self.sweep_seconds = 0.0
+        self.sweep_seconds_max = 0.0
+        self.queue_peak = 0
+        self._window_start = time.monotonic()
+        return self.last_report
+
+
+sweep_scheduler = SweepScheduler()
+
+def sweep(sensor_ids):
+    sweep_scheduler.sweep(sensor_ids)
+
+# counters: kênh LatestChannel cho số đếm hiện tại; daily_queue: hàng đợi tin cậy chỉ cho báo cáo hàng ngày.
+def counter_state():
+    return {"chimVao": chimVao, "chimRa": chimRa, "chimTong": chimTong,
+            "last_reset_date": _last_reset_date.isoformat()}
+
+# Khôi phục số đếm từ checkpoint. Nếu không có hoặc đã cũ (Pi tắt lâu, thẻ SD mới) thì lấy giá trị mới nhất
+# server đã nhận khi giá trị đó mới hơn checkpoint (chimVao/chimRa của server là số đếm trong ngày của timestamp đó).
+def restore_counters(checkpoint, fetch_latest=None):
     global chimTong, chimVao, chimRa, _last_reset_date
+    state = checkpoint.load()
+    saved_at = state["saved_at"] if state else 0
+    if time.time() - saved_at > CHECKPOINT_STALE_AFTER and fetch_latest is not None:
+        remote = fetch_latest()
+        try:
+            # Server trả timestamp dạng ...Z; fromisoformat trước Python 3.11 không hiểu "Z"
+            remote_time = datetime.fromisoformat(remote["timestamp"].replace("Z", "+00:00"))
+            if remote_time.timestamp() > saved_at:
+                state = {"chimVao": remote["chimVao"], "chimRa": remote["chimRa"], "chimTong": remote["chimTong"],
+                         "last_reset_date": remote_time.date().isoformat(), "saved_at": remote_time.timestamp()}
+                print(f"COUNTER: Checkpoint cũ hoặc không có, lấy số đếm từ server ({remote['timestamp']}).")
+        except (TypeError, KeyError, ValueError, AttributeError):
+            pass
+    if state is None:
+        return False
+    chimTong, chimVao, chimRa = state["chimTong"], state["chimVao"], state["chimRa"]
+    _last_reset_date = date.fromisoformat(state["last_reset_date"])
+    print(f"COUNTER: Khôi phục chimTong={chimTong}, chimVao={chimVao}, chimRa={chimRa} ngày {_last_reset_date}.")
+    checkpoint.save(counter_state(), force=True)
+    return True
+
+# Áp dụng cấu hình mới (ngưỡng đếm, khung giờ bay) ngay trong tiến trình đang chạy.
+def apply_config(config):
+    changed = apply_to_module(globals(), CONFIG_KEYS, config)
+    changed += flight_phase.apply_config(config)
+    event_matcher.max_interval = MAX_INTERVAL
+    event_matcher.near_simultaneous = NEAR_SIMULTANEOUS
+    return changed
+
+# metrics: kênh LatestChannel (tùy chọn) cho số liệu vận hành, gửi kèm bản ghi đầy đủ lên server.
+def run_counter(counters, daily_queue, metrics=None):
+    global chimTong, chimVao, chimRa, _last_reset_date
+    published = None
+    sweep_scheduler.metrics = metrics
+    checkpoint = CounterCheckpoint(CHECKPOINT_FILE)
+    restore_counters(checkpoint, fetch_latest)
+    config_watcher = ConfigWatcher()
     try:
         while True:
             today = date.today()
@@ -154,8 +356,8 @@ def run_counter(queue):
                 daily_ra    = chimRa
                 daily_tong  = chimTong
                 # gửi gói 
-                if queue:
-                    queue.put({
+                if daily_queue:
+                    daily_queue.put({
                         "chimVao":       chimVao,
                         "chimRa":        chimRa,
                         "chimTong":      chimTong,
@@ -169,6 +371,7 @@ def run_counter(queue):
                 chimVao = 0
                 chimRa  = 0
                 _last_reset_date = today
+                checkpoint.save(counter_state(), force=True)
 
             phase = get_time_phase()     
             now   = time.time()
@@ -178,28 +381,35 @@ def run_counter(queue):
             else:
                 sensor_ids = range(NUM_SENSORS)
 
-            for i in sensor_ids:
-                if time.time() - last_active[i] < COOLDOWN:
-                    continue
-                dist = read_distance(TRIG_PINS[i], ECHO_PINS[i])
-                if MIN_DISTANCE < dist < MAX_DISTANCE:
-                    enqueue(i, time.time())
-                    last_active[i] = time.time()
-                if i != sensor_ids[-1]:
-                    time.sleep(0.0065)
-
+            sweep(sensor_ids)
             check_events(phase)
-            # Gửi thường xuyên ba biến chính
-            if queue:
-                queue.put({
-                    "chimVao":  chimVao,
-                    "chimRa":   chimRa,
-                    "chimTong": chimTong
-                })
-            time.sleep(0.0065)
+            # Cập nhật ba biến chính vào bộ nhớ chung khi có thay đổi (không pickle, không xếp hàng)
+            current = (chimVao, chimRa, chimTong)
+            if current != published:
+                if counters:
+                    counters.publish({"chimVao": chimVao, "chimRa": chimRa, "chimTong": chimTong})
+                checkpoint.save(counter_state())
+                published = current
+            checkpoint.poll()
+            update = config_watcher.poll()
+            if update is not None:
+                changed = apply_config(update["config"])
+                if changed:
+                    print(f"COUNTER: Áp dụng cấu hình phiên bản {update['version']}: {', '.join(changed)}")
+            time.sleep(SENSOR_GAP)
     finally:
+        checkpoint.flush()
+        if recorder is not None:
+            recorder.close()
+        for timer in echo_timers.values():
+            timer.cancel()
         pi.stop()
 
 if __name__ == "__main__":
-    queue = Queue()
-    run_counter(queue)
\ No newline at end of file
+    daily_queue = Queue()
+    counters = counter_channel()
+    try:
+        run_counter(counters, daily_queue)
+    finally:
+        counters.close()
+        counters.unlink()
\ No newline at end of file
@@ -0,0 +1,39 @@
+# Khoảng gửi (giây) theo mức hoạt động
+FAST_INTERVAL = 0.5        # số đếm vừa thay đổi: chim đang qua lại
+PEAK_INTERVAL = 1.0        # trong khung giờ bay sáng/chiều
+BASE_INTERVAL = 10         # ngoài khung giờ bay, có thay đổi (nhiệt độ, độ ẩm, relay)
+IDLE_MAX_INTERVAL = 300    # không có gì thay đổi (ban đêm): giãn dần đến mức này
+ACTIVITY_WINDOW = 30       # giữ nhịp nhanh trong chừng này giây sau lần số đếm thay đổi cuối
+IDLE_BACKOFF = 2           # hệ số giãn mỗi vòng không có thay đổi
+
+
+class AdaptiveCadence:
+    """
+    Chọn thời gian nghỉ giữa hai vòng gửi của send_to_server: dưới một giây khi chim đang bay
+    (số đếm vừa đổi hoặc trong khung giờ bay), về base_interval khi có thay đổi khác,
+    và giãn gấp đôi mỗi vòng đến idle_max_interval khi không có gì thay đổi.
+    """
+
+    def __init__(self, fast_interval=FAST_INTERVAL, peak_interval=PEAK_INTERVAL, base_interval=BASE_INTERVAL,
+                 idle_max_interval=IDLE_MAX_INTERVAL, activity_window=ACTIVITY_WINDOW):
+        self.fast_interval = fast_interval
+        self.peak_interval = peak_interval
+        self.base_interval = base_interval
+        self.idle_max_interval = idle_max_interval
+        self.activity_window = activity_window
+        self.interval = base_interval
+        self.last_activity = None
+
+    # counters_changed: số chim đổi từ vòng trước; changed: trường khác đổi; phase: get_time_phase(); now: time.monotonic().
+    def next_interval(self, counters_changed, changed, phase, now):
+        if counters_changed:
+            self.last_activity = now
+        if self.last_activity is not None and now - self.last_activity < self.activity_window:
+            self.interval = self.fast_interval
+        elif phase is not None:
+            self.interval = self.peak_interval
+        elif changed:
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.idle_max_interval, max(self.base_interval, self.interval * IDLE_BACKOFF))
+        return self.interval
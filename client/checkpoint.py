@@ -0,0 +1,77 @@
+import json
+import os
+import time
+
+# Bản sao trên RAM (tmpfs) ghi mỗi lần số đếm đổi: sống qua khi tiến trình chết/khởi động lại, không tốn thẻ SD.
+FAST_DIR = "/dev/shm"
+# Bản trên thẻ SD (sống qua khi Pi khởi động lại) chỉ fsync tối đa mỗi chừng này giây để đỡ mòn thẻ.
+DURABLE_INTERVAL = 60
+
+
+def write_atomic(path, text, durable):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if durable:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if isinstance(state, dict) and "saved_at" in state else None
+
+
+class CounterCheckpoint:
+    """
+    Lưu số đếm chim (dict trạng thái) xuống đĩa theo kiểu ghi file tạm rồi os.replace, nên file luôn là
+    bản đầy đủ cũ hoặc mới. Hai tầng: bản trên tmpfs ghi ngay mỗi lần đổi, bản trên thẻ SD fsync có giới hạn
+    tần suất; load() lấy bản mới hơn trong hai bản.
+    """
+
+    def __init__(self, path, fast_dir=FAST_DIR, durable_interval=DURABLE_INTERVAL):
+        self.path = path
+        self.fast_path = None
+        if fast_dir and os.path.isdir(fast_dir):
+            self.fast_path = os.path.join(fast_dir, "swiftlet-" + os.path.basename(path))
+        self.durable_interval = durable_interval
+        self._pending = None
+        self._last_durable = 0
+
+    # Trạng thái đã lưu mới nhất (có thêm saved_at, giây epoch), hoặc None.
+    def load(self):
+        states = [s for s in (_read(self.path), _read(self.fast_path) if self.fast_path else None) if s]
+        return max(states, key=lambda s: s["saved_at"]) if states else None
+
+    def save(self, state, force=False):
+        text = json.dumps(dict(state, saved_at=time.time()))
+        if self.fast_path:
+            write_atomic(self.fast_path, text, durable=False)
+        self._pending = text
+        if force or time.monotonic() - self._last_durable >= self.durable_interval:
+            self._write_durable()
+
+    # Gọi thường xuyên: ghi bản đang chờ xuống thẻ SD khi đã đủ DURABLE_INTERVAL.
+    def poll(self):
+        if self._pending is not None and time.monotonic() - self._last_durable >= self.durable_interval:
+            self._write_durable()
+
+    def flush(self):
+        if self._pending is not None:
+            self._write_durable()
+
+    def _write_durable(self):
+        write_atomic(self.path, self._pending, durable=True)
+        self._pending = None
+        self._last_durable = time.monotonic()
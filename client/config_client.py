@@ -0,0 +1,63 @@
+import json
+import os
+import time
+
+from checkpoint import write_atomic
+
+# Cấu hình theo nhà yến tải từ /api/config (send_to_server) được lưu ở đây; dht và bird_counter đọc lại khi file đổi.
+# File còn lại sau khi khởi động lại nên thiết bị dùng cấu hình cũ được cả khi chưa có mạng.
+CONFIG_FILE = os.environ.get("SWIFTLET_CONFIG", "device_config.json")
+CONFIG_CHECK_INTERVAL = 5    # giây giữa hai lần kiểm tra file trong mỗi tiến trình
+
+
+def load_config_file(path=CONFIG_FILE):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) and isinstance(data.get("config"), dict) else None
+
+
+def save_config_file(version, etag, config, path=CONFIG_FILE):
+    write_atomic(path, json.dumps({"version": version, "etag": etag, "config": config}), durable=True)
+
+
+# Gán các tham số có trong config vào biến toàn cục của module (keys: tên tham số -> tên biến).
+# Trả về danh sách các biến đã đổi giá trị.
+def apply_to_module(namespace, keys, config):
+    changed = []
+    for key, name in keys.items():
+        if key in config and config[key] is not None and namespace.get(name) != config[key]:
+            namespace[name] = config[key]
+            changed.append(name)
+    return changed
+
+
+class ConfigWatcher:
+    """
+    Theo dõi file cấu hình trong một tiến trình: poll() rẻ (một lần os.stat mỗi interval giây)
+    và chỉ trả về nội dung khi file đã đổi, để tiến trình áp dụng ngay mà không cần khởi động lại.
+    """
+
+    def __init__(self, path=CONFIG_FILE, interval=CONFIG_CHECK_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._next_check = 0
+        self._stamp = None
+
+    # Nội dung file ({"version", "etag", "config"}) nếu đã đổi từ lần trước, ngược lại None.
+    def poll(self, now=None):
+        now = time.monotonic() if now is None else now
+        if now < self._next_check:
+            return None
+        self._next_check = now + self.interval
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        return load_config_file(self.path)
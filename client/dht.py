@@ -1,16 +1,43 @@
+import os
+import statistics
+import threading
 import time
-import adafruit_dht 
-import board 
-from multiprocessing import Queue 
-import RPi.GPIO as GPIO 
+from collections import deque
+from config_client import ConfigWatcher, apply_to_module
+from latest_channel import climate_channel
+
+# SWIFTLET_DHT=sim dùng DHT22 và GPIO mô phỏng (sim_dht.py, sim_gpio.py) để chạy/đo trên máy không có Pi
+DHT_BACKEND = os.environ.get("SWIFTLET_DHT", "adafruit")
+if DHT_BACKEND == "sim":
+    import sim_dht as adafruit_dht
+    import sim_gpio as GPIO
+    board = adafruit_dht.board
+else:
+    import adafruit_dht 
+    import board 
+    import RPi.GPIO as GPIO 
 
 GPIO.setmode(GPIO.BCM)
 # --- Cấu hình Relay ---
 RELAY_GPIO_PIN = 14  
 HUMIDITY_THRESHOLD_ON = 79.0  
 HUMIDITY_THRESHOLD_OFF = 82.0 
+RELAY_MIN_ON = 30        # giây: relay đã bật thì giữ ít nhất chừng này (chống bật/tắt liên tục)
+RELAY_MIN_OFF = 30       # giây: relay đã tắt thì nghỉ ít nhất chừng này
+RELAY_TICK = 1.0         # chu kỳ vòng điều khiển relay (giây)
+
+# --- Cấu hình lấy mẫu DHT22 ---
+SAMPLE_INTERVAL = 2.0    # DHT22 đọc nhanh nhất mỗi 2 giây
+FILTER_WINDOW = 5        # trung vị của 5 mẫu gần nhất loại các mẫu nhiễu/đọc sai
+EMA_ALPHA = 0.3          # làm mượt thêm sau trung vị
+STALE_AFTER = 120        # quá chừng này giây không đọc được thì coi như mất cảm biến, tắt relay cho an toàn
+
+# Tham số cấu hình từ server (/api/config) -> biến của module này; đổi được khi đang chạy
+CONFIG_KEYS = {"humidity_threshold_on": "HUMIDITY_THRESHOLD_ON", "humidity_threshold_off": "HUMIDITY_THRESHOLD_OFF",
+               "relay_min_on": "RELAY_MIN_ON", "relay_min_off": "RELAY_MIN_OFF"}
 
 relay_state = False 
+relay_changed_at = None
 
 def setup_relay():
     global relay_state 
@@ -19,71 +46,159 @@ def setup_relay():
     relay_state = False 
     print(f"RELAY: Relay trên GPIO {RELAY_GPIO_PIN} đã được thiết lập, trạng thái ban đầu: TẮT (GPIO HIGH).")
 
-def control_relay(current_humidity):
-    global relay_state
-    
+def set_relay(on, now=None):
+    global relay_state, relay_changed_at
+    GPIO.output(RELAY_GPIO_PIN, GPIO.LOW if on else GPIO.HIGH)
+    relay_state = on
+    relay_changed_at = time.monotonic() if now is None else now
+
+# Bật/tắt theo ngưỡng trễ (bật <= ON, tắt > OFF) và thời gian giữ tối thiểu. Trả về True nếu relay vừa đổi.
+def control_relay(current_humidity, now=None):
+    now = time.monotonic() if now is None else now
+    held = now - relay_changed_at if relay_changed_at is not None else float("inf")
+
     if current_humidity <= HUMIDITY_THRESHOLD_ON:
-        if not relay_state: 
-            GPIO.output(RELAY_GPIO_PIN, GPIO.LOW) 
-            relay_state = True 
+        if not relay_state and held >= RELAY_MIN_OFF: 
+            set_relay(True, now)
+            return True
     
     elif current_humidity > HUMIDITY_THRESHOLD_OFF:
-        if relay_state: 
-            GPIO.output(RELAY_GPIO_PIN, GPIO.HIGH) 
-            relay_state = False 
-    
+        if relay_state and held >= RELAY_MIN_ON: 
+            set_relay(False, now)
+            return True
+    return False
 
-def run_dht_sensor(dht_queue: Queue):
 
-    global relay_state 
+class DHTSampler:
+    """
+    Luồng nền đọc DHT22 nhanh nhất cảm biến cho phép (SAMPLE_INTERVAL), giữ FILTER_WINDOW mẫu gần nhất
+    và tính giá trị đã lọc (trung vị rồi EMA). Một lần đọc lỗi chỉ mất một mẫu 2 giây thay vì cả chu kỳ.
+    """
+
+    def __init__(self, device, interval=SAMPLE_INTERVAL, window=FILTER_WINDOW, alpha=EMA_ALPHA):
+        self.device = device
+        self.interval = interval
+        self.alpha = alpha
+        self._temperatures = deque(maxlen=window)
+        self._humidities = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._filtered = None
+        self.version = 0
+        self.updated_at = None
+        self.reads = 0
+        self.errors = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="dht-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.reads += 1
+            try:
+                # adafruit_dht đo một lần cho cả hai giá trị (.humidity dùng lại kết quả của .temperature)
+                temperature_c = self.device.temperature
+                humidity = self.device.humidity
+                if temperature_c is not None and humidity is not None:
+                    self.add(temperature_c, humidity, started)
+                else:
+                    self.errors += 1
+            except RuntimeError:
+                # DHT22 hay đọc hỏng (checksum, hết giờ chờ); mẫu sau 2 giây sẽ thử lại
+                self.errors += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"DHT: Lỗi không xác định khi đọc DHT: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def add(self, temperature_c, humidity, now=None):
+        self._temperatures.append(temperature_c)
+        self._humidities.append(humidity)
+        median = (statistics.median(self._temperatures), statistics.median(self._humidities))
+        with self._lock:
+            if self._filtered is None:
+                self._filtered = median
+            else:
+                self._filtered = tuple(self.alpha * m + (1 - self.alpha) * f for m, f in zip(median, self._filtered))
+            self.version += 1
+            self.updated_at = time.monotonic() if now is None else now
+
+    # (phiên bản, nhiệt độ, độ ẩm, thời điểm đọc được mẫu cuối) đã lọc, hoặc None nếu chưa có mẫu nào.
+    def latest(self):
+        with self._lock:
+            if self._filtered is None:
+                return None
+            return (self.version,) + self._filtered + (self.updated_at,)
+
+
+# climate: kênh LatestChannel, người đọc luôn thấy giá trị mới nhất; metrics: kênh số lần đọc/lỗi (tùy chọn).
+def run_dht_sensor(climate, metrics=None):
+
     dht_device = None
+    sampler = None
+    started = time.monotonic()
     try:
         setup_relay() 
         dht_device = adafruit_dht.DHT22(board.D4) 
         print("DHT: Cảm biến DHT22 đã khởi tạo trên chân D4.")
         
-        while True:
-            temperature_c = None 
-            humidity = None      
-            try:
-                temperature_c = dht_device.temperature
-                humidity = dht_device.humidity
-                # print(f"DHT Temp={temperature_c}°C, Humid={humidity}%")
+        sampler = DHTSampler(dht_device)
+        sampler.start()
+        published = None
+        published_metrics = None
+        stale_reported = False
+        config_watcher = ConfigWatcher()
 
-
-                if temperature_c is not None and humidity is not None:
-                    control_relay(humidity)
-
-                    current_relay_status = 1 if relay_state else 0 
+        # Vòng điều khiển relay chạy nhanh (RELAY_TICK) trên giá trị đã lọc; kênh climate chỉ ghi khi có thay đổi
+        while True:
+            now = time.monotonic()
+            update = config_watcher.poll(now)
+            if update is not None:
+                changed = apply_to_module(globals(), CONFIG_KEYS, update["config"])
+                if changed:
+                    print(f"RELAY: Áp dụng cấu hình phiên bản {update['version']}: {', '.join(changed)}")
+            reading = sampler.latest()
+            if reading is not None and now - reading[3] <= STALE_AFTER:
+                version, temperature_c, humidity, _ = reading
+                stale_reported = False
+                changed = control_relay(humidity, now)
+                if changed or (version, relay_state) != published:
                     data_packet = {
                         "temperature": round(temperature_c, 1), 
                         "humidity": round(humidity, 1),
-                        "relay_status": current_relay_status 
+                        "relay_status": 1 if relay_state else 0 
                     }
-                    while not dht_queue.empty():
-                        try:
-                            dht_queue.get_nowait()
-                        except Exception: 
-                            break 
-                    dht_queue.put(data_packet)
-                    print(f"DHT Sent: Temp={data_packet['temperature']}°C, Humid={data_packet['humidity']}%, Relay={data_packet['relay_status']}")
-                else:
-                    print("DHT: Không đọc được giá trị hợp lệ từ cảm biến (một hoặc cả hai là None).")
-                    pass 
-
-            except RuntimeError as error:
-                print(f"DHT: Lỗi đọc cảm biến (RuntimeError): {error}")
-                pass 
-            except Exception as e:
-                print(f"DHT: Lỗi không xác định trong vòng lặp đọc DHT: {e}")
-            
-            time.sleep(30) 
+                    climate.publish(data_packet)
+                    published = (version, relay_state)
+                    if changed:
+                        print(f"RELAY: {'BẬT' if relay_state else 'TẮT'} máy phun ẩm (độ ẩm lọc {data_packet['humidity']}%).")
+            elif not stale_reported and (reading is not None or now - started > STALE_AFTER):
+                print(f"DHT: Không đọc được cảm biến trong {STALE_AFTER}s ({sampler.errors} lần lỗi), tắt relay.")
+                if relay_state:
+                    set_relay(False, now)
+                climate.publish({"temperature": None, "humidity": None, "relay_status": 0})
+                published = None
+                stale_reported = True
+            if metrics is not None and (sampler.reads, sampler.errors) != published_metrics:
+                published_metrics = (sampler.reads, sampler.errors)
+                metrics.publish({"dht_reads_total": sampler.reads, "dht_errors_total": sampler.errors})
+            time.sleep(RELAY_TICK)
 
     except KeyboardInterrupt:
         print("DHT: Dừng chương trình đọc DHT.")
     except Exception as e:
         print(f"DHT: Lỗi nghiêm trọng trong tiến trình DHT: {e}")
     finally:
+        if sampler:
+            sampler.stop()
         if dht_device:
             print("DHT: Giải phóng tài nguyên cảm biến DHT.")
             dht_device.exit()
@@ -91,13 +206,13 @@ def run_dht_sensor(dht_queue: Queue):
         GPIO.cleanup(RELAY_GPIO_PIN) 
 
 if __name__ == '__main__':
-    test_dht_queue = Queue()
+    test_climate = climate_channel()
     try:
-        run_dht_sensor(test_dht_queue)
+        run_dht_sensor(test_climate)
     except KeyboardInterrupt:
         print("Test DHT dừng.")
     finally:
-        while not test_dht_queue.empty():
-            retrieved_data = test_dht_queue.get_nowait()
-            print(f"Dữ liệu còn lại trong queue test: {retrieved_data}")
+        print(f"Giá trị cuối cùng trong kênh test: {test_climate.read()[1]}")
+        test_climate.close()
+        test_climate.unlink()
         print("RELAY (Test): Kết thúc test, GPIO đã được xử lý trong run_dht_sensor.")
@@ -0,0 +1,55 @@
+from collections import deque
+
+
+class EventMatcher:
+    """
+    Ghép sự kiện cảm biến thành lượt chim vào/ra theo từng sự kiện mới, thay cho việc quét lại cả hàng đợi.
+    Mỗi cảm biến giữ các sự kiện đang chờ theo thứ tự thời gian; sự kiện cũ hơn max_interval bị bỏ vì
+    không thể ghép với sự kiện nào đến sau. Một sự kiện mới chỉ được so với các cảm biến cùng cặp hoặc
+    cặp kề bên (id//2 cách nhau không quá 1), nên mỗi sự kiện tốn thời gian gần như hằng số.
+    """
+
+    def __init__(self, num_sensors, max_interval, near_simultaneous):
+        self.max_interval = max_interval
+        self.near_simultaneous = near_simultaneous
+        self.neighbors = [[j for j in range(num_sensors) if j != i and abs(i // 2 - j // 2) <= 1]
+                          for i in range(num_sensors)]
+        self.pending = [deque() for _ in range(num_sensors)]
+
+    def _expire(self, now):
+        for events in self.pending:
+            while events and now - events[0] > self.max_interval:
+                events.popleft()
+
+    # Hướng bay của một cặp sự kiện (id1 là sự kiện đến trước): "in", "out" hoặc None nếu chưa quyết được.
+    def _direction(self, id1, t1, t2, phase):
+        even_time, odd_time = (t1, t2) if id1 % 2 == 0 else (t2, t1)
+        # Gần như đồng thời -> dùng phase
+        if abs(even_time - odd_time) <= self.near_simultaneous:
+            if phase == 'morning':
+                return "out"
+            if phase == 'evening':
+                return "in"
+            return None
+        return "in" if even_time < odd_time else "out"
+
+    # Thêm một sự kiện; trả về "in"/"out" nếu nó hoàn tất một lượt bay với sự kiện đang chờ cũ nhất phù hợp.
+    def add(self, sensor_id, t, phase):
+        self._expire(t)
+        candidates = sorted((t1, id1) for id1 in self.neighbors[sensor_id] for t1 in self.pending[id1])
+        for t1, id1 in candidates:
+            direction = self._direction(id1, t1, t, phase)
+            if direction is not None:
+                self.pending[id1].remove(t1)
+                return direction
+        self.pending[sensor_id].append(t)
+        return None
+
+    # Xử lý một loạt sự kiện (sensor_id, t) theo thứ tự thời gian, trả về danh sách các lượt bay hoàn tất.
+    def match(self, events, phase):
+        crossings = []
+        for sensor_id, t in sorted(events, key=lambda e: e[1]):
+            direction = self.add(sensor_id, t, phase)
+            if direction is not None:
+                crossings.append(direction)
+        return crossings
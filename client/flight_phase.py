@@ -0,0 +1,27 @@
+import time
+
+from config_client import apply_to_module
+
+# Khung giờ bay của chim yến (giờ địa phương), dùng chung cho bird_counter và send_to_server
+MORNING_START     = 4    # 4h–10h chim thường bay ra
+MORNING_END       = 10
+EVENING_START     = 15   # 15h–20h chim thường bay vào
+EVENING_END       = 20
+
+# Tham số cấu hình từ server (/api/config) -> biến của module này
+CONFIG_KEYS = {"morning_start": "MORNING_START", "morning_end": "MORNING_END",
+               "evening_start": "EVENING_START", "evening_end": "EVENING_END"}
+
+
+# Áp dụng các khung giờ trong config (mọi tiến trình dùng get_time_phase đều gọi); trả về các biến đã đổi.
+def apply_config(config):
+    return apply_to_module(globals(), CONFIG_KEYS, config)
+
+
+def get_time_phase(now=None):
+    h = time.localtime(now).tm_hour
+    if MORNING_START <= h < MORNING_END:
+        return 'morning'
+    elif EVENING_START <= h < EVENING_END:
+        return 'evening'
+    return None
@@ -0,0 +1,98 @@
+import math
+import struct
+import time
+import zlib
+from multiprocessing import shared_memory
+
+# Header: seq (lẻ = đang ghi) và CRC32 của phần dữ liệu. CRC giúp người đọc loại bản ghi rách
+# kể cả khi CPU (ARM) sắp xếp lại thứ tự ghi bộ nhớ giữa seq và dữ liệu.
+HEADER = struct.Struct("<QI")
+READ_RETRIES = 100
+
+
+class LatestChannel:
+    """
+    Kênh "giá trị mới nhất" giữa các tiến trình trên multiprocessing.shared_memory, kiểu seqlock:
+    một tiến trình ghi, nhiều tiến trình đọc, không khóa, không pickle, không hàng đợi phình ra.
+    Bố cục cố định theo struct; trường float dùng NaN để biểu diễn None.
+    """
+
+    def __init__(self, fields, fmt, name=None):
+        self.fields = tuple(fields)
+        self.payload = struct.Struct("<" + fmt)
+        size = HEADER.size + self.payload.size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self._float_fields = {f for f, code in zip(self.fields, fmt) if code in "fd"}
+        self._seq = 0
+
+    # Khi truyền sang tiến trình con (spawn) chỉ gửi tên vùng nhớ, tiến trình con gắn lại vào cùng vùng đó.
+    def __reduce__(self):
+        return _attach, (self.fields, self.payload.format[1:], self.shm.name)
+
+    def publish(self, values):
+        data = self.payload.pack(*(self._encode(f, values.get(f)) for f in self.fields))
+        seq = HEADER.unpack_from(self.shm.buf, 0)[0]
+        buf = self.shm.buf
+        struct.pack_into("<Q", buf, 0, seq + 1)
+        buf[HEADER.size:HEADER.size + len(data)] = data
+        HEADER.pack_into(buf, 0, seq + 2, zlib.crc32(data))
+
+    # Trả về (phiên bản, dict giá trị) mới nhất, hoặc (0, None) nếu chưa ghi lần nào.
+    def read(self):
+        buf = self.shm.buf
+        for _ in range(READ_RETRIES):
+            seq1, crc = HEADER.unpack_from(buf, 0)
+            if seq1 == 0:
+                return 0, None
+            data = bytes(buf[HEADER.size:HEADER.size + self.payload.size])
+            seq2 = HEADER.unpack_from(buf, 0)[0]
+            if seq1 % 2 == 0 and seq1 == seq2 and zlib.crc32(data) == crc:
+                values = self.payload.unpack(data)
+                return seq1 // 2, {f: self._decode(f, v) for f, v in zip(self.fields, values)}
+            time.sleep(0)
+        return 0, None
+
+    def _encode(self, field, value):
+        if field in self._float_fields:
+            return math.nan if value is None else value
+        return 0 if value is None else value
+
+    def _decode(self, field, value):
+        if field in self._float_fields and math.isnan(value):
+            return None
+        return value
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _attach(fields, fmt, name):
+    return LatestChannel(fields, fmt, name)
+
+
+# Số đếm chim hiện tại (bird_counter ghi, send_to_server đọc).
+def counter_channel(name=None):
+    return LatestChannel(("chimVao", "chimRa", "chimTong"), "qqq", name)
+
+
+# Nhiệt độ, độ ẩm và trạng thái relay (dht ghi, send_to_server đọc).
+def climate_channel(name=None):
+    return LatestChannel(("temperature", "humidity", "relay_status"), "ddb", name)
+
+
+# Số liệu vận hành của bird_counter: tốc độ và thời gian quét, số lần hết giờ chờ ECHO, độ sâu hàng đợi sự kiện.
+def counter_metrics_channel(name=None):
+    return LatestChannel(("sweep_rate", "sweep_seconds_avg", "sweep_seconds_max", "echo_timeouts_total",
+                          "event_queue_depth"), "dddqq", name)
+
+
+# Số liệu vận hành của dht: số lần đọc cảm biến và số lần lỗi.
+def dht_metrics_channel(name=None):
+    return LatestChannel(("dht_reads_total", "dht_errors_total"), "qq", name)
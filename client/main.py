@@ -1,29 +1,37 @@
 from multiprocessing import Process, Queue
 import time
 
+from latest_channel import climate_channel, counter_channel, counter_metrics_channel, dht_metrics_channel
+
 # Import hàm từ module
 
-def run_bird_counter_process(queue): 
+def run_bird_counter_process(counters, daily_queue, metrics): 
     import bird_counter 
-    bird_counter.run_counter(queue)
+    bird_counter.run_counter(counters, daily_queue, metrics)
 
-def run_dht_sensor_process(dht_queue): 
+def run_dht_sensor_process(climate, metrics): 
     import dht 
-    dht.run_dht_sensor(dht_queue)
+    dht.run_dht_sensor(climate, metrics)
 
-def run_send_to_server_process(bird_queue, dht_queue): 
+def run_send_to_server_process(counters, climate, daily_queue, metric_channels): 
     import send_to_server 
-    send_to_server.send_data(bird_queue, dht_queue)
+    send_to_server.send_data(counters, climate, daily_queue, metric_channels)
 
 if __name__ == "__main__":
-    bird_data_queue = Queue()  
-    dht_data_queue = Queue()   
+    # Giá trị mới nhất đi qua bộ nhớ chung; chỉ báo cáo hàng ngày cần hàng đợi tin cậy
+    counters = counter_channel()
+    climate = climate_channel()
+    # Số liệu vận hành của bird_counter và dht, send_to_server gửi kèm bản ghi đầy đủ
+    counter_metrics = counter_metrics_channel()
+    dht_metrics = dht_metrics_channel()
+    daily_report_queue = Queue()
 
     #Khởi tạo các tiến trình
     print("MAIN: Khởi tạo các tiến trình...")
-    counter_process = Process(target=run_bird_counter_process, args=(bird_data_queue,))
-    dht_process = Process(target=run_dht_sensor_process, args=(dht_data_queue,))
-    sender_process = Process(target=run_send_to_server_process, args=(bird_data_queue, dht_data_queue,))
+    counter_process = Process(target=run_bird_counter_process, args=(counters, daily_report_queue, counter_metrics,))
+    dht_process = Process(target=run_dht_sensor_process, args=(climate, dht_metrics,))
+    sender_process = Process(target=run_send_to_server_process,
+                             args=(counters, climate, daily_report_queue, (counter_metrics, dht_metrics),))
 
     # Bắt đầu các tiến trình
     print("MAIN: Bắt đầu các tiến trình...")
@@ -75,4 +83,7 @@ if __name__ == "__main__":
                  print("MAIN: Tiến trình gửi dữ liệu không dừng, buộc dừng (kill)...")
                  sender_process.kill()
         
+        for channel in (counters, climate, counter_metrics, dht_metrics):
+            channel.close()
+            channel.unlink()
         print("MAIN: Tất cả các tiến trình đã được yêu cầu dừng. Chương trình kết thúc.")
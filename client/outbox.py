@@ -0,0 +1,60 @@
+import json
+import sqlite3
+import time
+
+
+class Outbox:
+    """
+    Hàng đợi gửi lưu trên đĩa (SQLite) cho send_to_server: mọi payload được ghi trước khi gửi,
+    chỉ xóa khi server xác nhận, nên mất mạng hay khởi động lại cũng không mất dữ liệu.
+    Quá max_rows bản ghi thì bỏ các bản ghi trực tiếp cũ nhất; báo cáo hàng ngày luôn được giữ.
+    Số bản ghi đang chờ được đếm một lần lúc mở rồi giữ trong bộ nhớ (chỉ send_to_server dùng outbox),
+    để mỗi lần add không phải COUNT(*) cả bảng trên thẻ SD.
+    """
+
+    def __init__(self, path, max_rows=1000000):
+        self.max_rows = max_rows
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                daily INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+        self._pending = self.conn.execute("SELECT count(*) FROM outbox").fetchone()[0]
+
+    def add(self, payload):
+        self.conn.execute("INSERT INTO outbox (payload, daily, created) VALUES (?, ?, ?)",
+                          (json.dumps(payload), 1 if payload.get("daily_report") else 0, time.time()))
+        self.conn.commit()
+        self._pending += 1
+        if self.max_rows and self._pending > self.max_rows:
+            cursor = self.conn.execute('''
+                DELETE FROM outbox WHERE id IN (
+                    SELECT id FROM outbox WHERE daily = 0 ORDER BY id LIMIT ?
+                )
+            ''', (self._pending - self.max_rows,))
+            self.conn.commit()
+            self._pending -= cursor.rowcount
+
+    def pending(self):
+        return self._pending
+
+    # Lô cũ nhất chưa gửi: danh sách (id, payload).
+    def next_batch(self, limit):
+        rows = self.conn.execute("SELECT id, payload FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    # Xóa các bản ghi server đã nhận.
+    def ack(self, ids):
+        cursor = self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+        self.conn.commit()
+        self._pending -= cursor.rowcount
+
+    def close(self):
+        self.conn.close()
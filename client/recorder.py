@@ -0,0 +1,102 @@
+import glob
+import os
+import struct
+import time
+from array import array
+
+# Mỗi khối: header (magic, số mẫu n) rồi n thời điểm float64, n khoảng cách float32, n byte cảm biến.
+# Bit cao của byte cảm biến đánh dấu mẫu đã thành sự kiện với tham số lúc ghi. 13 byte mỗi mẫu.
+BLOCK_MAGIC = b"SWR1"
+BLOCK_HEADER = struct.Struct("<4sI")
+EVENT_FLAG = 0x80
+
+
+class EventRecorder:
+    """
+    Ghi các mẫu khoảng cách hợp lệ của bird_counter ra file nhị phân xoay vòng để phát lại offline (replay.py).
+    Mẫu được gom trong các array rồi ghi thành một khối mỗi flush_interval giây; file vượt max_file_bytes
+    thì mở file mới, quá max_files file thì xóa file cũ nhất.
+    """
+
+    def __init__(self, directory, max_file_bytes=4 * 1024 * 1024, max_files=256, flush_interval=1.0):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self._times = array('d')
+        self._distances = array('f')
+        self._sensors = array('B')
+        self._file = None
+        self._last_flush = time.monotonic()
+
+    def record(self, t, sensor_id, distance, is_event):
+        self._times.append(t)
+        self._distances.append(distance)
+        self._sensors.append(sensor_id | (EVENT_FLAG if is_event else 0))
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _open_file(self):
+        # Tên file sắp xếp theo thứ tự ghi (kể cả khi chép sang máy khác làm mất mtime)
+        name = time.strftime("events-%Y%m%d-%H%M%S")
+        n = 0
+        path = os.path.join(self.directory, f"{name}-{n:03d}.bin")
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(self.directory, f"{name}-{n:03d}.bin")
+        self._file = open(path, "ab")
+        files = recording_files(self.directory)
+        for old in files[:max(0, len(files) - self.max_files)]:
+            os.remove(old)
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._times:
+            return
+        if self._file is None or self._file.tell() >= self.max_file_bytes:
+            if self._file is not None:
+                self._file.close()
+            self._open_file()
+        self._file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, len(self._times)))
+        self._file.write(self._times.tobytes())
+        self._file.write(self._distances.tobytes())
+        self._file.write(self._sensors.tobytes())
+        self._file.flush()
+        self._times = array('d')
+        self._distances = array('f')
+        self._sensors = array('B')
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def recording_files(directory):
+    return sorted(glob.glob(os.path.join(directory, "events-*.bin")))
+
+
+# Đọc lần lượt các mẫu (t, sensor_id, distance, is_event) của một file; khối cuối ghi dở (mất điện) bị bỏ qua.
+def read_recording(path):
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            magic, n = BLOCK_HEADER.unpack(header)
+            body = f.read(n * 13)
+            if magic != BLOCK_MAGIC or len(body) < n * 13:
+                return
+            times = array('d')
+            times.frombytes(body[:n * 8])
+            distances = array('f')
+            distances.frombytes(body[n * 8:n * 12])
+            for t, distance, sensor in zip(times, distances, body[n * 12:]):
+                yield t, sensor & ~EVENT_FLAG, distance, bool(sensor & EVENT_FLAG)
+
+
+def read_recordings(directory):
+    for path in recording_files(directory):
+        yield from read_recording(path)
@@ -0,0 +1,117 @@
+"""
+Phát lại các mẫu khoảng cách đã ghi (SWIFTLET_RECORD_DIR) qua logic đếm của bird_counter với đồng hồ mô phỏng,
+nhanh hơn thời gian thực nhiều lần, để kiểm tra hồi quy và chỉnh MAX_INTERVAL, COOLDOWN, NEAR_SIMULTANEOUS.
+Chạy trên máy Linux thường: bird_counter được nạp với pigpio mô phỏng.
+Lưu ý: lúc ghi, cảm biến đang trong COOLDOWN không được đo, nên chỉ thử được COOLDOWN lớn hơn giá trị lúc ghi.
+
+Ví dụ:
+  python replay.py recordings/
+  python replay.py recordings/ --max-interval 0.3 --cooldown 0.06 --near-simultaneous 0.15 --json
+"""
+import argparse
+import json
+import os
+import time
+from datetime import date
+
+from recorder import read_recordings
+
+os.environ.setdefault("SWIFTLET_PIGPIO", "sim")
+import bird_counter  # noqa: E402
+from event_matcher import EventMatcher  # noqa: E402
+
+
+# Chạy lại chuỗi mẫu: áp COOLDOWN và ngưỡng khoảng cách, gọi check_events sau mỗi vòng quét mô phỏng.
+def replay(samples, sweep_period, phase="auto"):
+    bird_counter.event_queue.clear()
+    bird_counter.event_matcher = EventMatcher(bird_counter.NUM_SENSORS, bird_counter.MAX_INTERVAL,
+                                              bird_counter.NEAR_SIMULTANEOUS)
+    bird_counter.last_active[:] = [0] * bird_counter.NUM_SENSORS
+    bird_counter.chimVao = bird_counter.chimRa = 0
+    daily = {}
+    stats = {"samples": 0, "recorded_events": 0, "events": 0, "first": None, "last": None}
+    sweep_end = None
+    day = None
+
+    def close_sweep(t):
+        bird_counter.check_events(bird_counter.get_time_phase(t) if phase == "auto" else phase)
+        counts = daily.setdefault(day, {"in": 0, "out": 0})
+        counts["in"] += bird_counter.chimVao
+        counts["out"] += bird_counter.chimRa
+        bird_counter.chimVao = bird_counter.chimRa = 0
+
+    for t, sensor_id, distance, was_event in samples:
+        if sweep_end is None:
+            sweep_end = t + sweep_period
+            stats["first"] = t
+            day = date.fromtimestamp(t).isoformat()
+        if t >= sweep_end:
+            close_sweep(sweep_end)
+            sweep_end = t + sweep_period
+            day = date.fromtimestamp(t).isoformat()
+        stats["samples"] += 1
+        stats["recorded_events"] += was_event
+        stats["last"] = t
+        if t - bird_counter.last_active[sensor_id] < bird_counter.COOLDOWN:
+            continue
+        if bird_counter.MIN_DISTANCE < distance < bird_counter.MAX_DISTANCE:
+            bird_counter.enqueue(sensor_id, t)
+            bird_counter.last_active[sensor_id] = t
+            stats["events"] += 1
+    if sweep_end is not None:
+        close_sweep(sweep_end)
+    return daily, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--max-interval", type=float, default=bird_counter.MAX_INTERVAL)
+    parser.add_argument("--cooldown", type=float, default=bird_counter.COOLDOWN)
+    parser.add_argument("--near-simultaneous", type=float, default=bird_counter.NEAR_SIMULTANEOUS)
+    parser.add_argument("--min-distance", type=float, default=bird_counter.MIN_DISTANCE)
+    parser.add_argument("--max-distance", type=float, default=bird_counter.MAX_DISTANCE)
+    parser.add_argument("--phase", choices=("auto", "morning", "evening", "none"), default="auto",
+                        help="auto: theo giờ địa phương của từng mẫu như run_counter")
+    parser.add_argument("--sweep-period", type=float, default=0.025, help="thời gian một vòng quét mô phỏng (giây)")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    bird_counter.MAX_INTERVAL = args.max_interval
+    bird_counter.COOLDOWN = args.cooldown
+    bird_counter.NEAR_SIMULTANEOUS = args.near_simultaneous
+    bird_counter.MIN_DISTANCE = args.min_distance
+    bird_counter.MAX_DISTANCE = args.max_distance
+
+    started = time.perf_counter()
+    daily, stats = replay(read_recordings(args.directory), args.sweep_period,
+                          None if args.phase == "none" else args.phase)
+    elapsed = time.perf_counter() - started
+    bird_counter.pi.stop()
+
+    span = (stats["last"] - stats["first"]) if stats["samples"] else 0.0
+    result = {
+        "params": {k: getattr(args, k) for k in ("max_interval", "cooldown", "near_simultaneous",
+                                                  "min_distance", "max_distance")},
+        "samples": stats["samples"],
+        "recorded_events": stats["recorded_events"],
+        "events": stats["events"],
+        "in": sum(c["in"] for c in daily.values()),
+        "out": sum(c["out"] for c in daily.values()),
+        "daily": daily,
+        "recorded_seconds": round(span, 1),
+        "replay_seconds": round(elapsed, 3),
+        "speedup": round(span / elapsed) if elapsed else None,
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"REPLAY: {result['samples']} mẫu, {result['events']} sự kiện (lúc ghi: {result['recorded_events']})")
+    for day, counts in sorted(daily.items()):
+        print(f"REPLAY: {day}: vào {counts['in']}, ra {counts['out']}")
+    print(f"REPLAY: tổng vào {result['in']}, ra {result['out']}; {result['recorded_seconds']}s dữ liệu "
+          f"phát lại trong {result['replay_seconds']}s (x{result['speedup']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,185 @@
+import gzip
+import json
+import random
 import requests
+import sqlite3
 import time
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone, timedelta
 
-# Cấu hình
-SERVER_URL = "http://100.111.53.26:5000/api/update" 
+import flight_phase
+from cadence import AdaptiveCadence
+from config_client import ConfigWatcher, apply_to_module, load_config_file, save_config_file
+from flight_phase import get_time_phase
+from outbox import Outbox
+from server_api import HOUSE_ID, SERVER_BATCH_URL, SERVER_CONFIG_URL
+
+# Cấu hình (địa chỉ server và HOUSE_ID nằm trong server_api.py)
 GMT7 = timezone(timedelta(hours=7)) 
+SEND_INTERVAL = 10        # nhịp gửi cơ bản; AdaptiveCadence nhanh lên khi chim bay và giãn ra khi yên
+# Mọi payload được ghi vào outbox trên đĩa trước, rồi gửi theo lô nén gzip tới /api/update_batch
+OUTBOX_FILE = "outbox.db"
+BATCH_SIZE = 2000          # 6 giờ mất mạng (~2200 bản ghi) gửi lại trong 2 request
+BACKOFF_MAX = 600          # thời gian chờ tối đa giữa hai lần thử lại (giây)
+GZIP_MIN_BYTES = 256       # body nhỏ hơn thì gửi thẳng, gzip không lợi (header gzip ~20 byte)
+# Chế độ chỉ gửi thay đổi: giá trị không đổi thì không gửi gì, đổi thì chỉ gửi các trường đã đổi ("delta": true);
+# cứ HEARTBEAT_INTERVAL giây gửi lại đủ các trường để server biết thiết bị còn sống và đồng bộ lại.
+DELTA_MODE = True
+HEARTBEAT_INTERVAL = 300
+CONFIG_POLL_INTERVAL = 60  # hỏi /api/config (If-None-Match, thường chỉ nhận 304 rỗng)
+# Tham số cấu hình từ server (/api/config) -> biến của module này; đổi được khi đang chạy
+CONFIG_KEYS = {"send_interval": "SEND_INTERVAL", "heartbeat_interval": "HEARTBEAT_INTERVAL"}
+LIVE_FIELDS = ("chimVao", "chimRa", "chimTong", "temperature", "humidity", "relay_status")
+
+# Một phiên HTTP dùng lại kết nối TCP (keep-alive) cho mọi lần gửi, tránh bắt tay lại qua Tailscale mỗi 10 giây
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+# Số liệu vận hành của tiến trình gửi, đi kèm bản ghi đầy đủ (trường "metrics") cùng số liệu của bird_counter và dht.
+upload_stats = {"upload_rtt_seconds": None, "upload_failures_total": 0}
+
+# Thời gian chờ trước lần thử lại kế tiếp sau một lần gửi lỗi: gấp đôi lần trước, từ SEND_INTERVAL đến BACKOFF_MAX.
+def next_backoff(backoff):
+    return min(BACKOFF_MAX, max(SEND_INTERVAL, backoff * 2))
+
+# Ghi payload vào outbox; lỗi SQLite (ví dụ thẻ SD đầy) chỉ làm mất bản ghi này chứ không dừng tiến trình gửi.
+def queue_payload(outbox, payload):
+    try:
+        outbox.add(payload)
+    except sqlite3.Error as e:
+        print(f"SENDER: Không ghi được vào outbox: {e}")
+
+# Gửi các bản ghi đang chờ trong outbox theo lô, cũ trước. Trả về True nếu đã gửi hết;
+# False nếu lỗi (mạng, phản hồi hay outbox) để vòng lặp chính thử lại theo backoff.
+def upload_outbox(outbox):
+    while True:
+        try:
+            batch = outbox.next_batch(BATCH_SIZE)
+        except (sqlite3.Error, ValueError) as e:
+            print(f"SENDER: Không đọc được outbox: {e}")
+            return False
+        if not batch:
+            return True
+        body = json.dumps([payload for _, payload in batch], separators=(",", ":")).encode()
+        headers = {"Content-Type": "application/json"}
+        if len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        started = time.monotonic()
+        try:
+            response = session.post(SERVER_BATCH_URL, data=body, timeout=30, headers=headers)
+        except requests.exceptions.RequestException as e:
+            upload_stats["upload_failures_total"] += 1
+            print(f"SENDER: Không gửi được (lỗi request): {e}")
+            return False
+        upload_stats["upload_rtt_seconds"] = round(time.monotonic() - started, 4)
+        if response.status_code != 200:
+            upload_stats["upload_failures_total"] += 1
+            print(f"SENDER: Lỗi phản hồi từ server: {response.status_code}, {response.text}")
+            return False
+        # Bản ghi bị server từ chối (sai dữ liệu) không gửi lại được nữa, chỉ ghi log rồi bỏ.
+        # Phản hồi không đọc được thì coi như gửi lỗi: gửi lại cả lô không sao vì server ghi đè theo (house_id, ts).
+        try:
+            rejected = [(batch[item["index"]][1], item["error"]) for item in response.json().get("rejected", [])]
+        except (ValueError, KeyError, TypeError, IndexError, AttributeError) as e:
+            upload_stats["upload_failures_total"] += 1
+            print(f"SENDER: Phản hồi từ server không hợp lệ: {e!r}")
+            return False
+        for payload, error in rejected:
+            print(f"SENDER: Server từ chối bản ghi {payload}: {error}")
+        try:
+            outbox.ack([row_id for row_id, _ in batch])
+        except sqlite3.Error as e:
+            print(f"SENDER: Không xóa được bản ghi đã gửi khỏi outbox: {e}")
+            return False
+        if len(batch) < BATCH_SIZE:
+            return True
+        print(f"SENDER: Đã gửi lô {len(batch)} bản ghi tồn, còn {outbox.pending()} bản ghi.")
+
+# Tải cấu hình của nhà yến nếu đã đổi so với etag; lưu vào CONFIG_FILE để các tiến trình khác áp dụng.
+# Trả về etag mới nhất (giữ nguyên nếu 304 hoặc lỗi).
+def sync_config(etag):
+    headers = {"If-None-Match": etag} if etag else {}
+    try:
+        response = session.get(SERVER_CONFIG_URL, params={"house_id": HOUSE_ID}, headers=headers, timeout=10)
+    except requests.exceptions.RequestException as e:
+        print(f"SENDER: Không lấy được cấu hình: {e}")
+        return etag
+    if response.status_code != 200:
+        return etag
+    # Body hỏng thì giữ cấu hình đang dùng và hỏi lại ở lần sau
+    try:
+        data = response.json()
+        version, config = data["version"], data["config"]
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"SENDER: Cấu hình từ server không hợp lệ, giữ cấu hình hiện tại: {e!r}")
+        return etag
+    if version is None or not isinstance(config, dict):
+        print("SENDER: Cấu hình từ server thiếu version hoặc config, giữ cấu hình hiện tại.")
+        return etag
+    try:
+        save_config_file(version, response.headers.get("ETag"), config)
+    except OSError as e:
+        print(f"SENDER: Không lưu được cấu hình: {e}")
+        return etag
+    print(f"SENDER: Đã tải cấu hình phiên bản {version}.")
+    return response.headers.get("ETag")
+
+# Áp dụng cấu hình mới (nhịp gửi, heartbeat, khung giờ bay dùng để chọn nhịp) ngay trong tiến trình đang chạy.
+def apply_config(config):
+    changed = apply_to_module(globals(), CONFIG_KEYS, config)
+    changed += flight_phase.apply_config(config)
+    return changed
+
+# Payload cần đưa vào outbox cho lần đọc này (None nếu không cần gửi); last là các giá trị đã gửi lần trước.
+def live_payload(payload, last, heartbeat_due):
+    if not DELTA_MODE or last is None or heartbeat_due:
+        return payload
+    changed = {f: payload[f] for f in LIVE_FIELDS if payload[f] != last[f]}
+    if not changed:
+        return None
+    changed.update(house_id=payload["house_id"], timestamp=payload["timestamp"], delta=True)
+    return changed
+
+# Số liệu vận hành của thiết bị: đọc các kênh metrics của bird_counter/dht và thêm số liệu của chính tiến trình gửi.
+def device_metrics(metric_channels, outbox, daily_queue):
+    metrics = {}
+    for channel in metric_channels:
+        values = channel.read()[1]
+        if values is not None:
+            metrics.update((k, v) for k, v in values.items() if v is not None)
+    metrics.update((k, v) for k, v in upload_stats.items() if v is not None)
+    metrics["outbox_pending"] = outbox.pending()
+    if daily_queue is not None:
+        try:
+            metrics["daily_queue_depth"] = daily_queue.qsize()
+        except NotImplementedError:
+            pass
+    return metrics
+
+# Ngủ tối đa seconds giây nhưng dậy sớm khi bird_counter công bố số đếm mới (đọc kênh bộ nhớ chung rất rẻ),
+# để con chim đầu tiên sau một quãng nghỉ dài vẫn được báo ngay.
+def wait_for_counters(counters, seconds, version, step):
+    deadline = time.monotonic() + seconds
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(step, remaining))
+        if counters is not None and counters.read()[0] != version:
+            return
 
 # Hàm chính gửi dữ liệu lên server 
-def send_data(bird_queue, dht_queue):
+def send_data(counters, climate, daily_queue, metric_channels=()):
     """
-    Hàm này liên tục chạy để lấy dữ liệu từ các hàng đợi (queue)
+    Hàm này liên tục chạy để lấy giá trị mới nhất từ các kênh bộ nhớ chung (counters, climate)
     và gửi chúng lên server định kỳ.
-    Nó xử lý cả dữ liệu "trực tiếp" (live) và dữ liệu "báo cáo hàng ngày" (daily report).
+    Bản ghi đầy đủ (heartbeat) mang thêm số liệu vận hành của thiết bị đọc từ metric_channels.
+    Báo cáo hàng ngày đến qua daily_queue. Mọi payload qua outbox trên đĩa nên không mất khi mất mạng;
+    khi lỗi, thời gian chờ thử lại tăng gấp đôi (có ngẫu nhiên) đến BACKOFF_MAX.
+    Với DELTA_MODE chỉ gửi khi có thay đổi (và mỗi HEARTBEAT_INTERVAL giây một bản đầy đủ).
+    Nhịp vòng lặp do AdaptiveCadence chọn: dưới một giây khi chim đang bay, vài phút khi ban đêm không đổi gì.
     """
 
     # Biến lưu trữ dữ liệu trực tiếp 
@@ -22,46 +190,49 @@ def send_data(bird_queue, dht_queue):
     live_humidity = None
     live_relay_status = 0
     
-    pending_daily_vao = None
-    pending_daily_ra = None
-    pending_daily_tong = None 
-    pending_daily_report_date = None 
+    outbox = Outbox(OUTBOX_FILE)
+    cadence = AdaptiveCadence(base_interval=SEND_INTERVAL)
+    config_watcher = ConfigWatcher()
+    cached_config = load_config_file()
+    config_etag = cached_config.get("etag") if cached_config else None
+    next_config_sync = 0
+    previous = None
+    counter_version = 0
+    last_sent = None
+    last_full = 0
+    backoff = 0
+    next_attempt = 0
+    if outbox.pending():
+        print(f"SENDER: Còn {outbox.pending()} bản ghi chưa gửi trong outbox.")
 
     try:
         while True:
-            if bird_queue is not None:
-                while not bird_queue.empty(): 
+            daily_packets = []
+            if daily_queue is not None:
+                while not daily_queue.empty(): 
                     try:
-                        packet = bird_queue.get_nowait() 
-                        if isinstance(packet, dict):
-                            if packet.get("daily_report") is True:
-                                pending_daily_vao = packet.get("chimVaoDaily")
-                                pending_daily_ra = packet.get("chimRaDaily")
-                                pending_daily_tong = packet.get("chimTongDaily")
-                                pending_daily_report_date = packet.get("timestamp")
-
-                                live_chim_vao = packet.get("chimVao", live_chim_vao)
-                                live_chim_ra = packet.get("chimRa", live_chim_ra)
-                                live_chim_tong = packet.get("chimTong", live_chim_tong)
-                            else:
-                                live_chim_vao = packet.get("chimVao", live_chim_vao)
-                                live_chim_ra = packet.get("chimRa", live_chim_ra)
-                                live_chim_tong = packet.get("chimTong", live_chim_tong)
+                        packet = daily_queue.get_nowait() 
+                        if isinstance(packet, dict) and packet.get("daily_report") is True:
+                            daily_packets.append(packet)
                     except Exception: 
                         break
 
-            if dht_queue is not None:
-                while not dht_queue.empty(): 
-                    try:
-                        dht_data = dht_queue.get_nowait()
-                        if isinstance(dht_data, dict):
-                            live_temperature = dht_data.get("temperature", live_temperature)
-                            live_humidity = dht_data.get("humidity", live_humidity)
-                            live_relay_status = dht_data.get("relay_status", live_relay_status)
-                    except Exception: 
-                        break
+            if counters is not None:
+                counter_version, bird_data = counters.read()
+                if bird_data is not None:
+                    live_chim_vao = bird_data["chimVao"]
+                    live_chim_ra = bird_data["chimRa"]
+                    live_chim_tong = bird_data["chimTong"]
+
+            if climate is not None:
+                _, dht_data = climate.read()
+                if dht_data is not None:
+                    live_temperature = dht_data["temperature"]
+                    live_humidity = dht_data["humidity"]
+                    live_relay_status = dht_data["relay_status"]
 
             payload = {
+                "house_id": HOUSE_ID,
                 "chimVao": live_chim_vao,
                 "chimRa": live_chim_ra,
                 "chimTong": live_chim_tong,
@@ -70,36 +241,57 @@ def send_data(bird_queue, dht_queue):
                 "relay_status": live_relay_status,
             }
 
-            if pending_daily_report_date is not None:
-                payload["timestamp"] = pending_daily_report_date
-                payload["daily_report"] = True 
-                payload["chimVaoDaily"] = pending_daily_vao
-                payload["chimRaDaily"] = pending_daily_ra
-                payload["chimTongDaily"] = pending_daily_tong
-
-                pending_daily_vao = None
-                pending_daily_ra = None
-                pending_daily_tong = None
-                pending_daily_report_date = None
-            else:
-                now_utc = datetime.now(timezone.utc)
-                now_gmt7 = now_utc.astimezone(GMT7)
-                payload["timestamp"] = now_gmt7.isoformat() 
-
-            try:
-                response = requests.post(SERVER_URL, json=payload, timeout=10) 
-                if response.status_code == 200:
-                    # print(f"SENDER: Gửi thành công: {payload}") 
-                    pass
+            for daily in daily_packets:
+                daily_payload = dict(payload)
+                daily_payload["timestamp"] = daily.get("timestamp")
+                daily_payload["daily_report"] = True 
+                daily_payload["chimVaoDaily"] = daily.get("chimVaoDaily")
+                daily_payload["chimRaDaily"] = daily.get("chimRaDaily")
+                daily_payload["chimTongDaily"] = daily.get("chimTongDaily")
+                queue_payload(outbox, daily_payload)
+
+            now_utc = datetime.now(timezone.utc)
+            now_gmt7 = now_utc.astimezone(GMT7)
+            payload["timestamp"] = now_gmt7.isoformat(timespec='milliseconds') 
+            heartbeat_due = time.monotonic() - last_full >= HEARTBEAT_INTERVAL
+            queued = live_payload(payload, last_sent, heartbeat_due)
+            if queued is not None:
+                if queued is payload:
+                    last_full = time.monotonic()
+                    queued = dict(payload, metrics=device_metrics(metric_channels, outbox, daily_queue))
+                queue_payload(outbox, queued)
+                last_sent = payload
+
+            if time.monotonic() >= next_config_sync:
+                config_etag = sync_config(config_etag)
+                next_config_sync = time.monotonic() + CONFIG_POLL_INTERVAL
+            update = config_watcher.poll()
+            if update is not None:
+                changed = apply_config(update["config"])
+                cadence.base_interval = SEND_INTERVAL
+                if changed:
+                    print(f"SENDER: Áp dụng cấu hình phiên bản {update['version']}: {', '.join(changed)}")
+
+            if time.monotonic() >= next_attempt:
+                if upload_outbox(outbox):
+                    if backoff:
+                        print("SENDER: Đã kết nối lại và gửi hết dữ liệu tồn.")
+                    backoff = 0
                 else:
-                    print(f"SENDER: Lỗi phản hồi từ server: {response.status_code}, {response.text}")
-            except requests.exceptions.RequestException as e: 
-                print(f"SENDER: Không gửi được (lỗi request): {e}")
-            except Exception as e: 
-                print(f"SENDER: Không gửi được (lỗi khác): {e}")
-            time.sleep(10)
+                    backoff = next_backoff(backoff)
+                    next_attempt = time.monotonic() + backoff * random.uniform(0.5, 1.0)
+                    print(f"SENDER: Còn {outbox.pending()} bản ghi chờ gửi, thử lại sau khoảng {backoff}s.")
+            current = {f: payload[f] for f in LIVE_FIELDS}
+            changed = {f for f in LIVE_FIELDS if previous is None or current[f] != previous[f]}
+            previous = current
+            interval = cadence.next_interval(bool(changed & {"chimVao", "chimRa", "chimTong"}), bool(changed),
+                                             get_time_phase(), time.monotonic())
+            wait_for_counters(counters, interval, counter_version, cadence.fast_interval)
 
     except KeyboardInterrupt: 
         print("\nSENDER: Dừng gửi dữ liệu.")
     except Exception as e: 
         print(f"LỖI trong send_to_server: {e}")
+    finally:
+        outbox.close()
+        session.close()
@@ -0,0 +1,19 @@
+import requests
+
+# Địa chỉ server và mã nhà yến, dùng chung cho mọi tiến trình cần gọi server
+SERVER_URL = "http://100.111.53.26:5000"
+SERVER_BATCH_URL = SERVER_URL + "/api/update_batch"
+SERVER_DATA_URL = SERVER_URL + "/api/data"
+SERVER_CONFIG_URL = SERVER_URL + "/api/config"
+HOUSE_ID = "default" # Mã nhà yến, dùng khi nhiều nhà gửi về cùng một server
+
+
+# Giá trị mới nhất server đang giữ cho nhà yến này (dùng khi khôi phục số đếm), None nếu không lấy được.
+# session: phiên HTTP dùng lại kết nối nếu người gọi có sẵn; không có thì gửi một request riêng.
+def fetch_latest(timeout=5, session=None):
+    try:
+        response = (session or requests).get(SERVER_DATA_URL, params={"house_id": HOUSE_ID}, timeout=timeout)
+        return response.json() if response.status_code == 200 else None
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"HTTP: Không lấy được dữ liệu mới nhất từ server: {e}")
+        return None
@@ -0,0 +1,61 @@
+"""
+Mô phỏng adafruit_dht.DHT22 và module board để chạy và đo dht.py trên máy không có Raspberry Pi.
+
+Giá trị đọc được đặt bằng set_climate(temperature, humidity); mỗi giá trị có thể là một số hoặc hàm nhận
+thời điểm time.monotonic() và trả về giá trị. Một lần đọc tốn READ_SECONDS (DHT22 truyền 40 bit trong ~5 ms)
+và hỏng với xác suất ERROR_RATE (RuntimeError như thư viện thật khi sai checksum hoặc hết giờ chờ).
+"""
+import os
+import random
+import time
+import types
+
+READ_SECONDS = 0.005
+# Tỉ lệ đọc hỏng (chỉnh bằng SWIFTLET_SIM_DHT_ERROR_RATE); DHT22 thật hỏng khoảng 5-20% số lần đọc
+ERROR_RATE = float(os.environ.get("SWIFTLET_SIM_DHT_ERROR_RATE", "0.1"))
+
+board = types.SimpleNamespace(D4=4)
+
+_climate = {"temperature": 28.0, "humidity": 80.0}
+
+
+def set_climate(temperature=None, humidity=None):
+    if temperature is not None:
+        _climate["temperature"] = temperature
+    if humidity is not None:
+        _climate["humidity"] = humidity
+
+
+def _value(value, now):
+    return value(now) if callable(value) else value
+
+
+class DHT22:
+    def __init__(self, pin, use_pulseio=True):
+        self.pin = pin
+        self.reads = 0
+        self._rng = random.Random(pin)
+        self._last = None
+
+    def _measure(self):
+        time.sleep(READ_SECONDS)
+        self.reads += 1
+        if self._rng.random() < ERROR_RATE:
+            raise RuntimeError("Checksum did not validate. Try again.")
+        now = time.monotonic()
+        self._last = (_value(_climate["temperature"], now), _value(_climate["humidity"], now))
+
+    @property
+    def temperature(self):
+        self._measure()
+        return self._last[0]
+
+    # Như adafruit_dht: dùng lại kết quả của lần đo gần nhất (lần đọc .temperature)
+    @property
+    def humidity(self):
+        if self._last is None:
+            self._measure()
+        return self._last[1]
+
+    def exit(self):
+        pass
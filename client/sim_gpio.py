@@ -0,0 +1,41 @@
+"""
+Mô phỏng các hàm của RPi.GPIO mà dht.py dùng để điều khiển relay, để chạy và đo trên máy không có Raspberry Pi.
+levels giữ mức hiện tại của từng chân, changes đếm số lần đổi mức (số lần relay bật/tắt).
+"""
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+HIGH = 1
+LOW = 0
+
+levels = {}
+changes = {}
+
+
+def setmode(mode):
+    pass
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(pin, mode, initial=LOW):
+    levels[pin] = initial
+
+
+def output(pin, value):
+    value = HIGH if value else LOW
+    if levels.get(pin) != value:
+        changes[pin] = changes.get(pin, 0) + 1
+    levels[pin] = value
+
+
+def input(pin):
+    return levels.get(pin, LOW)
+
+
+def cleanup(pin=None):
+    for p in ([pin] if pin is not None else list(levels)):
+        levels.pop(p, None)
@@ -0,0 +1,165 @@
+"""
+Mô phỏng một phần API của thư viện pigpio (pi, set_mode, write, read, get_current_tick, gpio_trigger,
+callback, tickDiff) để chạy và đo bird_counter trên máy không có Raspberry Pi / pigpiod.
+
+Mỗi cảm biến siêu âm gắn bằng attach_sensor(trig, echo, distance): sau khi TRIG xuống mức thấp,
+chân ECHO lên mức cao sau ECHO_DELAY_US và giữ trong thời gian tương ứng khoảng cách (cm).
+distance có thể là một số hoặc hàm nhận thời điểm time.monotonic() và trả về khoảng cách.
+Mỗi lệnh gửi tới "pigpiod" tốn CALL_SECONDS CPU (vòng lặp bận) để mô phỏng một lượt socket.
+"""
+import heapq
+import os
+import threading
+import time
+
+INPUT = 0
+OUTPUT = 1
+RISING_EDGE = 0
+FALLING_EDGE = 1
+EITHER_EDGE = 2
+
+# Độ trễ từ khi kết thúc xung TRIG đến khi ECHO lên mức cao (HC-SR04 phát 8 chu kỳ 40kHz)
+ECHO_DELAY_US = 450
+SPEED_OF_SOUND_CM_PER_US = 0.0343
+# Chi phí một lượt gọi pigpiod qua socket trên Pi 4 (chỉnh bằng SWIFTLET_SIM_CALL_US)
+CALL_SECONDS = float(os.environ.get("SWIFTLET_SIM_CALL_US", "50")) / 1e6
+
+_sensors = {}
+_sensors_lock = threading.Lock()
+
+
+def attach_sensor(trig, echo, distance=200.0):
+    with _sensors_lock:
+        _sensors[trig] = (echo, distance)
+
+
+def tickDiff(t1, t2):
+    return (t2 - t1) & 0xFFFFFFFF
+
+
+def _now_tick():
+    return int(time.monotonic() * 1e6) & 0xFFFFFFFF
+
+
+def _spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class _Callback:
+    def __init__(self, pi, gpio, edge, func):
+        self._pi = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func
+        self.count = 0
+
+    def tally(self):
+        return self.count
+
+    def cancel(self):
+        self._pi._remove_callback(self)
+
+
+class pi:
+    def __init__(self, host=None, port=None):
+        self.connected = True
+        self._levels = {}
+        self._pulses = {}
+        self._callbacks = []
+        self._events = []
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run_events, name="sim-pigpio", daemon=True)
+        self._thread.start()
+
+    def _call(self):
+        _spin(CALL_SECONDS)
+
+    def set_mode(self, gpio, mode):
+        self._call()
+        self._levels.setdefault(gpio, 0)
+
+    def write(self, gpio, level):
+        self._call()
+        previous = self._levels.get(gpio, 0)
+        self._levels[gpio] = level
+        if previous == 1 and level == 0:
+            self._fire(gpio, time.monotonic())
+
+    def gpio_trigger(self, gpio, pulse_len=10, level=1):
+        self._call()
+        self._fire(gpio, time.monotonic() + pulse_len / 1e6)
+
+    def read(self, gpio):
+        self._call()
+        pulse = self._pulses.get(gpio)
+        if pulse is not None:
+            start, end = pulse
+            now = time.monotonic()
+            return 1 if start <= now < end else 0
+        return self._levels.get(gpio, 0)
+
+    def get_current_tick(self):
+        self._call()
+        return _now_tick()
+
+    def callback(self, user_gpio, edge=RISING_EDGE, func=None):
+        self._call()
+        cb = _Callback(self, user_gpio, edge, func)
+        with self._cond:
+            self._callbacks.append(cb)
+        return cb
+
+    def _remove_callback(self, cb):
+        with self._cond:
+            if cb in self._callbacks:
+                self._callbacks.remove(cb)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self.connected = False
+
+    # Cảm biến gắn với chân TRIG vừa kết thúc xung: lên lịch xung ECHO tương ứng khoảng cách.
+    def _fire(self, trig, at):
+        with _sensors_lock:
+            sensor = _sensors.get(trig)
+        if sensor is None:
+            return
+        echo, distance = sensor
+        cm = distance(at) if callable(distance) else distance
+        start = at + ECHO_DELAY_US / 1e6
+        end = start + (2 * cm / SPEED_OF_SOUND_CM_PER_US) / 1e6
+        self._pulses[echo] = (start, end)
+        with self._cond:
+            heapq.heappush(self._events, (start, echo, 1))
+            heapq.heappush(self._events, (end, echo, 0))
+            self._cond.notify()
+
+    # Luồng phát sự kiện cạnh, giống luồng callback của pigpio: tick là thời điểm xảy ra cạnh, không phải lúc gọi.
+    def _run_events(self):
+        with self._cond:
+            while self._running:
+                if not self._events:
+                    self._cond.wait()
+                    continue
+                at, gpio, level = self._events[0]
+                delay = at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._events)
+                tick = int(at * 1e6) & 0xFFFFFFFF
+                callbacks = [cb for cb in self._callbacks if cb.gpio == gpio and
+                             (cb.edge == EITHER_EDGE or cb.edge == (RISING_EDGE if level else FALLING_EDGE))]
+                self._cond.release()
+                try:
+                    for cb in callbacks:
+                        cb.count += 1
+                        if cb.func is not None:
+                            cb.func(gpio, level, tick)
+                finally:
+                    self._cond.acquire()
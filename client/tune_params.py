@@ -0,0 +1,190 @@
+"""
+Chấm điểm hàng nghìn bộ ngưỡng đếm chim cùng lúc trên dữ liệu đã ghi (SWIFTLET_RECORD_DIR), so với số đếm thật.
+Mỗi mẫu chỉ được duyệt một lần; trạng thái của mọi bộ tham số (last_active, sự kiện đang chờ, số đếm)
+nằm trong mảng NumPy nên mỗi bước xử lý tất cả các bộ cùng lúc, cùng luật ghép với EventMatcher.
+--workers chia các bộ tham số cho nhiều tiến trình.
+
+Giá trị tham số: danh sách "2,5,8" hoặc khoảng "0.2:0.5:0.02" (start:stop:step, không gồm stop).
+File số đếm thật (JSON): {"in": 1234, "out": 1180} hoặc theo ngày {"2026-10-16": {"in": 600, "out": 590}, ...}
+
+Ví dụ:
+  python tune_params.py recordings/ --truth truth.json --max-interval 0.2:0.5:0.02 --cooldown 0.045,0.06,0.08 \\
+      --near-simultaneous 0.1:0.3:0.05 --max-distance 60,75,89 --top 10
+"""
+import argparse
+import csv
+import itertools
+import json
+import time
+from datetime import date
+from multiprocessing import Pool
+
+import numpy as np
+
+from recorder import read_recordings
+
+NUM_SENSORS = 6
+# Số sự kiện đang chờ tối đa mỗi cảm biến (trong MAX_INTERVAL, cách nhau ít nhất COOLDOWN nên ít khi quá vài cái)
+PENDING_SLOTS = 8
+PARAMS = ("min_distance", "max_distance", "max_interval", "cooldown", "near_simultaneous",
+          "morning_start", "morning_end", "evening_start", "evening_end")
+# Giá trị mặc định giống client/bird_counter.py và client/flight_phase.py
+DEFAULTS = {"min_distance": "2", "max_distance": "89", "max_interval": "0.34", "cooldown": "0.045",
+            "near_simultaneous": "0.2", "morning_start": "4", "morning_end": "10",
+            "evening_start": "15", "evening_end": "20"}
+NEIGHBORS = [np.array([j for j in range(NUM_SENSORS) if j != i and abs(i // 2 - j // 2) <= 1])
+             for i in range(NUM_SENSORS)]
+
+
+def parse_values(text):
+    if ":" in text:
+        start, stop, step = (float(x) for x in text.split(":"))
+        return [round(v, 6) for v in np.arange(start, stop, step)]
+    return [float(x) for x in text.split(",")]
+
+
+def load_samples(directory):
+    rows = list(read_recordings(directory))
+    t = np.array([r[0] for r in rows], dtype=np.float64)
+    order = np.argsort(t, kind="stable")
+    sensors = np.array([r[1] for r in rows], dtype=np.int8)[order]
+    distances = np.array([r[2] for r in rows], dtype=np.float32)[order]
+    return t[order], sensors, distances
+
+
+# Chạy logic đếm cho C bộ tham số cùng lúc; grid là dict tên tham số -> mảng (C,). Trả về (vào, ra) dạng (C, số ngày).
+def evaluate(samples, days, day_index, grid):
+    t_all, sensors, distances = samples
+    C = len(grid["cooldown"])
+    rows = np.arange(C)
+    last_active = np.zeros((C, NUM_SENSORS))
+    pending = np.full((C, NUM_SENSORS, PENDING_SLOTS), np.inf)
+    counts_in = np.zeros((C, len(days)), dtype=np.int64)
+    counts_out = np.zeros((C, len(days)), dtype=np.int64)
+    min_d, max_d = grid["min_distance"], grid["max_distance"]
+    max_interval = grid["max_interval"][:, None, None]
+    near = grid["near_simultaneous"][:, None, None]
+    hours = np.array([time.localtime(t).tm_hour for t in t_all], dtype=np.int8)
+    # Bỏ trước các mẫu không thể là sự kiện với bất kỳ bộ tham số nào
+    keep = (distances > min_d.min()) & (distances < max_d.max())
+
+    for k in np.flatnonzero(keep):
+        t, s, d, h, day = t_all[k], sensors[k], distances[k], hours[k], day_index[k]
+        valid = (t - last_active[:, s] >= grid["cooldown"]) & (min_d < d) & (d < max_d)
+        if not valid.any():
+            continue
+        last_active[valid, s] = t
+        morning = (grid["morning_start"] <= h) & (h < grid["morning_end"])
+        evening = ~morning & (grid["evening_start"] <= h) & (h < grid["evening_end"])
+
+        nb = NEIGHBORS[s]
+        t1 = pending[:, nb, :]
+        present = (t1 != np.inf) & (t - t1 <= max_interval)
+        id1_even = (nb % 2 == 0)[None, :, None]
+        even_time = np.where(id1_even, t1, t)
+        odd_time = np.where(id1_even, t, t1)
+        is_near = np.abs(even_time - odd_time) <= near
+        direction_in = np.where(is_near, evening[:, None, None], even_time < odd_time)
+        decided = present & np.where(is_near, (morning | evening)[:, None, None], True)
+        key = np.where(decided, t1, np.inf).reshape(C, -1)
+        best = key.argmin(axis=1)
+        matched = valid & (key[rows, best] != np.inf)
+
+        m = rows[matched]
+        if len(m):
+            chosen = best[matched]
+            is_in = direction_in.reshape(C, -1)[m, chosen]
+            counts_in[m, day] += is_in
+            counts_out[m, day] += ~is_in
+            pending[m, nb[chosen // PENDING_SLOTS], chosen % PENDING_SLOTS] = np.inf
+
+        w = rows[valid & ~matched]
+        if len(w):
+            slots = pending[w, s, :]
+            free = (slots == np.inf) | (t - slots > grid["max_interval"][w, None])
+            slot = np.where(free.any(axis=1), free.argmax(axis=1), slots.argmin(axis=1))
+            pending[w, s, slot] = t
+    return counts_in, counts_out
+
+
+def _evaluate_chunk(job):
+    samples, days, day_index, grid = job
+    return evaluate(samples, days, day_index, grid)
+
+
+def score(counts_in, counts_out, days, truth):
+    if truth is None:
+        return None
+    if "in" in truth:
+        return np.abs(counts_in.sum(axis=1) - truth["in"]) + np.abs(counts_out.sum(axis=1) - truth["out"])
+    error = np.zeros(len(counts_in), dtype=np.int64)
+    for j, day in enumerate(days):
+        if day in truth:
+            error += np.abs(counts_in[:, j] - truth[day]["in"]) + np.abs(counts_out[:, j] - truth[day]["out"])
+    return error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--truth", help="file JSON số chim vào/ra thật")
+    for name in PARAMS:
+        parser.add_argument("--" + name.replace("_", "-"), default=DEFAULTS[name])
+    parser.add_argument("--workers", type=int, default=1, help="số tiến trình chia các bộ tham số")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--csv", help="ghi kết quả của mọi bộ tham số ra file CSV")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    combos = np.array(list(itertools.product(*(parse_values(getattr(args, name)) for name in PARAMS))))
+    truth = None
+    if args.truth:
+        with open(args.truth) as f:
+            truth = json.load(f)
+    samples = load_samples(args.directory)
+    day_labels = [date.fromtimestamp(t).isoformat() for t in samples[0]]
+    days = sorted(set(day_labels))
+    day_index = np.array([days.index(d) for d in day_labels]) if days else np.zeros(0, dtype=int)
+
+    started = time.perf_counter()
+    chunks = np.array_split(np.arange(len(combos)), max(1, args.workers))
+    jobs = [(samples, days, day_index, {name: combos[chunk, i] for i, name in enumerate(PARAMS)})
+            for chunk in chunks if len(chunk)]
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            results = pool.map(_evaluate_chunk, jobs)
+    else:
+        results = [_evaluate_chunk(job) for job in jobs]
+    counts_in = np.concatenate([r[0] for r in results])
+    counts_out = np.concatenate([r[1] for r in results])
+    elapsed = time.perf_counter() - started
+    errors = score(counts_in, counts_out, days, truth)
+
+    table = []
+    for c in range(len(combos)):
+        row = {name: float(combos[c, i]) for i, name in enumerate(PARAMS)}
+        row["in"] = int(counts_in[c].sum())
+        row["out"] = int(counts_out[c].sum())
+        if errors is not None:
+            row["error"] = int(errors[c])
+        table.append(row)
+    ranked = sorted(table, key=lambda r: r.get("error", 0))
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(ranked[0]))
+            writer.writeheader()
+            writer.writerows(ranked)
+    summary = {"samples": len(samples[0]), "combinations": len(combos), "seconds": round(elapsed, 2),
+               "truth": truth, "top": ranked[:args.top]}
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"TUNE: {len(combos)} bộ tham số trên {len(samples[0])} mẫu trong {elapsed:.1f}s")
+    for row in ranked[:args.top]:
+        params = " ".join(f"{name}={row[name]:g}" for name in PARAMS)
+        error = f"  sai lệch {row['error']}" if "error" in row else ""
+        print(f"TUNE: vào {row['in']:6d} ra {row['out']:6d}{error}  {params}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import queue
+import sqlite3
+
+from metrics import TimedCursor
+
+# Pragma cho SQLite: WAL để đọc không bị chặn bởi ghi, synchronous=NORMAL là đủ an toàn với WAL
+# (chỉ fsync khi checkpoint), cache 16MB và mmap 256MB để truy vấn lịch sử ít phải đọc đĩa.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+# Số câu lệnh đã biên dịch sẵn được giữ lại trên mỗi kết nối.
+CACHED_STATEMENTS = 256
+
+
+class TimedConnection(sqlite3.Connection):
+    """Kết nối mà mọi câu lệnh (kể cả conn.execute) đi qua TimedCursor để đo thời gian từng loại truy vấn."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+
+# Mở kết nối mới đã áp dụng các pragma ở trên.
+def connect(database, factory=TimedConnection):
+    conn = sqlite3.connect(database, check_same_thread=False,
+                           cached_statements=CACHED_STATEMENTS, factory=factory)
+    conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class PooledConnection(TimedConnection):
+    """Kết nối SQLite mà close() trả kết nối về pool thay vì đóng hẳn."""
+
+    pool = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    """
+    Pool kết nối SQLite dùng chung giữa các luồng request.
+    Kết nối được tạo một lần với các pragma ở trên và được dùng lại, nên các request không
+    còn tốn chi phí mở file/đọc schema, và cache câu lệnh đã biên dịch được giữ giữa các request.
+    """
+
+    def __init__(self, database, max_idle=8):
+        self.database = database
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            conn = connect(self.database, factory=PooledConnection)
+            conn.pool = self
+            return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.really_close()
+
+    # Đóng toàn bộ kết nối đang rảnh (ví dụ khi đổi DATABASE_FILE trong benchmark).
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().really_close()
+            except queue.Empty:
+                break
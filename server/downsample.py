@@ -0,0 +1,108 @@
+from functools import partial
+
+import numpy as np
+
+from partitions import parse_timestamp
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+# Các chuỗi số liệu được vẽ trên dashboard; mỗi chuỗi được giữ hình dạng riêng.
+SERIES = ("temperature", "humidity", "chimTong", "chimVao", "chimRa", "relay_status")
+
+
+def _column(rows, key):
+    return np.array([np.nan if row.get(key) is None else row[key] for row in rows], dtype=float)
+
+
+# Trục thời gian (giây) của các dòng: ts của dữ liệu thô, hoặc thời điểm bắt đầu bucket của dữ liệu tổng hợp.
+def _times(rows):
+    if "ts" in rows[0]:
+        return np.array([row["ts"] for row in rows], dtype=float) / 1000
+    return np.array([parse_timestamp(row["timestamp"]).timestamp() for row in rows], dtype=float)
+
+
+# Thay NaN bằng giá trị trung bình để không ảnh hưởng việc chọn điểm.
+def _fill_nan(y):
+    mask = np.isnan(y)
+    if not mask.any():
+        return y
+    if mask.all():
+        return np.zeros_like(y)
+    y = y.copy()
+    y[mask] = np.nanmean(y)
+    return y
+
+
+def lttb_indices(y, n_out, x=None):
+    """
+    Largest-Triangle-Three-Buckets: chọn n_out chỉ số giữ hình dạng đường cong.
+    x là thời điểm của các mẫu (mặc định là vị trí mẫu); cần thời điểm thật vì thiết bị gửi không đều
+    (chỉ gửi khi có thay đổi) và dữ liệu có khoảng trống. Trung bình các bucket được tính
+    vector hóa bằng reduceat; vòng lặp chỉ chạy theo số bucket (n_out), không theo số dòng.
+    """
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+
+    y = _fill_nan(y)
+    x = np.arange(n, dtype=float) if x is None else np.asarray(x, dtype=float)
+    # n_out - 2 bucket nằm giữa điểm đầu và điểm cuối: [edges[i], edges[i+1])
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - next_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[i] - ay))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, n_out):
+    """Giữ điểm nhỏ nhất và lớn nhất của mỗi bucket (hoàn toàn vector hóa), cộng điểm đầu và cuối."""
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    buckets = (n_out - 2) // 2
+    if buckets < 1:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+
+    y = _fill_nan(y)
+    bucket_ids = (np.arange(n) * buckets) // n
+    # Sắp theo (bucket, giá trị): phần tử đầu mỗi bucket là min, phần tử cuối là max
+    order = np.lexsort((y, bucket_ids))
+    starts = np.searchsorted(bucket_ids, np.arange(buckets))
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate([order[starts], order[ends], [0, n - 1]]))
+
+
+# Giảm số dòng xuống tối đa max_points, chia đều ngân sách điểm cho các chuỗi số liệu.
+def downsample_rows(rows, max_points, method="lttb", series=SERIES):
+    if max_points is None or len(rows) <= max_points:
+        return rows
+    present = [key for key in series if key in rows[0]]
+    if not present:
+        return rows[:max_points]
+
+    pick = partial(lttb_indices, x=_times(rows)) if method == "lttb" else minmax_indices
+    columns = [_column(rows, key) for key in present]
+    budget = max_points // len(present)
+    selected = np.unique(np.concatenate([pick(y, budget) for y in columns]))
+    # Các chuỗi thường trùng điểm nhau; tăng dần ngân sách khi hợp các chỉ số vẫn còn dưới max_points
+    while budget < len(rows):
+        budget = min(int(budget * 1.5) + 1, len(rows))
+        candidate = np.unique(np.concatenate([pick(y, budget) for y in columns]))
+        if len(candidate) > max_points:
+            break
+        selected = candidate
+    return [rows[i] for i in selected]
@@ -0,0 +1,15 @@
+# Cấu hình gunicorn cho server production. Các giá trị có thể đổi bằng biến môi trường.
+import multiprocessing
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get("SWIFTLET_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("SWIFTLET_WORKERS", min(4, multiprocessing.cpu_count())))
+# Mỗi dashboard giữ một kết nối SSE (/api/stream) nên cần nhiều luồng trên mỗi worker
+worker_class = "gthread"
+threads = int(os.environ.get("SWIFTLET_THREADS", 64))
+# Khởi tạo/migrate DB một lần ở tiến trình master trước khi fork
+preload_app = True
+timeout = 30
+keepalive = 5
+accesslog = os.environ.get("SWIFTLET_ACCESS_LOG")
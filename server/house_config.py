@@ -0,0 +1,119 @@
+import json
+from datetime import datetime, timezone
+
+# Các tham số thiết bị chỉnh được từ xa và giá trị mặc định (giống hằng số trong client/).
+# Chân GPIO và địa chỉ server không nằm ở đây: đổi sai từ xa là mất kết nối tới thiết bị.
+DEFAULT_CONFIG = {
+    # client/dht.py
+    "humidity_threshold_on": 79.0,
+    "humidity_threshold_off": 82.0,
+    "relay_min_on": 30.0,
+    "relay_min_off": 30.0,
+    # client/bird_counter.py
+    "min_distance": 2.0,
+    "max_distance": 89.0,
+    "max_interval": 0.34,
+    "cooldown": 0.045,
+    "near_simultaneous": 0.2,
+    # client/flight_phase.py
+    "morning_start": 4,
+    "morning_end": 10,
+    "evening_start": 15,
+    "evening_end": 20,
+    # client/send_to_server.py
+    "send_interval": 10.0,
+    "heartbeat_interval": 300.0,
+}
+
+# Khoảng giá trị hợp lệ (min, max) của từng tham số
+CONFIG_LIMITS = {
+    "humidity_threshold_on": (0, 100),
+    "humidity_threshold_off": (0, 100),
+    "relay_min_on": (0, 3600),
+    "relay_min_off": (0, 3600),
+    "min_distance": (0, 400),
+    "max_distance": (0, 400),
+    "max_interval": (0.01, 5),
+    "cooldown": (0, 5),
+    "near_simultaneous": (0, 5),
+    "morning_start": (0, 24),
+    "morning_end": (0, 24),
+    "evening_start": (0, 24),
+    "evening_end": (0, 24),
+    "send_interval": (0.5, 3600),
+    "heartbeat_interval": (10, 86400),
+}
+
+# Chỉ lưu các giá trị khác mặc định của từng nhà; version tăng mỗi lần đổi, dùng làm ETag.
+UPSERT_HOUSE_CONFIG_SQL = '''
+    INSERT INTO house_config (house_id, config, version, updated_at) VALUES (?, ?, 1, ?)
+    ON CONFLICT(house_id) DO UPDATE SET
+        config = excluded.config,
+        version = version + 1,
+        updated_at = excluded.updated_at
+'''
+
+
+def create_config_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS house_config (
+            house_id TEXT PRIMARY KEY,
+            config TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+
+# Cấu hình đầy đủ của một nhà yến: (version, updated_at dạng datetime hoặc None, dict cấu hình).
+def get_house_config(conn, house_id):
+    row = conn.execute("SELECT config, version, updated_at FROM house_config WHERE house_id = ?",
+                       (house_id,)).fetchone()
+    config = dict(DEFAULT_CONFIG)
+    if row is None:
+        return 0, None, config
+    config.update(json.loads(row[0]))
+    return row[1], datetime.fromisoformat(row[2]), config
+
+
+# Kiểm tra các thay đổi gửi lên (sau khi gộp vào cấu hình hiện tại), trả về thông báo lỗi hoặc None.
+def validate_config(changes, merged):
+    if not isinstance(changes, dict) or not changes:
+        return "Cấu hình không hợp lệ: Không có dữ liệu"
+    for key, value in changes.items():
+        if key not in DEFAULT_CONFIG:
+            return f"Cấu hình không hợp lệ: Không có tham số '{key}'"
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"Cấu hình không hợp lệ: '{key}' phải là số"
+        low, high = CONFIG_LIMITS[key]
+        if not low <= value <= high:
+            return f"Cấu hình không hợp lệ: '{key}' phải trong khoảng [{low}, {high}]"
+    if merged["humidity_threshold_on"] >= merged["humidity_threshold_off"]:
+        return "Cấu hình không hợp lệ: humidity_threshold_on phải nhỏ hơn humidity_threshold_off"
+    if merged["min_distance"] >= merged["max_distance"]:
+        return "Cấu hình không hợp lệ: min_distance phải nhỏ hơn max_distance"
+    if merged["morning_start"] > merged["morning_end"] or merged["evening_start"] > merged["evening_end"]:
+        return "Cấu hình không hợp lệ: giờ bắt đầu phải trước giờ kết thúc"
+    return None
+
+
+# Gộp thay đổi vào cấu hình của nhà yến (giá trị null = trở về mặc định); người gọi tự commit.
+# Trả về (version, updated_at, cấu hình mới) hoặc ném ValueError nếu không hợp lệ.
+def update_house_config(conn, house_id, changes):
+    row = conn.execute("SELECT config FROM house_config WHERE house_id = ?", (house_id,)).fetchone()
+    overrides = json.loads(row[0]) if row else {}
+    if isinstance(changes, dict):
+        for key, value in changes.items():
+            if value is None:
+                overrides.pop(key, None)
+            else:
+                overrides[key] = value
+    merged = dict(DEFAULT_CONFIG, **overrides)
+    error = validate_config(changes, merged)
+    if error:
+        raise ValueError(error)
+    now = datetime.now(timezone.utc).isoformat()
+    conn.execute(UPSERT_HOUSE_CONFIG_SQL, (house_id, json.dumps(overrides), now))
+    return get_house_config(conn, house_id)
@@ -0,0 +1,348 @@
+import json
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from metrics import BATCH_BUCKETS, registry
+from partitions import ensure_partition, epoch_ms, parse_timestamp, partition_for_ms
+from rollup import refresh_extremes, update_rollups
+
+# Nhà yến mặc định cho các thiết bị cũ không gửi house_id.
+DEFAULT_HOUSE_ID = "default"
+
+READING_FIELDS = ("chimVao", "chimRa", "chimTong", "temperature", "humidity", "relay_status")
+DAILY_FIELDS = ("chimVaoDaily", "chimRaDaily", "chimTongDaily")
+# SQLite chỉ lưu được số nguyên 64 bit có dấu; số lớn hơn làm executemany ném OverflowError.
+SQLITE_INT_MIN = -2 ** 63
+SQLITE_INT_MAX = 2 ** 63 - 1
+
+UPSERT_READING_SQL = '''
+    INSERT INTO {table} (house_id, ts, chimVao, chimRa, chimTong, temperature, humidity, relay_status, daily_report)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(house_id, ts) DO UPDATE SET
+        chimVao=excluded.chimVao,
+        chimRa=excluded.chimRa,
+        chimTong=excluded.chimTong,
+        temperature=excluded.temperature,
+        humidity=excluded.humidity,
+        relay_status=excluded.relay_status,
+        daily_report=excluded.daily_report
+'''
+
+UPSERT_DAILY_REPORT_SQL = '''
+    INSERT INTO daily_reports (house_id, date, chimVaoDaily, chimRaDaily, chimTongDaily)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(house_id, date) DO UPDATE SET
+        chimVaoDaily=excluded.chimVaoDaily,
+        chimRaDaily=excluded.chimRaDaily,
+        chimTongDaily=excluded.chimTongDaily
+'''
+
+# Phiên bản dữ liệu của từng nhà yến, tăng mỗi lần ghi; dùng làm ETag/Last-Modified cho các API lịch sử.
+UPSERT_HOUSE_VERSION_SQL = '''
+    INSERT INTO house_versions (house_id, version, updated_at) VALUES (?, 1, ?)
+    ON CONFLICT(house_id) DO UPDATE SET
+        version = version + 1,
+        updated_at = excluded.updated_at
+'''
+
+
+# Giá trị mới nhất (đã gộp các trường) của từng nhà yến, dùng chung giữa nhiều worker.
+# seq tăng dần trên toàn bảng để mỗi worker biết dòng nào đã thay đổi kể từ lần đồng bộ trước.
+UPSERT_LATEST_SQL = '''
+    INSERT INTO latest_readings (house_id, payload, seq)
+    VALUES (?, ?, (SELECT coalesce(max(seq), 0) + 1 FROM latest_readings))
+    ON CONFLICT(house_id) DO UPDATE SET
+        payload = excluded.payload,
+        seq = excluded.seq
+'''
+
+
+def create_ingest_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS house_versions (
+            house_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS latest_readings (
+            house_id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            seq INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_latest_readings_seq ON latest_readings (seq);")
+
+
+# Đọc phiên bản dữ liệu của một nhà yến: (version, updated_at dạng datetime) hoặc (0, None).
+def get_house_version(conn, house_id):
+    row = conn.execute("SELECT version, updated_at FROM house_versions WHERE house_id = ?", (house_id,)).fetchone()
+    if row is None:
+        return 0, None
+    return row[0], datetime.fromisoformat(row[1])
+
+
+# Gộp các bản ghi mới vào latest_readings. Gọi sau khi đã ghi readings trong cùng giao dịch,
+# nên khóa ghi đã được giữ và không worker nào khác chen vào giữa lúc đọc và ghi.
+def merge_latest(cursor, house_readings):
+    merged = {}
+    for house_id, data in house_readings:
+        merged.setdefault(house_id, {}).update(data)
+    houses = list(merged)
+    placeholders = ",".join("?" * len(houses))
+    cursor.execute(f"SELECT house_id, payload FROM latest_readings WHERE house_id IN ({placeholders})", houses)
+    for house_id, payload in cursor.fetchall():
+        current = json.loads(payload)
+        current.update(merged[house_id])
+        merged[house_id] = current
+    cursor.executemany(UPSERT_LATEST_SQL, [(house_id, json.dumps(data)) for house_id, data in merged.items()])
+
+
+# Kiểm tra một bản ghi gửi lên, trả về thông báo lỗi hoặc None nếu hợp lệ.
+def validate_reading(data):
+    if not data or not isinstance(data, dict):
+        return "Dữ liệu không hợp lệ: Không có dữ liệu"
+    if "timestamp" not in data:
+        return "Dữ liệu không hợp lệ: Thiếu timestamp"
+    if parse_timestamp(data["timestamp"]) is None:
+        return "Dữ liệu không hợp lệ: timestamp không đúng định dạng ISO 8601"
+    for field in READING_FIELDS + DAILY_FIELDS:
+        value = data.get(field)
+        # Bảng tổng hợp nhân giá trị với thời gian hiệu lực nên chỉ nhận số (bool của relay_status là int)
+        if value is not None and not isinstance(value, (int, float)):
+            return f"Dữ liệu không hợp lệ: {field} phải là số"
+        if isinstance(value, int) and not SQLITE_INT_MIN <= value <= SQLITE_INT_MAX:
+            return f"Dữ liệu không hợp lệ: {field} vượt quá giới hạn số nguyên 64 bit"
+    return None
+
+
+# Giới hạn kích thước sau giải nén để một body gzip nhỏ không thể bung ra chiếm hết bộ nhớ.
+MAX_DECOMPRESSED_BYTES = 32 * 1024 * 1024
+
+
+# Giải mã body JSON, hỗ trợ Content-Encoding: gzip (lô dữ liệu tồn từ outbox của thiết bị). Lỗi -> ValueError.
+def decode_json_body(body, content_encoding=None):
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_DECOMPRESSED_BYTES)
+        except zlib.error as e:
+            raise ValueError(f"gzip không hợp lệ: {e}")
+        if decompressor.unconsumed_tail:
+            raise ValueError("Dữ liệu giải nén quá lớn")
+    elif encoding != "identity":
+        raise ValueError(f"Không hỗ trợ Content-Encoding: {encoding}")
+    return json.loads(body)
+
+
+def get_house_id(data):
+    return str(data.get("house_id") or DEFAULT_HOUSE_ID)
+
+
+def upsert_reading_sql(table):
+    return UPSERT_READING_SQL.format(table=table)
+
+
+# Bản ghi "delta": true chỉ chứa các trường đã đổi; bổ sung các trường còn lại từ giá trị mới nhất
+# của nhà yến (latest_readings, rồi các bản ghi trước đó trong cùng lô) để bảng readings luôn có đủ cột.
+def resolve_deltas(cursor, readings):
+    houses = {get_house_id(data) for data in readings if data.get("delta") is True}
+    if not houses:
+        return readings
+    placeholders = ",".join("?" * len(houses))
+    cursor.execute(f"SELECT house_id, payload FROM latest_readings WHERE house_id IN ({placeholders})", list(houses))
+    state = {house_id: json.loads(payload) for house_id, payload in cursor.fetchall()}
+    resolved = []
+    for data in readings:
+        house_id = get_house_id(data)
+        current = state.setdefault(house_id, {})
+        if data.get("delta") is True:
+            full = {f: current.get(f) for f in READING_FIELDS}
+            full.update((k, v) for k, v in data.items() if k != "delta")
+            data = full
+        current.update(data)
+        resolved.append(data)
+    return resolved
+
+
+# Ghi nhiều bản ghi (có thể của nhiều nhà yến) bằng executemany theo từng phân vùng tháng; người gọi tự commit.
+# Trả về house_id -> (phiên bản dữ liệu mới của nhà, các bản ghi đã ghi với delta đã bổ sung đủ trường).
+def write_readings(conn, readings):
+    partition_rows = {}
+    house_readings = []
+    daily_rows = []
+    cursor = conn.cursor()
+    readings = resolve_deltas(cursor, readings)
+    for data in readings:
+        house_id = get_house_id(data)
+        house_readings.append((house_id, data))
+        ts = epoch_ms(data["timestamp"])
+        is_daily = data.get("daily_report") is True
+        row = (house_id, ts) + tuple(data.get(f) for f in READING_FIELDS) + (1 if is_daily else 0,)
+        partition_rows.setdefault(partition_for_ms(ts), []).append(row)
+
+        if is_daily:
+            report_date = data["timestamp"].split('T')[0]
+            daily = tuple(data.get(f) for f in DAILY_FIELDS)
+            if None not in daily:
+                daily_rows.append((house_id, report_date) + daily)
+                print(f"SERVER: Đã lưu/cập nhật báo cáo hàng ngày cho {house_id}/{report_date}")
+            else:
+                print(f"SERVER: Nhận cờ daily_report nhưng thiếu dữ liệu đếm hàng ngày cho {house_id}/{report_date}.")
+
+    # Bảng tổng hợp đọc các mẫu đã lưu quanh các bản ghi mới nên phải cập nhật trước khi ghi dữ liệu thô
+    changed = update_rollups(cursor, house_readings) if house_readings else []
+    for table, rows in partition_rows.items():
+        ensure_partition(cursor, table)
+        cursor.executemany(upsert_reading_sql(table), rows)
+    if changed:
+        refresh_extremes(cursor, changed)
+    if house_readings:
+        merge_latest(cursor, house_readings)
+    if daily_rows:
+        cursor.executemany(UPSERT_DAILY_REPORT_SQL, daily_rows)
+    written = {}
+    for house_id, data in house_readings:
+        written.setdefault(house_id, []).append(data)
+    versions = {}
+    if written:
+        now = datetime.now(timezone.utc).isoformat()
+        cursor.executemany(UPSERT_HOUSE_VERSION_SQL, [(house_id, now) for house_id in written])
+        placeholders = ",".join("?" * len(written))
+        versions = dict(cursor.execute(f"SELECT house_id, version FROM house_versions WHERE house_id IN ({placeholders})",
+                                       list(written)).fetchall())
+    registry.inc("swiftlet_ingest_rows_total", len(house_readings))
+    registry.observe("swiftlet_ingest_batch_rows", len(house_readings), buckets=BATCH_BUCKETS)
+    return {house_id: (versions[house_id], rows) for house_id, rows in written.items()}
+
+
+class _PendingWrite:
+    __slots__ = ("reading", "done", "error", "claimed", "cancelled")
+
+    def __init__(self, reading):
+        self.reading = reading
+        self.done = threading.Event()
+        self.error = None
+        # claimed: luồng ghi đã lấy vào một lô; cancelled: request đã hết thời gian chờ trước đó, bỏ qua
+        self.claimed = False
+        self.cancelled = False
+
+
+class WriteCoalescer:
+    """
+    Gom các POST /api/update đơn lẻ đến cùng lúc thành một giao dịch (group commit).
+    Một luồng nền giữ một kết nối riêng; mỗi request chờ đến khi lô chứa nó được commit,
+    nên độ bền dữ liệu vẫn như ghi trực tiếp nhưng chỉ tốn một lần commit/fsync cho cả lô.
+    on_commit (nếu có) được gọi trong luồng ghi với kết quả của write_readings sau mỗi lần commit.
+    """
+
+    def __init__(self, connect, linger=0, max_batch=500, on_commit=None):
+        self._connect = connect
+        self._on_commit = on_commit
+        self._linger = linger
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._claim_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="ingest-coalescer", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    # Đưa một bản ghi vào hàng đợi và chờ commit. Trả về True nếu đã ghi thành công.
+    # Hết thời gian chờ mà bản ghi còn trong hàng đợi thì hủy nó, để request trả lỗi thì dữ liệu chắc chắn
+    # không được ghi (thiết bị sẽ gửi lại); nếu luồng ghi đã lấy nó thì chờ kết quả của lô đó
+    # (giới hạn bởi busy_timeout của SQLite).
+    def submit(self, reading, timeout=5.0):
+        self._ensure_started()
+        pending = _PendingWrite(reading)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            with self._claim_lock:
+                pending.cancelled = not pending.claimed
+            if pending.cancelled:
+                print("SERVER: Hết thời gian chờ ghi lô dữ liệu vào DB, đã hủy bản ghi.")
+                return False
+            pending.done.wait()
+        return pending.error is None
+
+    # Giữ lại các bản ghi chưa bị hủy và đánh dấu đã lấy, để submit không hủy được nữa.
+    def _claim(self, batch):
+        with self._claim_lock:
+            batch = [p for p in batch if not p.cancelled]
+            for p in batch:
+                p.claimed = True
+        return batch
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._linger
+        while len(batch) < self._max_batch:
+            # Lấy ngay những gì đã xếp hàng trong lúc commit trước đang chạy
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    # Ghi một lô trong một giao dịch; trả về lỗi (đã rollback) hoặc None.
+    def _write(self, conn, batch):
+        try:
+            written = write_readings(conn, [p.reading for p in batch])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return e
+        if self._on_commit is not None:
+            # Dữ liệu đã commit: lỗi ở đây không được báo thành ghi thất bại
+            try:
+                self._on_commit(written)
+            except Exception as e:
+                print(f"SERVER: Lỗi xử lý sau khi ghi lô dữ liệu: {e}")
+        return None
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = self._claim(self._collect_batch())
+            if not batch:
+                continue
+            try:
+                error = self._write(conn, batch)
+                if error is not None and len(batch) > 1:
+                    # Một bản ghi hỏng không được kéo theo cả lô: ghi lại từng bản ghi, chỉ từ chối bản ghi lỗi
+                    print(f"SERVER: Lỗi ghi lô {len(batch)} bản ghi vào DB ({error}), ghi lại từng bản ghi.")
+                    for p in batch:
+                        p.error = self._write(conn, [p])
+                else:
+                    for p in batch:
+                        p.error = error
+                for p in batch:
+                    if p.error is not None:
+                        print(f"SERVER: Không ghi được bản ghi của {get_house_id(p.reading)}: {p.error}")
+            except Exception as e:
+                # Luồng ghi không được chết: mọi request sau đó sẽ chờ hết thời gian rồi mất dữ liệu
+                print(f"SERVER: Lỗi không xác định khi ghi lô dữ liệu: {e}")
+                for p in batch:
+                    p.error = p.error or e
+            for p in batch:
+                p.done.set()
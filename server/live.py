@@ -0,0 +1,75 @@
+import json
+import queue
+import threading
+
+# Gửi dòng chú thích định kỳ để giữ kết nối và phát hiện client đã ngắt.
+HEARTBEAT_SECONDS = 15
+# Mỗi subscriber chỉ cần giá trị mới nhất; hàng đợi nhỏ, đầy thì bỏ bản cũ.
+SUBSCRIBER_QUEUE_SIZE = 4
+
+
+class LiveBroker:
+    """
+    Phát dữ liệu mới nhất tới các dashboard đang mở qua Server-Sent Events, theo kênh từng nhà yến.
+    update_sensor_data gọi publish() mỗi khi nhận dữ liệu; không còn dashboard nào phải hỏi 5 giây một lần.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._seq = 0
+
+    def subscribe(self, channel):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            subscribers = self._channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._channels[channel]
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(s) for s in self._channels.values())
+
+    def publish(self, channel, data):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+            if not subscribers:
+                return
+            self._seq += 1
+            message = (self._seq, json.dumps(data))
+        for q in subscribers:
+            while True:
+                try:
+                    q.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    # Sinh luồng SSE cho một subscriber: gửi ngay giá trị hiện tại, sau đó mỗi lần có dữ liệu mới.
+    def event_stream(self, channel, initial=None):
+        q = self.subscribe(channel)
+        try:
+            yield "retry: 3000\n\n"
+            if initial:
+                yield f"data: {json.dumps(initial)}\n\n"
+            while True:
+                try:
+                    seq, payload = q.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"id: {seq}\ndata: {payload}\n\n"
+        finally:
+            self.unsubscribe(channel, q)
@@ -0,0 +1,233 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Mốc (giây) của các histogram thời gian, từ 1 ms đến 10 s.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Ảnh chụp số liệu của một worker quá chừng này giây không cập nhật thì coi như worker đã chết.
+SNAPSHOT_MAX_AGE = 120
+
+HELP = {
+    "swiftlet_http_requests_total": ("counter", "Số request HTTP theo route, method và mã trạng thái"),
+    "swiftlet_http_request_duration_seconds": ("histogram", "Thời gian xử lý request HTTP theo route"),
+    "swiftlet_db_query_duration_seconds": ("histogram", "Thời gian execute câu lệnh SQLite theo loại và bảng"),
+    "swiftlet_ingest_rows_total": ("counter", "Số bản ghi đã ghi vào readings"),
+    "swiftlet_ingest_batch_rows": ("histogram", "Số bản ghi trong mỗi giao dịch ghi (group commit)"),
+    "swiftlet_retention_runs_total": ("counter", "Số lượt dọn dữ liệu cũ"),
+    "swiftlet_retention_deleted_rows_total": ("counter", "Số dòng đã xóa khi dọn dữ liệu cũ theo bảng"),
+    "swiftlet_retention_last_duration_seconds": ("gauge", "Thời gian lượt dọn dữ liệu gần nhất"),
+    "swiftlet_ring_cache_hits_total": ("counter", "Số truy vấn lịch sử trả từ bộ nhớ"),
+    "swiftlet_ring_cache_refreshes_total": ("counter", "Số lần bộ nhớ lịch sử đọc thêm từ DB"),
+    "swiftlet_ring_cache_appends_total": ("counter", "Số lần ghi của chính worker được nối vào bộ nhớ lịch sử"),
+    "swiftlet_metrics_workers": ("gauge", "Số worker có số liệu trong lần xuất này"),
+    # Số liệu thiết bị gửi kèm bản ghi đầy đủ (trường "metrics"), nhãn house_id
+    "swiftlet_device_sweep_rate": ("gauge", "Số vòng quét cảm biến siêu âm mỗi giây"),
+    "swiftlet_device_sweep_seconds_avg": ("gauge", "Thời gian trung bình một vòng quét"),
+    "swiftlet_device_sweep_seconds_max": ("gauge", "Thời gian dài nhất của một vòng quét"),
+    "swiftlet_device_echo_timeouts_total": ("counter", "Số lần đo khoảng cách không nhận được ECHO hợp lệ (999)"),
+    "swiftlet_device_event_queue_depth": ("gauge", "Số sự kiện chờ ghép lớn nhất trong hàng đợi"),
+    "swiftlet_device_dht_reads_total": ("counter", "Số lần đọc DHT22"),
+    "swiftlet_device_dht_errors_total": ("counter", "Số lần đọc DHT22 bị lỗi"),
+    "swiftlet_device_upload_rtt_seconds": ("gauge", "Thời gian khứ hồi của lần gửi lô gần nhất"),
+    "swiftlet_device_upload_failures_total": ("counter", "Số lần gửi lô thất bại"),
+    "swiftlet_device_outbox_pending": ("gauge", "Số bản ghi chờ gửi trong outbox"),
+    "swiftlet_device_daily_queue_depth": ("gauge", "Số báo cáo hàng ngày chờ trong hàng đợi"),
+}
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF (?:NOT )?EXISTS)?)\s+([A-Za-z_][A-Za-z0-9_]*)", re.I)
+_PARTITION_PATTERN = re.compile(r"^readings_p\d{6}$")
+_DEVICE_NAME_PATTERN = re.compile(r"^[a-z][a-z0-9_]{0,63}$")
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """
+    Bộ đếm, gauge và histogram trong bộ nhớ của một tiến trình, xuất theo định dạng text của Prometheus.
+    snapshot()/merge() cho phép cộng số liệu của nhiều worker gunicorn (qua bảng metrics_snapshots).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {"buckets": list(buckets), "counts": [0] * len(buckets),
+                                               "sum": 0.0, "count": 0}
+            for i, bound in enumerate(hist["buckets"]):
+                if value <= bound:
+                    hist["counts"][i] += 1
+                    break
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                "gauges": [[name, dict(labels), value] for (name, labels), value in self.gauges.items()],
+                "histograms": [[name, dict(labels), dict(h, counts=list(h["counts"]))]
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+
+# Cộng các ảnh chụp của nhiều worker: counter và histogram cộng lại, gauge lấy giá trị lớn nhất.
+def merge(snapshots):
+    merged = MetricsRegistry()
+    for snap in snapshots:
+        for name, labels, value in snap["counters"]:
+            merged.inc(name, value, **labels)
+        for name, labels, value in snap["gauges"]:
+            key = _key(name, labels)
+            merged.gauges[key] = max(value, merged.gauges.get(key, value))
+        for name, labels, hist in snap["histograms"]:
+            key = _key(name, labels)
+            current = merged.histograms.get(key)
+            if current is None or current["buckets"] != hist["buckets"]:
+                merged.histograms[key] = dict(hist, counts=list(hist["counts"]))
+                continue
+            current["counts"] = [a + b for a, b in zip(current["counts"], hist["counts"])]
+            current["sum"] += hist["sum"]
+            current["count"] += hist["count"]
+    return merged
+
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Định dạng text exposition 0.0.4 của Prometheus.
+def render(registry):
+    lines = []
+    families = {}
+    for (name, labels), value in registry.counters.items():
+        families.setdefault(name, []).append(("counter", labels, value))
+    for (name, labels), value in registry.gauges.items():
+        families.setdefault(name, []).append(("gauge", labels, value))
+    for (name, labels), hist in registry.histograms.items():
+        families.setdefault(name, []).append(("histogram", labels, hist))
+    for name in sorted(families):
+        kind, text = HELP.get(name, (families[name][0][0], name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for kind, labels, value in sorted(families[name], key=lambda item: item[1]):
+            if kind != "histogram":
+                lines.append(f"{name}{_labels_text(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(value["buckets"], value["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels_text(labels, [('le', _number(float(bound)))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels_text(labels, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {_number(value['sum'])}")
+            lines.append(f"{name}_count{_labels_text(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+# Thêm số liệu thiết bị (trường "metrics" trong dữ liệu mới nhất của từng nhà yến) dưới dạng swiftlet_device_<tên>.
+def add_device_metrics(target, latest_by_house):
+    for house_id, data in list(latest_by_house.items()):
+        metrics = data.get("metrics") if isinstance(data, dict) else None
+        if not isinstance(metrics, dict):
+            continue
+        for name, value in metrics.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not _DEVICE_NAME_PATTERN.match(name):
+                continue
+            target.set(f"swiftlet_device_{name}", value, house_id=house_id)
+
+
+# Nhãn ít giá trị cho một câu SQL: loại lệnh và bảng đầu tiên (các phân vùng tháng gộp thành readings_p*).
+_statement_labels = {}
+
+
+def statement_labels(sql):
+    labels = _statement_labels.get(sql)
+    if labels is None:
+        words = sql.split(None, 1)
+        kind = words[0].upper() if words else ""
+        match = _TABLE_PATTERN.search(sql)
+        table = match.group(1) if match else ""
+        if _PARTITION_PATTERN.match(table):
+            table = "readings_p*"
+        labels = {"statement": kind, "table": table}
+        if len(_statement_labels) < 4096:
+            _statement_labels[sql] = labels
+    return labels
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor ghi thời gian execute/executemany vào registry (không tính thời gian fetch)."""
+
+    def execute(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            registry.observe("swiftlet_db_query_duration_seconds", time.perf_counter() - started,
+                             **statement_labels(sql))
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            registry.observe("swiftlet_db_query_duration_seconds", time.perf_counter() - started,
+                             **statement_labels(sql))
+
+
+def create_metrics_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS metrics_snapshots (
+            pid INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            updated REAL NOT NULL
+        )
+    ''')
+
+
+# Ghi ảnh chụp của worker hiện tại để worker nào nhận request /metrics cũng cộng được số liệu của mọi worker.
+def publish_snapshot(conn):
+    conn.execute("INSERT OR REPLACE INTO metrics_snapshots (pid, payload, updated) VALUES (?, ?, ?)",
+                 (os.getpid(), json.dumps(registry.snapshot()), time.time()))
+    conn.execute("DELETE FROM metrics_snapshots WHERE updated < ?", (time.time() - SNAPSHOT_MAX_AGE,))
+
+
+def collect_snapshots(conn):
+    rows = conn.execute("SELECT payload FROM metrics_snapshots WHERE updated >= ?",
+                        (time.time() - SNAPSHOT_MAX_AGE,)).fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,45 @@
+"""
+Chuyển một DB có sẵn sang lược đồ gọn: ts INTEGER (epoch mili giây), WITHOUT ROWID, khóa (house_id, ts).
+Server cũng tự chuyển khi khởi động; công cụ này để chạy trước một lần (ví dụ khi server đang dừng)
+và in dung lượng trước/sau. --vacuum chạy VACUUM sau khi chuyển để thu nhỏ file ngay.
+
+Ví dụ:
+  python migrate_db.py
+  python migrate_db.py /path/to/swiftlet_data.db --vacuum
+"""
+import argparse
+import os
+import sqlite3
+
+import server
+
+
+def file_size(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", nargs="?", default=server.DATABASE_FILE)
+    parser.add_argument("--vacuum", action="store_true", help="chạy VACUUM sau khi chuyển")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"không tìm thấy {args.database}")
+    before = file_size(args.database)
+    server.DATABASE_FILE = args.database
+    server.init_db()
+    conn = sqlite3.connect(args.database)
+    rows = conn.execute("SELECT count(*) FROM readings").fetchone()[0]
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    if args.vacuum:
+        print("MAIN: Đang chạy VACUUM...")
+        conn.execute("VACUUM")
+    conn.close()
+    server.db_pool.close_all()
+    after = file_size(args.database)
+    print(f"MAIN: {rows} bản ghi readings, dung lượng {before / 1024:.0f} KiB -> {after / 1024:.0f} KiB.")
+
+
+if __name__ == "__main__":
+    main()
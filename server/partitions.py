@@ -0,0 +1,261 @@
+import re
+from datetime import datetime, timezone
+
+# Dữ liệu thô được chia theo tháng (UTC): readings_pYYYYMM. "readings" là VIEW gộp mọi phân vùng,
+# giữ cho các truy vấn đọc cũ (khôi phục cache, tính lại bảng tổng hợp) vẫn chạy được.
+PARTITION_PREFIX = "readings_p"
+PARTITION_PATTERN = re.compile(r"^readings_p(\d{4})(\d{2})$")
+VALUE_COLUMNS = ("chimVao", "chimRa", "chimTong", "temperature", "humidity", "relay_status")
+# Thời điểm lưu dạng số nguyên epoch mili giây (UTC) trong cột ts; cột timestamp (ISO 8601, UTC)
+# chỉ được tính ra khi đọc để API và dashboard không phải đổi.
+TIMESTAMP_EXPR = "strftime('%Y-%m-%dT%H:%M:%fZ', ts / 1000.0, 'unixepoch')"
+SELECT_COLUMNS = f"house_id, {TIMESTAMP_EXPR} AS timestamp, ts, " + ", ".join(VALUE_COLUMNS)
+# Các cột của một mẫu đo dùng để tính trung bình theo thời gian ở bảng tổng hợp.
+SAMPLE_COLUMNS = "ts, temperature, humidity, relay_status"
+
+
+def parse_timestamp(value):
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+# Chuyển timestamp ISO 8601 (mọi múi giờ) sang epoch mili giây; None nếu không hợp lệ.
+def epoch_ms(timestamp):
+    dt = parse_timestamp(timestamp)
+    if dt is None:
+        return None
+    return int(round(dt.timestamp() * 1000))
+
+
+def partition_for_ms(ts):
+    dt = datetime.fromtimestamp(ts / 1000, timezone.utc)
+    return f"{PARTITION_PREFIX}{dt.year:04d}{dt.month:02d}"
+
+
+def partition_for(timestamp):
+    ts = epoch_ms(timestamp)
+    return None if ts is None else partition_for_ms(ts)
+
+
+# Thời điểm bắt đầu và kết thúc (không bao gồm) của tháng ứng với một phân vùng.
+def partition_bounds(name):
+    match = PARTITION_PATTERN.match(name)
+    year, month = int(match.group(1)), int(match.group(2))
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + (month == 12), month % 12 + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+
+def list_partitions(conn):
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'readings_p%' ORDER BY name"
+    ).fetchall()
+    return [row[0] for row in rows if PARTITION_PATTERN.match(row[0])]
+
+
+# Lệnh DDL và lệnh SELECT không tự mở giao dịch: mở BEGIN IMMEDIATE (giữ khóa ghi) nếu chưa có, để DROP/CREATE VIEW
+# của hai worker cùng tạo phân vùng đầu tháng, hay các mẫu đọc trước khi ghi, không bị worker khác xen vào.
+# Người gọi commit.
+def begin_write(cursor):
+    if not cursor.connection.in_transaction:
+        cursor.execute("BEGIN IMMEDIATE")
+
+
+# Tạo lại VIEW readings sau khi thêm hoặc xóa phân vùng.
+def refresh_readings_view(cursor):
+    begin_write(cursor)
+    partitions = list_partitions(cursor.connection)
+    cursor.execute("DROP VIEW IF EXISTS readings")
+    if partitions:
+        body = " UNION ALL ".join(f"SELECT {SELECT_COLUMNS} FROM {name}" for name in partitions)
+    else:
+        columns = ("house_id", "timestamp", "ts") + VALUE_COLUMNS
+        body = "SELECT " + ", ".join(f"NULL AS {c}" for c in columns) + " WHERE 0"
+    cursor.execute(f"CREATE VIEW IF NOT EXISTS readings AS {body}")
+
+
+# Cột daily_report = 1 đánh dấu dòng của báo cáo hàng ngày (mang timestamp là ngày, không phải một mẫu đo),
+# để bảng tổng hợp bỏ qua; VIEW readings và API không trả cột này.
+# Tạo phân vùng nếu chưa có. Tra sqlite_master (vài chục dòng, luôn nằm trong cache) rẻ hơn nhiều
+# so với lệnh ghi, và luôn đúng kể cả khi worker khác vừa tạo hoặc retention vừa xóa phân vùng.
+def ensure_partition(cursor, name):
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone()
+    if exists:
+        return
+    begin_write(cursor)
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            house_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            chimVao INTEGER,
+            chimRa INTEGER,
+            chimTong INTEGER,
+            temperature REAL,
+            humidity REAL,
+            relay_status INTEGER,
+            daily_report INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (house_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    refresh_readings_view(cursor)
+
+
+# Câu truy vấn một nhà yến từ start_dt, chỉ đọc các phân vùng giao với khoảng thời gian.
+# Mỗi phân vùng được tìm bằng index seek trên khóa chính (house_id, ts).
+def range_query(conn, house_id, start_dt, end_dt=None):
+    partitions = []
+    for name in list_partitions(conn):
+        p_start, p_end = partition_bounds(name)
+        if p_end > start_dt and (end_dt is None or p_start < end_dt):
+            partitions.append(name)
+    if not partitions:
+        return "SELECT * FROM readings WHERE 0", ()
+
+    condition = "house_id = ? AND ts >= ?"
+    params = (house_id, int(start_dt.timestamp() * 1000))
+    if end_dt is not None:
+        condition += " AND ts < ?"
+        params += (int(end_dt.timestamp() * 1000),)
+    # Các phân vùng đã theo thứ tự tháng, mỗi phân vùng sắp theo ts nên không cần sắp xếp lại toàn bộ
+    sql = " UNION ALL ".join(
+        f"SELECT * FROM (SELECT {SELECT_COLUMNS} FROM {name} WHERE {condition} ORDER BY ts)" for name in partitions
+    )
+    return sql, params * len(partitions)
+
+
+# Số dòng thô của một nhà yến từ start_dt, đếm tối đa limit dòng (đủ để so với một ngưỡng mà không quét cả tháng).
+def count_rows(conn, house_id, start_dt, limit):
+    query, params = range_query(conn, house_id, start_dt)
+    return conn.execute(f"SELECT count(*) FROM ({query} LIMIT ?)", params + (limit,)).fetchone()[0]
+
+
+def _samples(conn, table, condition, params, order="ASC", limit=""):
+    return conn.execute(f"SELECT {SAMPLE_COLUMNS} FROM {table} WHERE house_id = ? AND {condition} "
+                        f"AND daily_report = 0 ORDER BY ts {order}{limit}", params)
+
+
+# Các mẫu đo (ts, temperature, humidity, relay_status) quanh khoảng [lo_ms, hi_ms] của một nhà yến:
+# (mẫu ngay trước lo_ms hoặc None, các mẫu trong khoảng, ts của mẫu ngay sau hi_ms hoặc None).
+# Mỗi lần tra là một lần tìm theo khóa chính trong một phân vùng; partitions: kết quả list_partitions.
+def read_samples(conn, house_id, lo_ms, hi_ms, partitions=None):
+    if partitions is None:
+        partitions = list_partitions(conn)
+    first = partition_for_ms(lo_ms)
+    previous = None
+    for name in reversed([name for name in partitions if name <= first]):
+        row = _samples(conn, name, "ts < ?", (house_id, lo_ms), "DESC", " LIMIT 1").fetchone()
+        if row is not None:
+            previous = tuple(row)
+            break
+    # Đọc tiếp từ lo_ms theo thứ tự ts, dừng ở mẫu đầu tiên sau hi_ms
+    stored = []
+    for name in partitions:
+        if name < first:
+            continue
+        for row in _samples(conn, name, "ts >= ?", (house_id, lo_ms)):
+            if row[0] > hi_ms:
+                return previous, stored, row[0]
+            stored.append(tuple(row))
+    return previous, stored, None
+
+
+# Xóa các phân vùng mà toàn bộ tháng đã cũ hơn mốc cắt; trả về danh sách phân vùng đã xóa.
+def drop_expired_partitions(conn, cutoff_dt):
+    dropped = []
+    cursor = conn.cursor()
+    for name in list_partitions(conn):
+        _, p_end = partition_bounds(name)
+        if p_end <= cutoff_dt:
+            begin_write(cursor)
+            cursor.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    if dropped:
+        refresh_readings_view(cursor)
+        conn.commit()
+    return dropped
+
+
+# Chuyển dữ liệu từ một bảng readings dạng cũ (timestamp dạng chuỗi) sang các phân vùng theo tháng.
+def migrate_table_to_partitions(conn, table, upsert_sql_for, chunk_size=10000):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    house_expr = "house_id" if "house_id" in columns else "'default'"
+    source = conn.cursor()
+    source.execute(f"SELECT {house_expr}, timestamp, chimVao, chimRa, chimTong, temperature, humidity, relay_status "
+                   f"FROM {table} ORDER BY rowid")
+    cursor = conn.cursor()
+    moved = skipped = 0
+    touched = set()
+    while True:
+        chunk = source.fetchmany(chunk_size)
+        if not chunk:
+            break
+        grouped = {}
+        for row in chunk:
+            ts = epoch_ms(row[1])
+            if ts is None:
+                skipped += 1
+                continue
+            grouped.setdefault(partition_for_ms(ts), []).append((row[0], ts) + tuple(row[2:]) + (0,))
+        for name, rows in grouped.items():
+            ensure_partition(cursor, name)
+            cursor.executemany(upsert_sql_for(name), rows)
+            moved += len(rows)
+            touched.add(name)
+    for name in touched:
+        _flag_legacy_daily_reports(cursor, name)
+    cursor.execute(f"DROP TABLE {table}")
+    refresh_readings_view(cursor)
+    conn.commit()
+    return moved, skipped
+
+
+# Phân vùng tạo trước khi có lược đồ epoch (cột timestamp dạng chuỗi, có rowid) cần được chuyển đổi.
+def text_partitions(conn):
+    return [name for name in list_partitions(conn)
+            if "timestamp" in [row[1] for row in conn.execute(f"PRAGMA table_info({name})")]]
+
+
+# Chuyển các phân vùng dạng chuỗi sang lược đồ epoch mili giây, WITHOUT ROWID, khóa (house_id, ts).
+def migrate_text_partitions(conn, upsert_sql_for):
+    names = text_partitions(conn)
+    if not names:
+        return 0, 0
+    # Đổi tên hết trước: VIEW readings được tạo lại sau mỗi phân vùng và chỉ hiểu lược đồ mới
+    conn.execute("DROP VIEW IF EXISTS readings")
+    for name in names:
+        conn.execute(f"ALTER TABLE {name} RENAME TO {name}_text")
+    moved = skipped = 0
+    for name in names:
+        part_moved, part_skipped = migrate_table_to_partitions(conn, f"{name}_text", upsert_sql_for)
+        moved += part_moved
+        skipped += part_skipped
+    return moved, skipped
+
+
+# Dữ liệu ghi trước khi có cột daily_report không mang dấu hiệu báo cáo hàng ngày; chỉ với dữ liệu cũ này mới
+# suy ra từ timestamp: dòng lúc 0h UTC đúng ngày đã có trong daily_reports.
+def _flag_legacy_daily_reports(cursor, name):
+    cursor.execute(f'''
+        UPDATE {name} SET daily_report = 1
+        WHERE ts % 86400000 = 0 AND EXISTS (
+            SELECT 1 FROM daily_reports d WHERE d.house_id = {name}.house_id AND d.date = date(ts / 1000, 'unixepoch'))
+    ''')
+
+
+# Thêm cột daily_report vào các phân vùng tạo trước khi có cột này; trả về danh sách phân vùng đã thêm.
+def add_daily_report_flags(conn):
+    added = []
+    cursor = conn.cursor()
+    for name in list_partitions(conn):
+        if "daily_report" not in [row[1] for row in conn.execute(f"PRAGMA table_info({name})")]:
+            begin_write(cursor)
+            cursor.execute(f"ALTER TABLE {name} ADD COLUMN daily_report INTEGER NOT NULL DEFAULT 0")
+            _flag_legacy_daily_reports(cursor, name)
+            added.append(name)
+    conn.commit()
+    return added
@@ -0,0 +1,75 @@
+import json
+
+from flask import Response, jsonify, request
+
+# Số dòng lấy từ cursor mỗi lần khi trả JSON dạng stream.
+STREAM_CHUNK_ROWS = 500
+RESPONSE_FORMATS = ("rows", "columns")
+
+
+# Chuyển danh sách dòng thành dạng cột {"timestamp": [...], "temperature": [...]} để không lặp lại khóa.
+def rows_to_columns(names, rows):
+    if not rows:
+        return {name: [] for name in names}
+    return dict(zip(names, map(list, zip(*rows))))
+
+
+def cursor_columns(cursor):
+    return [column[0] for column in cursor.description]
+
+
+# Sinh JSON mảng các đối tượng theo từng khối dòng; kết nối được trả về pool khi stream kết thúc.
+def _stream_rows(conn, cursor):
+    names = cursor_columns(cursor)
+    try:
+        yield '['
+        separator = ''
+        while True:
+            chunk = cursor.fetchmany(STREAM_CHUNK_ROWS)
+            if not chunk:
+                break
+            yield separator + ','.join(json.dumps(dict(zip(names, row))) for row in chunk)
+            separator = ','
+        yield ']'
+    finally:
+        conn.close()
+
+
+# Tạo response cho kết quả truy vấn: stream từng dòng, dạng cột, hoặc danh sách đối tượng như trước.
+def query_response(conn, cursor, response_format="rows", stream=False, transform=None):
+    names = cursor_columns(cursor)
+    if stream and response_format == "rows" and transform is None:
+        return Response(_stream_rows(conn, cursor), mimetype='application/json')
+
+    rows = cursor.fetchall()
+    conn.close()
+    return rows_response(names, rows, response_format, transform)
+
+
+# Response cho các dòng đã có sẵn (kết quả truy vấn hoặc bộ nhớ đệm), cùng định dạng với query_response.
+def rows_response(names, rows, response_format="rows", transform=None):
+    if transform is not None:
+        dict_rows = transform([dict(zip(names, row)) for row in rows])
+        if response_format == "columns":
+            return jsonify({name: [row.get(name) for row in dict_rows] for name in names})
+        return jsonify(dict_rows)
+    if response_format == "columns":
+        return jsonify(rows_to_columns(names, rows))
+    return jsonify([dict(zip(names, row)) for row in rows])
+
+
+# Trả 304 nếu client đã có bản mới nhất (If-None-Match / If-Modified-Since), ngược lại trả None.
+def not_modified_response(etag, last_modified):
+    response = Response(status=200)
+    set_validators(response, etag, last_modified)
+    response.make_conditional(request)
+    return response if response.status_code == 304 else None
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Luôn hỏi lại server, nhưng có thể nhận 304 thay vì tải lại toàn bộ dữ liệu
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,154 @@
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from metrics import registry
+from partitions import drop_expired_partitions
+
+# Chính sách giữ dữ liệu cho một bảng.
+#   column: cột thời gian so sánh với mốc cắt; days: số ngày giữ (None = giữ vĩnh viễn)
+#   key: biểu thức khóa để xóa theo từng khối; date_only: cột chỉ lưu ngày (YYYY-MM-DD)
+#   partitioned: bảng chia phân vùng theo tháng, hết hạn thì xóa nguyên phân vùng
+RetentionPolicy = namedtuple("RetentionPolicy", "table column days key date_only partitioned", defaults=(False,))
+
+
+def create_retention_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            task TEXT PRIMARY KEY,
+            last_run REAL NOT NULL
+        )
+    ''')
+
+
+# Bật auto_vacuum=INCREMENTAL. Với DB mới chỉ cần pragma; DB cũ phải VACUUM một lần để đổi chế độ.
+def enable_incremental_vacuum(conn):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is not None:
+            print("SERVER: Đang chuyển DB sang auto_vacuum=INCREMENTAL (VACUUM một lần)...")
+        conn.execute("VACUUM")
+
+
+def retention_cutoff(policy, now):
+    cutoff = now - timedelta(days=policy.days)
+    return cutoff.strftime('%Y-%m-%d') if policy.date_only else cutoff.isoformat()
+
+
+class RetentionScheduler:
+    """
+    Xóa dữ liệu hết hạn ở luồng nền thay vì trong request /api/update.
+    Mỗi lượt xóa theo từng khối chunk_size dòng, commit và nghỉ giữa các khối để không giữ khóa ghi lâu,
+    sau đó chạy incremental_vacuum để trả trang trống về hệ điều hành. Khi chạy nhiều worker,
+    bảng maintenance_runs bảo đảm mỗi chu kỳ chỉ một worker thực hiện.
+    """
+
+    def __init__(self, connect, policies, interval=600, chunk_size=2000, pause=0.05, vacuum_pages=2000):
+        self._connect = connect
+        self.policies = list(policies)
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.last_report = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                conn = self._connect()
+                try:
+                    if self._claim(conn):
+                        self.run_once(conn)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"SERVER: Lỗi khi dọn dữ liệu cũ: {e}")
+            time.sleep(self.interval)
+
+    # Giành lượt chạy của chu kỳ hiện tại (chỉ một worker thành công).
+    def _claim(self, conn):
+        now = time.time()
+        conn.execute("INSERT OR IGNORE INTO maintenance_runs (task, last_run) VALUES ('retention', 0)")
+        cursor = conn.execute(
+            "UPDATE maintenance_runs SET last_run = ? WHERE task = 'retention' AND last_run <= ?",
+            (now, now - self.interval * 0.9)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+
+    def _delete_expired(self, conn, policy, cutoff):
+        deleted = 0
+        sql = (f"DELETE FROM {policy.table} WHERE ({policy.key}) IN "
+               f"(SELECT {policy.key} FROM {policy.table} WHERE {policy.column} < ? LIMIT ?)")
+        while True:
+            cursor = conn.execute(sql, (cutoff, self.chunk_size))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.chunk_size:
+                return deleted
+            time.sleep(self.pause)
+
+    def _incremental_vacuum(self, conn):
+        freed = 0
+        while True:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages == 0:
+                return freed
+            # executescript chạy pragma đến hết; execute() chỉ bước một lần nên mỗi lần chỉ giải phóng một trang
+            conn.executescript(f"PRAGMA incremental_vacuum({min(free_pages, self.vacuum_pages)});")
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free_pages:
+                return freed
+            freed += free_pages - remaining
+            time.sleep(self.pause)
+
+    # Chạy một lượt dọn dữ liệu và trả về báo cáo: số dòng đã xóa mỗi bảng, số trang giải phóng, thời gian.
+    def run_once(self, conn):
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        deleted = {}
+        dropped_partitions = []
+        for policy in self.policies:
+            if policy.days is None:
+                continue
+            if policy.partitioned:
+                # Chỉ xóa phân vùng khi cả tháng đã hết hạn: một lệnh DROP thay vì hàng triệu lệnh DELETE
+                dropped_partitions += drop_expired_partitions(conn, now - timedelta(days=policy.days))
+                continue
+            deleted[policy.table] = self._delete_expired(conn, policy, retention_cutoff(policy, now))
+        vacuum_started = time.monotonic()
+        freed_pages = self._incremental_vacuum(conn)
+        report = {
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "deleted": deleted,
+            "dropped_partitions": dropped_partitions,
+            "freed_pages": freed_pages,
+            "delete_seconds": round(vacuum_started - started, 3),
+            "vacuum_seconds": round(time.monotonic() - vacuum_started, 3),
+            "duration_seconds": round(time.monotonic() - started, 3),
+        }
+        self.last_report = report
+        registry.inc("swiftlet_retention_runs_total")
+        registry.set("swiftlet_retention_last_duration_seconds", report["duration_seconds"])
+        for table, count in deleted.items():
+            registry.inc("swiftlet_retention_deleted_rows_total", count, table=table)
+        total = sum(deleted.values())
+        if dropped_partitions:
+            print(f"SERVER: Đã xóa các phân vùng hết hạn: {', '.join(dropped_partitions)}.")
+        if total or freed_pages:
+            details = ", ".join(f"{table}: {count}" for table, count in deleted.items() if count)
+            print(f"SERVER: Đã xóa {total} bản ghi cũ ({details}), giải phóng {freed_pages} trang "
+                  f"trong {report['duration_seconds']}s.")
+        return report
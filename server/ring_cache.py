@@ -0,0 +1,310 @@
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from itertools import repeat
+
+from metrics import registry
+from partitions import VALUE_COLUMNS, epoch_ms, range_query
+from rollup import AUTO_MAX_POINTS, COUNTERS, MAX_HOLD_SECONDS, ROLLUPS, counter_delta, rollup_rows_sql
+
+# Số giờ gần nhất giữ trong bộ nhớ cho mỗi nhà yến: đủ cho range=day (từ 0h UTC) cộng dư.
+RING_HOURS = 26
+# Mỗi lần làm mới đọc lại cả RING_REREAD_SECONDS giây cuối và thay vào bộ nhớ, để bắt các dòng
+# do worker khác ghi lệch thứ tự vài giây hoặc ghi đè cùng ts.
+RING_REREAD_SECONDS = 300
+# Dòng trễ hơn thế (ví dụ outbox của thiết bị gửi bù sau khi mất mạng, báo cáo hàng ngày mang
+# timestamp 0h) chỉ hiện ra ở lần đọc lại toàn bộ cửa sổ, tối đa sau RING_RELOAD_INTERVAL giây.
+RING_RELOAD_INTERVAL = 600
+# Độ phân giải trả được từ bộ nhớ ("auto" chọn theo số dòng đang giữ, như choose_resolution)
+RING_RESOLUTIONS = ("raw", "1m", "auto")
+
+RAW_NAMES = ("house_id", "timestamp", "ts") + VALUE_COLUMNS
+# Kiểu array cho từng cột theo kiểu cột trong phân vùng. Cột REAL lưu NULL là NaN (SQLite không lưu được NaN),
+# cột INTEGER cần thêm một bytearray đánh dấu NULL.
+RAW_TYPECODES = {"chimVao": "q", "chimRa": "q", "chimTong": "q", "temperature": "d", "humidity": "d", "relay_status": "q"}
+ROLLUP_NAMES = (("house_id", "timestamp", "samples",
+                 "temperature", "temperature_min", "temperature_max",
+                 "humidity", "humidity_min", "humidity_max", "relay_status")
+                + COUNTERS + tuple(f"{name}_delta" for name in COUNTERS))
+ROLLUP_SQL = rollup_rows_sql(ROLLUPS["1m"][0]) + " ORDER BY bucket ASC"
+
+
+def _ratio(numerator, denominator):
+    return None if not denominator else numerator / denominator
+
+
+def _bucket(ms):
+    return datetime.fromtimestamp(ms // 60000 * 60, timezone.utc).isoformat()
+
+
+# Giống TIMESTAMP_EXPR của partitions: epoch mili giây -> "YYYY-MM-DDTHH:MM:SS.sssZ".
+def _timestamp(ms):
+    seconds, millis = divmod(ms, 1000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + f".{millis:03d}Z"
+
+
+# Giá trị như SQLite lưu vào cột: cột INTEGER đổi số thực nguyên (3.0) thành 3.
+def _stored(value, typecode):
+    if typecode == "q" and isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# Trung bình theo thời gian, hoặc theo số mẫu nếu chưa mẫu nào biết thời gian hiệu lực (như rollup_query).
+def _mean(weighted, duration, total, count):
+    return weighted / duration if duration else _ratio(total, count)
+
+
+# Một dòng readings_1m -> dòng kết quả giống rollup_query("1m").
+def _rollup_row(row):
+    firsts = [row[f"{name}_first"] for name in COUNTERS]
+    lasts = [row[f"{name}_last"] for name in COUNTERS]
+    deltas = [counter_delta(first, last, row[f"{name}_prev"]) for first, last, name in zip(firsts, lasts, COUNTERS)]
+    return (row["house_id"], row["bucket"], row["samples"],
+            _mean(row["temp_wsum"], row["temp_ms"], row["temp_sum"], row["temp_n"]),
+            row["temp_min"], row["temp_max"],
+            _mean(row["hum_wsum"], row["hum_ms"], row["hum_sum"], row["hum_n"]),
+            row["hum_min"], row["hum_max"],
+            _mean(float(row["relay_on_ms"]), row["relay_ms"], float(row["relay_on"]), row["relay_n"])
+            ) + tuple(lasts) + tuple(deltas)
+
+
+class _HouseRing:
+    """
+    Dữ liệu gần nhất của một nhà yến. Dữ liệu thô lưu theo cột: ts và mỗi cột giá trị là một array
+    (khoảng 60 byte mỗi dòng thay vì một tuple đối tượng Python); bảng tổng hợp 1 phút (tối đa
+    RING_HOURS * 60 dòng) giữ sẵn ở dạng trả về API. Bỏ dữ liệu cũ chỉ tăng chỉ số đầu (head),
+    phần đã bỏ được cắt khỏi mảng khi chiếm quá nửa, nên chi phí cắt chia đều cho các lần thêm.
+    """
+
+    def __init__(self, house_id):
+        self.house_id = house_id
+        self.lock = threading.Lock()
+        self.version = None
+        self.loaded_at = 0.0
+        self.start_ms = None
+        # False nếu có giá trị không phải số (SQLite không ép kiểu chặt): đọc thẳng từ DB tới lần nạp lại sau
+        self.cacheable = True
+        self.head = 0
+        self.ts = array("q")
+        self.values = {name: array(RAW_TYPECODES[name]) for name in VALUE_COLUMNS}
+        self.nulls = {name: bytearray() for name in VALUE_COLUMNS if RAW_TYPECODES[name] == "q"}
+        self.rollup_head = 0
+        self.buckets = []
+        self.rollup = []
+        # Các bucket 1 phút từ mốc này (ms) đã đổi do ghi cục bộ, đọc lại ở truy vấn 1m kế tiếp
+        self.rollup_stale_ms = None
+
+    def _raw_buffers(self):
+        return [self.ts, *self.values.values(), *self.nulls.values()]
+
+    def clear(self, start_ms):
+        for buffer in self._raw_buffers():
+            del buffer[:]
+        del self.buckets[:]
+        del self.rollup[:]
+        self.head = self.rollup_head = 0
+        self.start_ms = start_ms
+        self.cacheable = True
+        self.rollup_stale_ms = None
+
+    # Thay các dòng có ts >= from_ms bằng rows (đã sắp theo ts, đều có ts >= from_ms).
+    def merge_raw(self, from_ms, rows):
+        keep = bisect_left(self.ts, from_ms, self.head)
+        for buffer in self._raw_buffers():
+            del buffer[keep:]
+        try:
+            for row in rows:
+                for name, typecode in RAW_TYPECODES.items():
+                    value = row[name]
+                    if typecode == "d":
+                        self.values[name].append(math.nan if value is None else value)
+                    else:
+                        self.values[name].append(0 if value is None else value)
+                        self.nulls[name].append(value is None)
+                self.ts.append(row["ts"])
+        except TypeError:
+            self.clear(self.start_ms)
+            self.cacheable = False
+
+    # Thêm các bản ghi vừa ghi (dict như payload, đủ trường) mà không đọc DB; bản ghi cùng ts thay dòng cũ,
+    # bản ghi trễ được trộn vào đúng chỗ. Bucket 1 phút không tính lại ở đây mà đánh dấu để đọc lại: thời gian
+    # hiệu lực của các mẫu trong MAX_HOLD_SECONDS trước bản ghi sớm nhất cũng đổi.
+    def append(self, readings):
+        rows = {}
+        for data in readings:
+            ts = epoch_ms(data["timestamp"])
+            if ts >= self.start_ms:
+                rows[ts] = dict({name: _stored(data.get(name), RAW_TYPECODES[name]) for name in VALUE_COLUMNS}, ts=ts)
+        if not rows:
+            return
+        from_ms = min(rows)
+        if self.ts and self.ts[-1] >= from_ms:
+            for row in self.raw_rows(from_ms):
+                rows.setdefault(row[2], dict(zip(RAW_NAMES, row)))
+        self.merge_raw(from_ms, [rows[ts] for ts in sorted(rows)])
+        stale = from_ms - MAX_HOLD_SECONDS * 1000
+        self.rollup_stale_ms = stale if self.rollup_stale_ms is None else min(self.rollup_stale_ms, stale)
+
+    # Thay các bucket từ bucket đầu tiên của rows trở đi (bucket cuối trong bộ nhớ có thể chưa đủ mẫu).
+    def merge_rollup(self, rows):
+        if not rows:
+            return
+        keep = bisect_left(self.buckets, rows[0]["bucket"], self.rollup_head)
+        del self.buckets[keep:]
+        del self.rollup[keep:]
+        for row in rows:
+            self.buckets.append(row["bucket"])
+            self.rollup.append(_rollup_row(row))
+
+    # Bỏ dữ liệu cũ hơn start_ms ở đầu các mảng.
+    def trim(self, start_ms):
+        self.head = bisect_left(self.ts, start_ms, self.head)
+        if self.head > len(self.ts) // 2:
+            for buffer in self._raw_buffers():
+                del buffer[:self.head]
+            self.head = 0
+        self.rollup_head = bisect_left(self.buckets, _bucket(start_ms), self.rollup_head)
+        if self.rollup_head > len(self.buckets) // 2:
+            del self.buckets[:self.rollup_head]
+            del self.rollup[:self.rollup_head]
+            self.rollup_head = 0
+        self.start_ms = max(self.start_ms, start_ms)
+
+    def raw_count(self, start_ms):
+        return len(self.ts) - bisect_left(self.ts, start_ms, self.head)
+
+    def rollup_count(self, start_bucket):
+        return len(self.buckets) - bisect_left(self.buckets, start_bucket, self.rollup_head)
+
+    def raw_rows(self, start_ms):
+        lo = bisect_left(self.ts, start_ms, self.head)
+        ts = self.ts[lo:]
+        columns = []
+        for name, typecode in RAW_TYPECODES.items():
+            values = self.values[name][lo:]
+            if typecode == "d":
+                columns.append([None if math.isnan(value) else value for value in values])
+            else:
+                columns.append([None if null else value for value, null in zip(values, self.nulls[name][lo:])])
+        return list(zip(repeat(self.house_id), map(_timestamp, ts), ts, *columns))
+
+    def rollup_rows(self, start_bucket):
+        return self.rollup[bisect_left(self.buckets, start_bucket, self.rollup_head):]
+
+
+class RingCache:
+    """
+    Giữ RING_HOURS giờ dữ liệu gần nhất của từng nhà yến trong bộ nhớ để trả /api/historical_data
+    (dữ liệu thô và tổng hợp 1 phút) mà không đọc lại cả ngày từ SQLite.
+    Bộ nhớ đồng bộ theo phiên bản dữ liệu của nhà (house_versions, vốn đã đọc để tính ETag):
+    Dữ liệu do chính worker ghi được nối vào bộ nhớ ngay sau commit (append) cùng phiên bản mới;
+    phiên bản khác bộ nhớ nghĩa là worker khác đã ghi, khi đó chỉ đọc lại RING_REREAD_SECONDS giây cuối.
+    Mỗi nhà có khóa riêng: một nhà đang đọc DB không chặn truy vấn của nhà khác.
+    """
+
+    def __init__(self, hours=RING_HOURS, reload_interval=RING_RELOAD_INTERVAL):
+        self.hours = hours
+        self.reload_interval = reload_interval
+        self._houses = {}
+        self._lock = threading.Lock()
+
+    def _window_start_ms(self):
+        return int((datetime.now(timezone.utc) - timedelta(hours=self.hours)).timestamp() * 1000)
+
+    def _ring(self, house_id):
+        with self._lock:
+            ring = self._houses.get(house_id)
+            if ring is None:
+                ring = self._houses[house_id] = _HouseRing(house_id)
+            return ring
+
+    # Đọc dữ liệu thô và tổng hợp 1 phút từ from_ms trở đi, thay phần tương ứng trong bộ nhớ.
+    def _read_from(self, conn, ring, from_ms):
+        query, params = range_query(conn, ring.house_id, datetime.fromtimestamp(from_ms / 1000, timezone.utc))
+        ring.merge_raw(from_ms, [row for row in conn.execute(query, params).fetchall() if row["ts"] >= from_ms])
+        if ring.rollup_stale_ms is not None:
+            from_ms = min(from_ms, ring.rollup_stale_ms)
+        self._read_rollup(conn, ring, from_ms)
+
+    def _read_rollup(self, conn, ring, from_ms):
+        ring.merge_rollup(conn.execute(ROLLUP_SQL, {"house_id": ring.house_id, "start": _bucket(from_ms)}).fetchall())
+        ring.rollup_stale_ms = None
+
+    def _load(self, conn, ring, start_ms):
+        ring.clear(start_ms)
+        self._read_from(conn, ring, start_ms)
+        ring.loaded_at = time.monotonic()
+
+    # Đọc lại phần cuối (thường chỉ vài chục dòng) để lấy các dòng vừa ghi.
+    def _refresh(self, conn, ring):
+        from_ms = ring.start_ms
+        if ring.ts:
+            from_ms = max(from_ms, ring.ts[-1] - RING_REREAD_SECONDS * 1000)
+        self._read_from(conn, ring, from_ms)
+        ring.trim(self._window_start_ms())
+
+    # Gọi khi đang giữ ring.lock.
+    def _sync(self, conn, ring, version):
+        if ring.version == version and ring.version is not None:
+            return
+        if ring.version is None or time.monotonic() - ring.loaded_at >= self.reload_interval:
+            self._load(conn, ring, self._window_start_ms())
+        elif ring.cacheable:
+            self._refresh(conn, ring)
+        ring.version = version
+        registry.inc("swiftlet_ring_cache_refreshes_total")
+
+    # Nối các bản ghi worker này vừa commit (written: kết quả của write_readings). Chỉ nối khi bộ nhớ đang ở
+    # đúng phiên bản ngay trước lần ghi; nếu worker khác đã ghi xen vào thì để truy vấn sau đọc lại theo phiên bản.
+    def append(self, written):
+        for house_id, (version, readings) in written.items():
+            with self._lock:
+                ring = self._houses.get(house_id)
+            if ring is None:
+                continue
+            with ring.lock:
+                if ring.version is None or ring.version != version - 1 or not ring.cacheable:
+                    continue
+                ring.append(readings)
+                ring.version = version
+                ring.trim(self._window_start_ms())
+            registry.inc("swiftlet_ring_cache_appends_total")
+
+    # Nạp sẵn các nhà yến (lúc khởi động). versions: dict house_id -> phiên bản dữ liệu.
+    def warm(self, conn, versions):
+        for house_id, version in versions.items():
+            ring = self._ring(house_id)
+            with ring.lock:
+                self._sync(conn, ring, version)
+
+    # (tên cột, các dòng) cho truy vấn lịch sử từ start_dt, hoặc None nếu bộ nhớ không phủ được khoảng này.
+    # resolution="auto" chọn như choose_resolution nhưng đếm trong bộ nhớ; None nếu cần độ phân giải thô hơn 1m.
+    def query(self, conn, house_id, version, start_dt, resolution):
+        if resolution not in RING_RESOLUTIONS:
+            return None
+        start_ms = int(start_dt.timestamp() * 1000)
+        if start_ms < self._window_start_ms():
+            return None
+        ring = self._ring(house_id)
+        with ring.lock:
+            self._sync(conn, ring, version)
+            if not ring.cacheable or start_ms < ring.start_ms:
+                return None
+            auto = resolution == "auto"
+            if auto:
+                resolution = "raw" if ring.raw_count(start_ms) <= AUTO_MAX_POINTS else "1m"
+            if resolution == "1m":
+                if ring.rollup_stale_ms is not None:
+                    self._read_rollup(conn, ring, ring.rollup_stale_ms)
+                if auto and ring.rollup_count(start_dt.isoformat()) > AUTO_MAX_POINTS:
+                    return None
+            if resolution == "raw":
+                result = RAW_NAMES, ring.raw_rows(start_ms)
+            else:
+                result = ROLLUP_NAMES, ring.rollup_rows(start_dt.isoformat())
+        registry.inc("swiftlet_ring_cache_hits_total")
+        return result
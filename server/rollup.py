@@ -0,0 +1,358 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from partitions import (SELECT_COLUMNS, begin_write, count_rows, epoch_ms, list_partitions, parse_timestamp,
+                        partition_for_ms, read_samples)
+
+# Các bảng tổng hợp sẵn: tên độ phân giải -> (tên bảng, độ dài bucket tính bằng giây)
+ROLLUPS = {
+    "1m": ("readings_1m", 60),
+    "1h": ("readings_1h", 3600),
+    "1d": ("readings_1d", 86400),
+}
+RESOLUTIONS = ("raw",) + tuple(ROLLUPS)
+
+# Số điểm tối đa mong muốn khi server tự chọn độ phân giải.
+AUTO_MAX_POINTS = 1500
+
+# Thiết bị ở DELTA_MODE chỉ gửi khi có thay đổi nên các mẫu cách nhau không đều: trung bình nhiệt độ, độ ẩm
+# và tỉ lệ bật relay trong bucket được tính theo thời gian hiệu lực của mỗi mẫu (đến mẫu kế tiếp của nhà yến,
+# cắt ở cuối bucket của mẫu). Một mẫu giữ tối đa MAX_HOLD_SECONDS (heartbeat 300 giây cộng vòng lặp lúc rảnh
+# tối đa 300 giây); khoảng trống dài hơn coi như thiết bị mất kết nối.
+MAX_HOLD_SECONDS = 600
+
+COUNTERS = ("chimVao", "chimRa", "chimTong")
+
+# Tổng giá trị x thời gian (ms) và tổng thời gian hiệu lực (ms) của các mẫu trong bucket.
+WEIGHT_COLUMNS = ("temp_wsum", "temp_ms", "hum_wsum", "hum_ms", "relay_on_ms", "relay_ms")
+ROLLUP_COLUMNS = (
+    "house_id", "bucket", "samples",
+    "temp_min", "temp_max", "temp_sum", "temp_n",
+    "hum_min", "hum_max", "hum_sum", "hum_n",
+    "relay_on", "relay_n",
+    "first_ts", "last_ts",
+    "chimVao_first", "chimRa_first", "chimTong_first",
+    "chimVao_last", "chimRa_last", "chimTong_last",
+) + WEIGHT_COLUMNS
+
+
+def create_rollup_tables(cursor):
+    for table, _ in ROLLUPS.values():
+        columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        if columns and "temp_ms" not in columns:
+            # Bảng tạo trước khi có trung bình theo thời gian: xóa để init_db tính lại từ readings
+            cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                house_id TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                samples INTEGER NOT NULL,
+                temp_min REAL, temp_max REAL, temp_sum REAL, temp_n INTEGER NOT NULL,
+                hum_min REAL, hum_max REAL, hum_sum REAL, hum_n INTEGER NOT NULL,
+                relay_on INTEGER NOT NULL, relay_n INTEGER NOT NULL,
+                first_ts TEXT NOT NULL, last_ts TEXT NOT NULL,
+                chimVao_first INTEGER, chimRa_first INTEGER, chimTong_first INTEGER,
+                chimVao_last INTEGER, chimRa_last INTEGER, chimTong_last INTEGER,
+                temp_wsum REAL NOT NULL DEFAULT 0, temp_ms INTEGER NOT NULL DEFAULT 0,
+                hum_wsum REAL NOT NULL DEFAULT 0, hum_ms INTEGER NOT NULL DEFAULT 0,
+                relay_on_ms INTEGER NOT NULL DEFAULT 0, relay_ms INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (house_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+
+def _upsert_sql(table):
+    placeholders = ", ".join("?" * len(ROLLUP_COLUMNS))
+    # min/max bỏ qua NULL; first/last lấy theo thời điểm nên dữ liệu gửi bù (không theo thứ tự) vẫn đúng
+    keep_min = "min(coalesce({c}, excluded.{c}), coalesce(excluded.{c}, {c}))"
+    keep_max = "max(coalesce({c}, excluded.{c}), coalesce(excluded.{c}, {c}))"
+    updates = ["samples = samples + excluded.samples"]
+    for prefix in ("temp", "hum"):
+        updates += [
+            f"{prefix}_min = " + keep_min.format(c=f"{prefix}_min"),
+            f"{prefix}_max = " + keep_max.format(c=f"{prefix}_max"),
+            f"{prefix}_sum = coalesce({prefix}_sum, 0) + coalesce(excluded.{prefix}_sum, 0)",
+            f"{prefix}_n = {prefix}_n + excluded.{prefix}_n",
+        ]
+    updates += ["relay_on = relay_on + excluded.relay_on", "relay_n = relay_n + excluded.relay_n"]
+    updates += [f"{c} = {c} + excluded.{c}" for c in WEIGHT_COLUMNS]
+    for name in COUNTERS:
+        updates.append(f"{name}_first = CASE WHEN excluded.first_ts <= first_ts THEN excluded.{name}_first ELSE {name}_first END")
+        updates.append(f"{name}_last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.{name}_last ELSE {name}_last END")
+    # first_ts/last_ts cập nhật sau cùng; mọi biểu thức SET đều đọc giá trị cũ của dòng
+    updates += ["first_ts = min(first_ts, excluded.first_ts)", "last_ts = max(last_ts, excluded.last_ts)"]
+    return (f"INSERT INTO {table} ({', '.join(ROLLUP_COLUMNS)}) VALUES ({placeholders}) "
+            f"ON CONFLICT(house_id, bucket) DO UPDATE SET " + ",\n".join(updates))
+
+
+UPSERT_ROLLUP_SQL = {resolution: _upsert_sql(table) for resolution, (table, _) in ROLLUPS.items()}
+ADD_WEIGHTS_SQL = {
+    resolution: (f"UPDATE {table} SET " + ", ".join(f"{c} = {c} + ?" for c in WEIGHT_COLUMNS)
+                 + " WHERE house_id = ? AND bucket = ?")
+    for resolution, (table, _) in ROLLUPS.items()
+}
+
+
+@lru_cache(maxsize=4096)
+def bucket_start(epoch_seconds, seconds):
+    start = int(epoch_seconds) - int(epoch_seconds) % seconds
+    return datetime.fromtimestamp(start, timezone.utc).isoformat()
+
+
+def _present(value):
+    return 0 if value is None else 1
+
+
+# Chuyển một bản ghi thành các giá trị (trừ house_id, bucket) của một dòng tổng hợp gồm một mẫu.
+# old: mẫu (ts, temperature, humidity, relay_status) đã lưu cùng ts mà bản ghi này ghi đè (ví dụ outbox gửi lại
+# một lô khi mất phản hồi): khi đó chỉ cộng phần chênh lệch vào số mẫu và các tổng.
+def _sample_values(data, ts_utc, old=None):
+    temperature = data.get("temperature")
+    humidity = data.get("humidity")
+    relay = data.get("relay_status")
+    counters = tuple(data.get(name) for name in COUNTERS)
+    if old is None:
+        counts = (1, temperature, _present(temperature), humidity, _present(humidity),
+                  1 if relay else 0, _present(relay))
+    else:
+        _, old_temperature, old_humidity, old_relay = old
+        counts = (0,
+                  (temperature or 0) - (old_temperature or 0), _present(temperature) - _present(old_temperature),
+                  (humidity or 0) - (old_humidity or 0), _present(humidity) - _present(old_humidity),
+                  (1 if relay else 0) - (1 if old_relay else 0), _present(relay) - _present(old_relay))
+    samples, temp_sum, temp_n, hum_sum, hum_n, relay_on, relay_n = counts
+    return (
+        samples,
+        temperature, temperature, temp_sum, temp_n,
+        humidity, humidity, hum_sum, hum_n,
+        relay_on, relay_n,
+        ts_utc, ts_utc,
+    ) + counters + counters
+
+
+# Cộng sign x thời gian hiệu lực của mẫu (ts, temperature, humidity, relay_status) vào bucket của mẫu ở mọi
+# độ phân giải; next_ts là ts của mẫu kế tiếp (None: chưa biết, mẫu chưa được tính thời gian).
+def _add_weights(totals, house_id, sample, next_ts, sign):
+    if next_ts is None:
+        return
+    ts, temperature, humidity, relay = sample
+    for resolution, (_, seconds) in ROLLUPS.items():
+        start = ts - ts % (seconds * 1000)
+        held = sign * (min(next_ts, ts + MAX_HOLD_SECONDS * 1000, start + seconds * 1000) - ts)
+        weights = totals.setdefault((resolution, house_id, bucket_start(start // 1000, seconds)), [0.0, 0, 0.0, 0, 0, 0])
+        if temperature is not None:
+            weights[0] += temperature * held
+            weights[1] += held
+        if humidity is not None:
+            weights[2] += humidity * held
+            weights[3] += held
+        if relay is not None:
+            weights[4] += held if relay else 0
+            weights[5] += held
+
+
+# Thời gian hiệu lực của một dãy mẫu liên tiếp (đã sắp theo ts); mẫu cuối có hiệu lực đến next_ts.
+def _add_sequence(totals, house_id, samples, next_ts, sign=1):
+    for i, sample in enumerate(samples):
+        _add_weights(totals, house_id, sample, samples[i + 1][0] if i + 1 < len(samples) else next_ts, sign)
+
+
+# Ghi các dòng một mẫu (rows: độ phân giải -> danh sách dòng) cùng thời gian hiệu lực đã tính (totals).
+# Thời gian hiệu lực của bucket có mẫu mới đi kèm dòng đầu tiên của bucket đó trong lệnh upsert;
+# phần còn lại (bucket chỉ có mẫu cũ) cộng bằng UPDATE.
+def _write_rollups(cursor, rows, totals):
+    zero = (0.0, 0, 0.0, 0, 0, 0)
+    for resolution, resolution_rows in rows.items():
+        if resolution_rows:
+            cursor.executemany(UPSERT_ROLLUP_SQL[resolution], [
+                row + tuple(totals.pop((resolution, row[0], row[1]), zero)) for row in resolution_rows])
+    params = {resolution: [] for resolution in ROLLUPS}
+    for (resolution, house_id, bucket), weights in totals.items():
+        if any(weights):
+            params[resolution].append(tuple(weights) + (house_id, bucket))
+    for resolution, resolution_params in params.items():
+        if resolution_params:
+            cursor.executemany(ADD_WEIGHTS_SQL[resolution], resolution_params)
+
+
+# Các bản ghi là mẫu đo theo nhà yến: house_id -> {ts: (bản ghi, timestamp UTC)}. Cùng (house_id, ts) thì
+# bản sau thắng, giống lệnh upsert vào phân vùng.
+def _readings_by_house(house_readings):
+    readings = {}
+    for house_id, data in house_readings:
+        # Báo cáo hàng ngày mang timestamp là ngày, không phải một mẫu đo
+        if data.get("daily_report") is True:
+            continue
+        dt = parse_timestamp(data.get("timestamp"))
+        if dt is None:
+            continue
+        readings.setdefault(house_id, {})[epoch_ms(data["timestamp"])] = (data, dt.astimezone(timezone.utc).isoformat())
+    return readings
+
+
+def _sample(ts, data):
+    return ts, data.get("temperature"), data.get("humidity"), data.get("relay_status")
+
+
+# Thêm các dòng một mẫu (chưa có thời gian hiệu lực) của một nhà yến vào rows (độ phân giải -> danh sách dòng);
+# existing: ts -> mẫu đã lưu mà bản ghi cùng ts sẽ ghi đè.
+def _add_rows(rows, house_id, readings, existing):
+    for ts, (data, ts_utc) in readings.items():
+        values = _sample_values(data, ts_utc, existing.get(ts))
+        for resolution, (_, seconds) in ROLLUPS.items():
+            rows[resolution].append((house_id, bucket_start(ts // 1000, seconds)) + values)
+
+
+# Cập nhật các bảng tổng hợp cho một loạt bản ghi sắp ghi vào readings (gọi trước khi ghi dữ liệu thô).
+# Thời gian hiệu lực được tính lại cho đoạn dữ liệu bị chèn vào: bỏ phần của các mẫu đã lưu trong đoạn đó
+# (và mẫu ngay trước, vì mẫu kế tiếp của nó đổi) rồi cộng phần của dãy mẫu mới, nên dữ liệu gửi bù
+# không theo thứ tự vẫn đúng. Bản ghi trùng (house_id, ts) với mẫu đã lưu thay mẫu đó chứ không cộng thêm.
+# Giữ khóa ghi từ lúc đọc để worker khác không chen dòng vào giữa.
+# Trả về các mẫu (house_id, ts) bị ghi đè bằng nhiệt độ/độ ẩm khác: min/max của bucket chứa chúng không thể
+# trừ ra nên người gọi phải gọi refresh_extremes sau khi ghi dữ liệu thô.
+def update_rollups(cursor, house_readings):
+    readings = _readings_by_house(house_readings)
+    begin_write(cursor)
+    rows = {resolution: [] for resolution in ROLLUPS}
+    totals = {}
+    changed = []
+    partitions = list_partitions(cursor.connection) if readings else []
+    for house_id, house_batch in readings.items():
+        previous, stored, next_ts = read_samples(cursor.connection, house_id, min(house_batch), max(house_batch),
+                                                 partitions)
+        merged = {sample[0]: sample for sample in stored}
+        _add_rows(rows, house_id, house_batch, merged)
+        for ts, (data, _) in house_batch.items():
+            sample = _sample(ts, data)
+            if ts in merged and merged[ts][1:3] != sample[1:3]:
+                changed.append((house_id, ts))
+            merged[ts] = sample
+        head = [previous] if previous else []
+        _add_sequence(totals, house_id, head + stored, next_ts, -1)
+        _add_sequence(totals, house_id, head + [merged[ts] for ts in sorted(merged)], next_ts)
+    _write_rollups(cursor, rows, totals)
+    return changed
+
+
+REFRESH_EXTREMES_SQL = {
+    resolution: f"UPDATE {table} SET temp_min = ?, temp_max = ?, hum_min = ?, hum_max = ? WHERE house_id = ? AND bucket = ?"
+    for resolution, (table, _) in ROLLUPS.items()
+}
+
+
+# Tính lại min/max của các bucket chứa mẫu bị ghi đè (changed: kết quả của update_rollups) từ dữ liệu thô đã ghi.
+# Bucket dài nhất là một ngày UTC nên luôn nằm trọn trong một phân vùng tháng.
+def refresh_extremes(cursor, changed):
+    buckets = set()
+    for house_id, ts in changed:
+        for resolution, (_, seconds) in ROLLUPS.items():
+            buckets.add((resolution, house_id, ts - ts % (seconds * 1000), seconds * 1000))
+    for resolution, house_id, start, length in buckets:
+        extremes = cursor.execute(
+            f"SELECT min(temperature), max(temperature), min(humidity), max(humidity) FROM {partition_for_ms(start)} "
+            "WHERE house_id = ? AND ts >= ? AND ts < ? AND daily_report = 0", (house_id, start, start + length)).fetchone()
+        cursor.execute(REFRESH_EXTREMES_SQL[resolution],
+                       tuple(extremes) + (house_id, bucket_start(start // 1000, length // 1000)))
+
+
+# Các mẫu đo đã lưu (bỏ dòng báo cáo hàng ngày) theo thứ tự ts, từng khối chunk_size dòng.
+# Các phân vùng theo thứ tự tháng nên đọc lần lượt từng phân vùng là đã đúng thứ tự.
+def _sample_chunks(conn, chunk_size):
+    for name in list_partitions(conn):
+        source = conn.cursor()
+        source.execute(f"SELECT {SELECT_COLUMNS} FROM {name} WHERE daily_report = 0 ORDER BY ts")
+        while True:
+            chunk = source.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+# Tính lại toàn bộ bảng tổng hợp từ readings (dùng khi nâng cấp một DB đã có dữ liệu).
+def rebuild_rollups(conn, chunk_size=10000):
+    cursor = conn.cursor()
+    for table, _ in ROLLUPS.values():
+        cursor.execute(f"DELETE FROM {table}")
+    total = 0
+    # Mẫu cuối cùng đã gặp của mỗi nhà yến, chờ mẫu kế tiếp để biết thời gian hiệu lực
+    last = {}
+    for chunk in _sample_chunks(conn, chunk_size):
+        rows = {resolution: [] for resolution in ROLLUPS}
+        totals = {}
+        for house_id, house_batch in _readings_by_house([(row["house_id"], dict(row)) for row in chunk]).items():
+            _add_rows(rows, house_id, house_batch, {})
+            sequence = [_sample(ts, house_batch[ts][0]) for ts in sorted(house_batch)]
+            if house_id in last:
+                sequence.insert(0, last[house_id])
+            _add_sequence(totals, house_id, sequence, None)
+            last[house_id] = sequence[-1]
+        _write_rollups(cursor, rows, totals)
+        total += len(chunk)
+    conn.commit()
+    return total
+
+
+# Chọn độ phân giải mịn nhất mà số dòng thực có trong DB từ start_dt không quá AUTO_MAX_POINTS.
+# Mỗi lần đếm dừng ở AUTO_MAX_POINTS + 1 dòng nên chi phí không phụ thuộc độ dài khoảng thời gian.
+def choose_resolution(conn, house_id, start_dt):
+    limit = AUTO_MAX_POINTS + 1
+    if count_rows(conn, house_id, start_dt, limit) <= AUTO_MAX_POINTS:
+        return "raw"
+    for resolution, (table, _) in ROLLUPS.items():
+        count = conn.execute(f"SELECT count(*) FROM (SELECT 1 FROM {table} WHERE house_id = ? AND bucket >= ? LIMIT ?)",
+                             (house_id, start_dt.isoformat(), limit)).fetchone()[0]
+        if count <= AUTO_MAX_POINTS:
+            return resolution
+    return "1d"
+
+
+# Mức thay đổi bộ đếm trong bucket tính từ giá trị cuối của bucket trước ({c}_prev), để tổng các bucket bằng
+# mức thay đổi thật. Bộ đếm giảm nghĩa là đã reset về 0 (đầu ngày) nên phần đếm sau reset chính là giá trị mới;
+# bucket đầu tiên của nhà yến chỉ tính từ mẫu đầu tiên của nó.
+COUNTER_DELTA_SQL = (
+    "CASE WHEN {c}_first IS NULL OR {c}_last IS NULL THEN NULL ELSE "
+    "(CASE WHEN {c}_prev IS NULL THEN 0 WHEN {c}_first >= {c}_prev THEN {c}_first - {c}_prev ELSE {c}_first END)"
+    " + (CASE WHEN {c}_last >= {c}_first THEN {c}_last - {c}_first ELSE {c}_last END) END"
+)
+
+
+# Giống COUNTER_DELTA_SQL, cho bộ nhớ đệm.
+def counter_delta(first, last, prev):
+    if first is None or last is None:
+        return None
+    before = 0 if prev is None else (first - prev if first >= prev else first)
+    return before + (last - first if last >= first else last)
+
+
+# Các dòng của bảng tổng hợp từ :start của nhà yến :house_id, kèm {name}_prev là giá trị cuối của bucket liền trước
+# (kể cả bucket ngay trước :start).
+def rollup_rows_sql(table):
+    prevs = ", ".join(f"LAG({name}_last) OVER (ORDER BY bucket) AS {name}_prev" for name in COUNTERS)
+    return f'''
+        SELECT * FROM (
+            SELECT *, {prevs} FROM {table}
+            WHERE house_id = :house_id AND bucket >= coalesce(
+                (SELECT max(bucket) FROM {table} WHERE house_id = :house_id AND bucket < :start), :start)
+        ) WHERE bucket >= :start
+    '''
+
+
+# Câu truy vấn (tham số :house_id, :start) trả về các cột cùng tên với readings để dashboard dùng lại được,
+# kèm min/max, mức thay đổi bộ đếm trong bucket và tỉ lệ thời gian bật relay. Trung bình theo thời gian;
+# bucket chưa có mẫu nào biết thời gian hiệu lực (bucket mới nhất) dùng trung bình theo số mẫu.
+def rollup_query(resolution):
+    table, _ = ROLLUPS[resolution]
+    deltas = ", ".join(f"{COUNTER_DELTA_SQL.format(c=name)} AS {name}_delta" for name in COUNTERS)
+    lasts = ", ".join(f"{name}_last AS {name}" for name in COUNTERS)
+    return f'''
+        SELECT house_id, bucket AS timestamp, samples,
+               coalesce(temp_wsum / NULLIF(temp_ms, 0), temp_sum / NULLIF(temp_n, 0)) AS temperature,
+               temp_min AS temperature_min, temp_max AS temperature_max,
+               coalesce(hum_wsum / NULLIF(hum_ms, 0), hum_sum / NULLIF(hum_n, 0)) AS humidity,
+               hum_min AS humidity_min, hum_max AS humidity_max,
+               coalesce(CAST(relay_on_ms AS REAL) / NULLIF(relay_ms, 0),
+                        CAST(relay_on AS REAL) / NULLIF(relay_n, 0)) AS relay_status,
+               {lasts}, {deltas}
+        FROM ({rollup_rows_sql(table)})
+        ORDER BY bucket ASC
+    '''
@@ -0,0 +1,13 @@
+# Điểm vào production, chạy nhiều worker:  gunicorn -c gunicorn.conf.py wsgi:app
+# (app.run(debug=True) trong server.py chỉ dùng khi phát triển.)
+import server
+
+# Mỗi worker là một tiến trình riêng: latest_data được đồng bộ qua bảng latest_readings trong DB.
+server.LATEST_SYNC_ENABLED = True
+server.init_db()
+server.load_latest_data_from_db()
+server.warm_ring_cache()
+# Không mang kết nối SQLite đã mở qua fork sang các worker
+server.db_pool.close_all()
+
+app = server.app
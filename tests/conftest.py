@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Module của server và client được import theo tên như khi chạy trong thư mục của chúng (tên không trùng nhau)
+for directory in ("server", "client"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+import server  # noqa: E402
+from db import connect  # noqa: E402
+
+
+# Kết nối tới một DB mới trong thư mục tạm, đã tạo bảng bằng init_db như khi server khởi động.
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "DATABASE_FILE", str(tmp_path / "test.db"))
+    server.init_db()
+    conn = connect(server.DATABASE_FILE)
+    yield conn
+    conn.close()
@@ -0,0 +1,47 @@
+from event_matcher import EventMatcher
+
+
+def matcher():
+    return EventMatcher(num_sensors=6, max_interval=0.34, near_simultaneous=0.2)
+
+
+def test_direction_follows_which_sensor_of_the_pair_fires_first():
+    # Cảm biến chẵn (phía ngoài) báo trước: chim bay vào; cảm biến lẻ trước: bay ra
+    assert matcher().match([(0, 10.0), (1, 10.3)], None) == ["in"]
+    assert matcher().match([(1, 10.0), (0, 10.3)], None) == ["out"]
+    assert matcher().match([(4, 10.0), (5, 10.25)], "morning") == ["in"]
+
+
+def test_near_simultaneous_events_use_the_flight_phase():
+    events = [(2, 10.0), (3, 10.1)]
+    assert matcher().match(events, "morning") == ["out"]
+    assert matcher().match(events, "evening") == ["in"]
+    # Ngoài khung giờ bay thì không đoán: cả hai sự kiện vẫn chờ
+    m = matcher()
+    assert m.match(events, None) == []
+    assert [list(p) for p in m.pending] == [[], [], [10.0], [10.1], [], []]
+
+
+def test_events_older_than_max_interval_are_dropped():
+    m = matcher()
+    assert m.match([(0, 10.0), (1, 10.5)], None) == []
+    assert [list(p) for p in m.pending] == [[], [10.5], [], [], [], []]
+
+
+def test_only_neighbouring_pairs_are_matched():
+    # Cặp 0-1 và cặp 4-5 cách nhau hai cặp: không ghép; cặp kề bên (0 và 3) thì ghép được
+    assert matcher().match([(0, 10.0), (5, 10.3)], None) == []
+    assert matcher().match([(0, 10.0), (3, 10.3)], None) == ["in"]
+
+
+def test_oldest_pending_event_is_matched_first():
+    m = matcher()
+    assert m.add(0, 10.0, None) is None
+    assert m.add(0, 10.1, None) is None
+    assert m.add(1, 10.3, None) == "in"
+    assert [list(p) for p in m.pending] == [[10.1], [], [], [], [], []]
+
+
+def test_match_sorts_events_and_counts_every_crossing():
+    events = [(1, 11.3), (0, 10.0), (3, 11.0), (1, 10.3), (2, 11.3)]
+    assert matcher().match(events, None) == ["in", "out"]
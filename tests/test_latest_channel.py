@@ -0,0 +1,56 @@
+import pickle
+import struct
+
+import pytest
+
+import latest_channel
+from latest_channel import HEADER, climate_channel, counter_channel
+
+
+@pytest.fixture
+def channel():
+    channel = climate_channel()
+    yield channel
+    channel.close()
+    channel.unlink()
+
+
+def test_read_before_first_publish(channel):
+    assert channel.read() == (0, None)
+
+
+def test_publish_bumps_version_and_round_trips_none(channel):
+    channel.publish({"temperature": 28.5, "humidity": None, "relay_status": 1})
+    assert channel.read() == (1, {"temperature": 28.5, "humidity": None, "relay_status": 1})
+    channel.publish({"temperature": None, "humidity": 80.0, "relay_status": None})
+    # Trường nguyên không có NaN: None được ghi thành 0
+    assert channel.read() == (2, {"temperature": None, "humidity": 80.0, "relay_status": 0})
+
+
+def test_reader_skips_write_in_progress(channel, monkeypatch):
+    monkeypatch.setattr(latest_channel, "READ_RETRIES", 3)
+    channel.publish({"temperature": 30.0, "humidity": 70.0, "relay_status": 0})
+    seq = HEADER.unpack_from(channel.shm.buf, 0)[0]
+    # seq lẻ: người ghi đang ghi dở, không được trả về dữ liệu
+    struct.pack_into("<Q", channel.shm.buf, 0, seq + 1)
+    assert channel.read() == (0, None)
+
+
+def test_reader_rejects_torn_payload_by_crc(channel, monkeypatch):
+    monkeypatch.setattr(latest_channel, "READ_RETRIES", 3)
+    channel.publish({"temperature": 30.0, "humidity": 70.0, "relay_status": 0})
+    # seq chẵn nhưng dữ liệu đã đổi sau khi tính CRC (thứ tự ghi bộ nhớ bị đảo trên ARM)
+    channel.shm.buf[HEADER.size] ^= 0xFF
+    assert channel.read() == (0, None)
+
+
+def test_child_process_attaches_to_the_same_memory():
+    writer = counter_channel()
+    try:
+        reader = pickle.loads(pickle.dumps(writer))
+        writer.publish({"chimVao": 12, "chimRa": 5, "chimTong": 7})
+        assert reader.read() == (1, {"chimVao": 12, "chimRa": 5, "chimTong": 7})
+        reader.close()
+    finally:
+        writer.close()
+        writer.unlink()
@@ -0,0 +1,105 @@
+import gzip
+import json
+
+import pytest
+import requests
+
+import send_to_server
+from outbox import Outbox
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    yield outbox
+    outbox.close()
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None, text=None):
+        self.status_code = status_code
+        self.text = json.dumps(body) if text is None else text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession:
+    """Thay session của send_to_server: ghi lại các lô đã gửi và trả lần lượt các phản hồi cho trước."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.batches = []
+
+    def post(self, url, data, timeout, headers):
+        if headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        self.batches.append(json.loads(data))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_outbox_returns_oldest_first_and_keeps_unacked_rows(tmp_path, outbox):
+    for i in range(5):
+        outbox.add({"i": i})
+    batch = outbox.next_batch(3)
+    assert [payload["i"] for _, payload in batch] == [0, 1, 2]
+    outbox.ack([row_id for row_id, _ in batch])
+    assert outbox.pending() == 2
+    outbox.close()
+    # Mở lại (khởi động lại thiết bị): các bản ghi chưa gửi vẫn còn
+    reopened = Outbox(str(tmp_path / "outbox.db"))
+    assert reopened.pending() == 2
+    assert [payload["i"] for _, payload in reopened.next_batch(10)] == [3, 4]
+    reopened.close()
+
+
+def test_outbox_trims_oldest_live_rows_but_keeps_daily_reports(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"), max_rows=4)
+    outbox.add({"i": 0, "daily_report": True})
+    for i in range(1, 7):
+        outbox.add({"i": i})
+    assert outbox.pending() == 4
+    assert [payload["i"] for _, payload in outbox.next_batch(10)] == [0, 4, 5, 6]
+    outbox.close()
+
+
+def test_backoff_doubles_from_send_interval_up_to_the_limit():
+    backoff, waits = 0, []
+    for _ in range(12):
+        backoff = send_to_server.next_backoff(backoff)
+        waits.append(backoff)
+    assert waits[:3] == [send_to_server.SEND_INTERVAL, 2 * send_to_server.SEND_INTERVAL,
+                         4 * send_to_server.SEND_INTERVAL]
+    assert waits == sorted(waits) and waits[-1] == send_to_server.BACKOFF_MAX
+
+
+def test_upload_sends_in_batches_and_drops_rejected_rows(outbox, monkeypatch):
+    monkeypatch.setattr(send_to_server, "BATCH_SIZE", 3)
+    session = FakeSession(FakeResponse(body={"rejected": [{"index": 1, "error": "timestamp"}]}),
+                          FakeResponse(body={"rejected": []}))
+    monkeypatch.setattr(send_to_server, "session", session)
+    for i in range(5):
+        outbox.add({"i": i})
+    assert send_to_server.upload_outbox(outbox) is True
+    assert [[p["i"] for p in batch] for batch in session.batches] == [[0, 1, 2], [3, 4]]
+    # Bản ghi bị từ chối không gửi lại được nữa nên cũng bị xóa
+    assert outbox.pending() == 0
+
+
+@pytest.mark.parametrize("response", [
+    requests.exceptions.ConnectionError("mất mạng"),
+    FakeResponse(500, text="Internal Server Error"),
+    FakeResponse(text="<html>proxy</html>"),
+    FakeResponse(body={"rejected": [{"index": 7, "error": "x"}]}),
+    FakeResponse(body=["không phải object"]),
+])
+def test_failed_upload_keeps_rows_for_the_next_attempt(outbox, monkeypatch, response):
+    monkeypatch.setattr(send_to_server, "session", FakeSession(response))
+    monkeypatch.setitem(send_to_server.upload_stats, "upload_failures_total", 0)
+    outbox.add({"i": 0})
+    assert send_to_server.upload_outbox(outbox) is False
+    assert outbox.pending() == 1
+    assert send_to_server.upload_stats["upload_failures_total"] == 1
@@ -0,0 +1,66 @@
+from datetime import datetime, timezone
+
+from ingest import write_readings
+from partitions import drop_expired_partitions, list_partitions, partition_for, range_query
+
+
+def reading(timestamp, chim_vao=0, house_id="a"):
+    return {"house_id": house_id, "timestamp": timestamp, "chimVao": chim_vao}
+
+
+def view_timestamps(conn):
+    return [row["timestamp"] for row in conn.execute("SELECT timestamp FROM readings ORDER BY ts")]
+
+
+def test_partition_follows_utc_month():
+    assert partition_for("2026-09-30T23:59:59.999Z") == "readings_p202609"
+    assert partition_for("2026-10-01T00:00:00Z") == "readings_p202610"
+    # Giờ địa phương GMT+7: 0h ngày 1 vẫn thuộc tháng trước theo UTC
+    assert partition_for("2026-10-01T06:59:00+07:00") == "readings_p202609"
+    assert partition_for("không phải thời gian") is None
+
+
+def test_readings_are_routed_to_monthly_partitions(conn):
+    write_readings(conn, [reading("2026-12-05T10:00:00Z", 3), reading("2026-09-30T23:59:59Z", 1),
+                          reading("2026-10-01T00:00:00Z", 2)])
+    conn.commit()
+    assert list_partitions(conn) == ["readings_p202609", "readings_p202610", "readings_p202612"]
+    counts = {name: conn.execute(f"SELECT count(*) FROM {name}").fetchone()[0] for name in list_partitions(conn)}
+    assert counts == {"readings_p202609": 1, "readings_p202610": 1, "readings_p202612": 1}
+    # VIEW readings gộp mọi phân vùng, kể cả phân vùng vừa tạo trong lần ghi này
+    assert view_timestamps(conn) == ["2026-09-30T23:59:59.000Z", "2026-10-01T00:00:00.000Z", "2026-12-05T10:00:00.000Z"]
+
+
+def test_same_timestamp_overwrites_within_partition(conn):
+    write_readings(conn, [reading("2026-10-02T08:00:00Z", 1)])
+    write_readings(conn, [reading("2026-10-02T15:00:00+07:00", 5)])
+    conn.commit()
+    rows = conn.execute("SELECT chimVao FROM readings_p202610").fetchall()
+    assert [row[0] for row in rows] == [5]
+
+
+def test_view_is_rebuilt_after_dropping_partitions(conn):
+    write_readings(conn, [reading("2026-08-15T00:00:00Z"), reading("2026-09-15T00:00:00Z"),
+                          reading("2026-10-15T00:00:00Z")])
+    conn.commit()
+    # Phân vùng chỉ bị xóa khi cả tháng đã cũ hơn mốc cắt
+    dropped = drop_expired_partitions(conn, datetime(2026, 10, 1, tzinfo=timezone.utc))
+    assert dropped == ["readings_p202608", "readings_p202609"]
+    assert view_timestamps(conn) == ["2026-10-15T00:00:00.000Z"]
+    assert drop_expired_partitions(conn, datetime(2027, 1, 1, tzinfo=timezone.utc)) == ["readings_p202610"]
+    # Không còn phân vùng nào: VIEW vẫn truy vấn được, chỉ rỗng
+    assert view_timestamps(conn) == []
+    write_readings(conn, [reading("2026-11-01T00:00:00Z")])
+    conn.commit()
+    assert view_timestamps(conn) == ["2026-11-01T00:00:00.000Z"]
+
+
+def test_range_query_reads_only_overlapping_partitions(conn):
+    write_readings(conn, [reading(f"2026-{month:02d}-10T00:00:00Z", month) for month in (8, 9, 10, 11)]
+                   + [reading("2026-09-20T00:00:00Z", 99, house_id="b")])
+    conn.commit()
+    query, params = range_query(conn, "a", datetime(2026, 9, 5, tzinfo=timezone.utc),
+                                datetime(2026, 10, 20, tzinfo=timezone.utc))
+    assert "readings_p202609" in query and "readings_p202610" in query
+    assert "readings_p202608" not in query and "readings_p202611" not in query
+    assert [row["chimVao"] for row in conn.execute(query, params)] == [9, 10]
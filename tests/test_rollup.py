@@ -0,0 +1,111 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from ingest import write_readings
+from rollup import ROLLUPS, rebuild_rollups, rollup_query
+
+# Bắt đầu ngay trước đầu tháng để dữ liệu nằm ở hai phân vùng
+START = datetime(2026, 9, 30, 22, 0, tzinfo=timezone.utc)
+
+
+# Bản ghi cách nhau không đều như thiết bị ở DELTA_MODE (dưới một giây đến quá MAX_HOLD_SECONDS),
+# thiếu trường ngẫu nhiên, cùng một báo cáo hàng ngày mang timestamp là ngày.
+def make_readings(count, seed=7):
+    rng = random.Random(seed)
+    readings = []
+    t = START
+    for i in range(count):
+        t += timedelta(seconds=rng.choice([0.4, 3, 10, 10, 45, 200, 900]), milliseconds=rng.randint(0, 999))
+        reading = {"house_id": rng.choice("ab"), "timestamp": t.isoformat(), "chimVao": i}
+        if rng.random() < 0.9:
+            reading["temperature"] = round(rng.uniform(20, 35), 2)
+        if rng.random() < 0.9:
+            reading["humidity"] = round(rng.uniform(60, 95), 2)
+        if rng.random() < 0.9:
+            reading["relay_status"] = rng.randint(0, 1)
+        readings.append(reading)
+    readings.append({"house_id": "a", "timestamp": "2026-10-01", "daily_report": True, "temperature": 99,
+                     "chimVaoDaily": 1, "chimRaDaily": 2, "chimTongDaily": 3})
+    return readings
+
+
+def write_batches(conn, readings, rng):
+    i = 0
+    while i < len(readings):
+        size = rng.choice([1, 1, 5, 50])
+        write_readings(conn, readings[i:i + size])
+        conn.commit()
+        i += size
+
+
+def dump(conn):
+    return {resolution: [tuple(row) for row in conn.execute(f"SELECT * FROM {table} ORDER BY house_id, bucket")]
+            for resolution, (table, _) in ROLLUPS.items()}
+
+
+# So hai lần dump; số thực (tổng giá trị x thời gian) so với sai số do thứ tự cộng khác nhau.
+def assert_same_rollups(actual, expected):
+    for resolution, rows in expected.items():
+        assert len(actual[resolution]) == len(rows), resolution
+        for got, want in zip(actual[resolution], rows):
+            for x, y in zip(got, want):
+                if isinstance(x, float) or isinstance(y, float):
+                    assert abs((x or 0) - (y or 0)) <= 1e-6 * max(1, abs(y or 0)), (resolution, got[:2])
+                else:
+                    assert x == y, (resolution, got[:2])
+
+
+def test_incremental_rollups_match_rebuild_for_out_of_order_batches(conn):
+    readings = make_readings(1500)
+    rng = random.Random(1)
+    rng.shuffle(readings)
+    write_batches(conn, readings, rng)
+    incremental = dump(conn)
+    rebuild_rollups(conn)
+    assert_same_rollups(incremental, dump(conn))
+
+
+def test_resent_readings_replace_stored_samples(conn):
+    readings = make_readings(800)
+    rng = random.Random(2)
+    write_batches(conn, readings, rng)
+    samples = [r for r in readings if not r.get("daily_report")]
+    # Outbox gửi lại lô khi mất phản hồi: bản ghi trùng, có khi đã đổi giá trị, có khi trùng ngay trong một lô
+    for reading in rng.sample(samples, 200):
+        resent = dict(reading)
+        if rng.random() < 0.5:
+            resent["temperature"] = rng.choice([None, 50.0, 1.0])
+        if rng.random() < 0.3:
+            resent["relay_status"] = 1 - (resent.get("relay_status") or 0)
+        batch = [resent] if rng.random() < 0.7 else [dict(resent, humidity=10.0), resent]
+        write_readings(conn, batch)
+        conn.commit()
+    incremental = dump(conn)
+    assert sum(row[2] for row in incremental["1d"]) == len(samples)
+    rebuild_rollups(conn)
+    assert_same_rollups(incremental, dump(conn))
+
+
+def counter_deltas(conn, start):
+    rows = conn.execute(rollup_query("1m"), {"house_id": "a", "start": start.isoformat()}).fetchall()
+    return [row["chimVao_delta"] for row in rows]
+
+
+def test_counter_deltas_include_changes_between_buckets(conn):
+    # Bộ đếm tăng 1 mỗi 20 giây: mức tăng giữa mẫu cuối của bucket trước và mẫu đầu của bucket sau
+    # cũng phải được tính, nên tổng delta bằng giá trị cuối trừ giá trị đầu
+    write_readings(conn, [{"house_id": "a", "timestamp": (START + timedelta(seconds=20 * i)).isoformat(), "chimVao": i}
+                          for i in range(30)])
+    conn.commit()
+    assert counter_deltas(conn, START) == [2] + [3] * 9
+    # Bucket đầu của khoảng truy vấn lấy giá trị cuối của bucket ngay trước đó
+    assert sum(counter_deltas(conn, START + timedelta(minutes=4))) == 29 - 11
+
+
+def test_counter_delta_treats_a_drop_as_reset(conn):
+    values = [5, 6, 7, 0, 1, 2]
+    write_readings(conn, [{"house_id": "a", "timestamp": (START + timedelta(seconds=30 * i)).isoformat(), "chimVao": v}
+                          for i, v in enumerate(values)])
+    conn.commit()
+    # Đặt lại về 0 lúc 0h giữa hai bucket: tính từ 0 chứ không ra số âm
+    assert counter_deltas(conn, START) == [1, 1, 2]